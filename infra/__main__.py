@@ -32,6 +32,8 @@ openai_project = config.require("OPENAI_PROJECT")
 assistant_id = config.require("ASSISTANT_ID")
 client_port = config.require("CLIENT_PORT")
 phoenix_collector_endpoint = config.require("PHOENIX_COLLECTOR_ENDPOINT")
+# "rabbitmq" or "redis" (Redis Streams); the workers read the same setting
+transport = config.get("TRANSPORT") or "rabbitmq"
 
 # Retrieve sensitive environment variables
 aws_access_key_id = config.require_secret("AWS_ACCESS_KEY_ID")
@@ -46,6 +48,8 @@ hume_api_key = config.require_secret("HUME_API_KEY")
 arize_api_key = config.require_secret("ARIZE_API_KEY")
 otel_exporter_otlp_headers = config.require_secret("OTEL_EXPORTER_OTLP_HEADERS")
 phoenix_client_headers = config.require_secret("PHOENIX_CLIENT_HEADERS")
+# Redis as reached from the audio Lambda (REDIS_HOST is only resolvable on the VM)
+stream_redis_url = config.require_secret("STREAM_REDIS_URL") if transport == "redis" else ""
 
 with open('.env', 'r') as f:
     env_content = f.read()
@@ -71,6 +75,7 @@ GOOGLE_CLIENT_SECRET={google_client_secret}
 GOOGLE_REDIRECT_URI={google_redirect_uri}
 CLOUDAMQP_API_KEY={cloudamqp_api_key}
 ENV={env}
+TRANSPORT={transport}
 RABBITMQ_URI={rabbitmq_uri}
 FIRST_QUEUE={first_queue}
 SECOND_QUEUE={second_queue}
@@ -362,12 +367,21 @@ pika_layer = lambda_.LayerVersion("PikaLayer",
     description="Lambda Layer with pika library",
 )
 
+# Built by ./layers/redis/build.sh, only needed for the Redis Streams transport
+redis_layer = lambda_.LayerVersion("RedisLayer",
+    compatible_runtimes=["python3.9"],
+    code=pulumi.FileArchive("./layers/redis/lambda_layer_redis.zip"),
+    layer_name="RedisLayer",
+    description="Lambda Layer with redis library",
+) if transport == "redis" else None
+
 # =========================
 # 5a. Lambda PDF->Slides Code
 # =========================
 lambda_code_pdf = """
 import boto3
 import os
+import time
 import subprocess
 import logging
 import tempfile
@@ -431,6 +445,8 @@ def handler(event, context):
                         s3_client.upload_file(image_path, bucket_name, image_key, ExtraArgs={'ContentDisposition': 'inline', 'ContentType': 'image/png'})
                         logger.info(f"Uploaded {image_file} to {image_key}")
 
+            prewarm(user_id, presentation_id)
+
         logger.info("PDF processing completed successfully.")
         s3_client.put_object(Bucket=bucket_name, Key=completed_status_key, Body=b'')
         return {
@@ -451,6 +467,23 @@ def handler(event, context):
             'statusCode': 500,
             'body': f'Error processing PDF: {str(e)}'
         }
+
+def prewarm(user_id, presentation_id):
+    # Have worker1 create the presentation's thread and Redis state now, so the
+    # first clip doesn't wait on it. Best effort: the first clip does it otherwise.
+    message = {'type': 'prewarm', 'userID': user_id, 'presentationID': presentation_id}
+    headers = {
+        'traceparent': f"00-{os.urandom(16).hex()}-{os.urandom(8).hex()}-01",
+        'x-published-at': time.time(),
+    }
+    try:
+        if os.environ.get('TRANSPORT') == 'redis':
+            publish_to_redis_stream(message, 1, headers)
+        else:
+            publish_to_rabbitmq(message, 1, headers)
+        logger.info(f"Requested prewarm of {presentation_id}")
+    except Exception as e:
+        logger.warning(f"Could not request prewarm of {presentation_id}: {e}")
 """
 
 # =========================
@@ -461,9 +494,8 @@ import boto3
 import os
 import logging
 from urllib.parse import unquote_plus
-import pika  # RabbitMQ client library
 import json
-import ssl
+import time
 
 # Initialize AWS clients
 s3_client = boto3.client('s3')
@@ -527,10 +559,26 @@ def handler(event, context):
                 'videoURL': http_prefix + video_url
             }
 
-            # Publish the message to RabbitMQ
-            publish_to_rabbitmq(message)
+            # Final clips (including single-clip reviews) go in the high priority lane;
+            # values mirror packages/workers/scheduler.py
+            priority = 5 if is_end == 'true' else 1
+
+            # Start the clip's trace here (W3C traceparent, the workers continue it);
+            # x-published-at lets worker1 report how long the message queued
+            trace_id = os.urandom(16).hex()
+            headers = {
+                'traceparent': f"00-{trace_id}-{os.urandom(8).hex()}-01",
+                'x-published-at': time.time(),
+            }
+            logger.info(f"trace_id={trace_id}")
+
+            # Publish the message to the first queue
+            if os.environ.get('TRANSPORT') == 'redis':
+                publish_to_redis_stream(message, priority, headers)
+            else:
+                publish_to_rabbitmq(message, priority, headers)
 
-            logger.info(f"Published message to RabbitMQ: {message}")
+            logger.info(f"Published message to {os.environ.get('TRANSPORT', 'rabbitmq')}: {message}")
 
         return {
             'statusCode': 200,
@@ -543,8 +591,17 @@ def handler(event, context):
             'statusCode': 500,
             'body': f'Error processing audio file: {str(e)}'
         }
+"""
+
+
+# Shared by both Lambdas, appended to their code
+lambda_code_publish = """
+import os
+import ssl
+import json
+import pika  # RabbitMQ client library
 
-def publish_to_rabbitmq(message):
+def publish_to_rabbitmq(message, priority, headers):
 
     # RabbitMQ connection parameters from environment variables
     rabbitmq_host = os.environ.get('RABBITMQ_HOST')
@@ -568,8 +625,9 @@ def publish_to_rabbitmq(message):
     connection = pika.BlockingConnection(parameters)
     channel = connection.channel()
 
-    # Declare the queue (if it doesn't exist)
-    channel.queue_declare(queue=rabbitmq_queue, durable=True)
+    # The queue and its retry topology are declared by create_queues.py;
+    # a passive declare just checks it exists without fighting over arguments
+    channel.queue_declare(queue=rabbitmq_queue, passive=True)
 
     # Publish the message
     channel.basic_publish(
@@ -578,11 +636,27 @@ def publish_to_rabbitmq(message):
         body=json.dumps(message),
         properties=pika.BasicProperties(
             delivery_mode=2,  # Make message persistent
+            priority=priority,
+            headers=headers,
         )
     )
 
     # Close the connection
     connection.close()
+
+def publish_to_redis_stream(message, priority, headers):
+    # The redis layer is only attached when TRANSPORT=redis
+    import redis
+
+    client = redis.Redis.from_url(os.environ.get('STREAM_REDIS_URL'))
+    # Same fields packages/workers/transport.py publishes
+    client.xadd(os.environ.get('RABBITMQ_QUEUE'), {
+        'body': json.dumps(message),
+        'priority': priority,
+        'retries': 0,
+        'headers': json.dumps(headers),
+    })
+    client.close()
 """
 
 # =========================
@@ -595,13 +669,27 @@ lambda_function_pdf = lambda_.Function("pdf2image",
     handler="index.handler",  # Ensure this matches the filename and function name
     role=lambda_role.arn,
     code=pulumi.AssetArchive({
-        "index.py": pulumi.StringAsset(lambda_code_pdf)  # Specify the filename here
+        "index.py": pulumi.StringAsset(lambda_code_pdf + lambda_code_publish)  # Specify the filename here
     }),
-    layers=[poppler_layer.arn],
+    # pika/redis to publish the prewarm request
+    layers=[poppler_layer.arn, pika_layer.arn] + ([redis_layer.arn] if redis_layer else []),
+    environment=lambda_.FunctionEnvironmentArgs(
+        variables={
+            'TRANSPORT': transport,
+            'STREAM_REDIS_URL': stream_redis_url,
+            'RABBITMQ_HOST': connection_details.get('host'),
+            'RABBITMQ_PORT': connection_details.get('port'),
+            'RABBITMQ_USER': connection_details.get('user'),
+            'RABBITMQ_PASSWORD': connection_details.get('password'),
+            'RABBITMQ_QUEUE': first_queue,
+            'RABBITMQ_VHOST': connection_details.get('vhost'),
+        }
+    ),
     timeout=300,
     memory_size=1024,
     opts=pulumi.ResourceOptions(depends_on=[
         lambda_logs,
+        create_second_queue
     ])
 )
 
@@ -611,11 +699,13 @@ lambda_function_audio = lambda_.Function("audio2rabbitmq",
     handler="index.handler",
     role=lambda_role.arn,
     code=pulumi.AssetArchive({
-        "index.py": pulumi.StringAsset(lambda_code_audio)
+        "index.py": pulumi.StringAsset(lambda_code_audio + lambda_code_publish)
     }),
-    layers=[pika_layer.arn],
+    layers=[pika_layer.arn] + ([redis_layer.arn] if redis_layer else []),
     environment=lambda_.FunctionEnvironmentArgs(
         variables={
+            'TRANSPORT': transport,
+            'STREAM_REDIS_URL': stream_redis_url,
             'RABBITMQ_HOST': connection_details.get('host'),
             'RABBITMQ_PORT': connection_details.get('port'),
             'RABBITMQ_USER': connection_details.get('user'),
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import requests
 import json
 import urllib.parse
 
-def create_queue(host, user, password, vhost, queue_name):
+# Must match RETRY_DELAYS in packages/workers/retry.py
+RETRY_DELAYS = [int(d) for d in os.getenv("RETRY_DELAYS", "5,30,120,600").split(",")]
+# Must match RABBITMQ_CONSUMER_TIMEOUT in packages/workers/retry.py
+CONSUMER_TIMEOUT = os.getenv("RABBITMQ_CONSUMER_TIMEOUT")
+# Must match QUEUE_MAX_PRIORITY in packages/workers/retry.py
+QUEUE_MAX_PRIORITY = int(os.getenv("QUEUE_MAX_PRIORITY", 0))
+
+def create_queue(host, user, password, vhost, queue_name, arguments=None):
     vhost_encoded = urllib.parse.quote(vhost, safe='')
     url = f"https://{host}/api/queues/{vhost_encoded}/{queue_name}"
     headers = {'Content-Type': 'application/json'}
-    data = {"durable": True}
+    data = {"durable": True, "arguments": arguments or {}}
 
     response = requests.put(
         url,
@@ -24,6 +32,26 @@ def create_queue(host, user, password, vhost, queue_name):
         print(f"Failed to create queue '{queue_name}': {response.text}")
         sys.exit(1)
 
+def create_topology(host, user, password, vhost, queue_name):
+    # Work queue
+    arguments = {}
+    if CONSUMER_TIMEOUT:
+        arguments["x-consumer-timeout"] = int(CONSUMER_TIMEOUT)
+    if QUEUE_MAX_PRIORITY:
+        arguments["x-max-priority"] = QUEUE_MAX_PRIORITY
+    create_queue(host, user, password, vhost, queue_name, arguments)
+
+    # Delay tiers: messages sit out their TTL, then dead-letter back onto the work queue
+    for delay in RETRY_DELAYS:
+        create_queue(host, user, password, vhost, f"{queue_name}.retry.{delay}s", {
+            "x-message-ttl": delay * 1000,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": queue_name,
+        })
+
+    # Messages that ran out of retries, inspected and replayed with dlq.py
+    create_queue(host, user, password, vhost, f"{queue_name}.dlq")
+
 if __name__ == "__main__":
     if len(sys.argv) != 6:
         print("Usage: create_queues.py <host> <user> <password> <vhost> <queue_name>")
@@ -35,4 +63,4 @@ if __name__ == "__main__":
     vhost = sys.argv[4]
     queue_name = sys.argv[5]
 
-    create_queue(host, user, password, vhost, queue_name)
\ No newline at end of file
+    create_topology(host, user, password, vhost, queue_name)
@@ -0,0 +1,8 @@
+#!/bin/bash
+# Builds lambda_layer_redis.zip for the audio Lambda's Redis Streams transport
+set -e
+cd "$(dirname "$0")"
+rm -rf python lambda_layer_redis.zip
+pip install redis -t python --python-version 3.9 --only-binary=:all:
+zip -qr lambda_layer_redis.zip python
+rm -rf python
@@ -5,12 +5,14 @@ interface Feedback {
   emotion: string[];
   emotionScore: number;
   text: string;
+  timeline?: string; // base64 little-endian float32 rows of [begin, end, confidence]
 }
 
 interface Clip {
   slideUUID: string;
   video: string;
   feedback: Feedback;
+  transcript?: string; // what the feedback was generated from, for reprocessing
 }
 
 interface Slide {
@@ -0,0 +1,142 @@
+import os
+import subprocess
+import urllib.request
+from vad import classify, SILENT
+from segments import plan_segments, map_segments
+from log import get_logger
+
+log = get_logger("audio")
+
+SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", 16000))
+OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+FETCH_TIMEOUT = int(os.getenv("AUDIO_FETCH_TIMEOUT", 60))
+
+# 16-bit mono PCM
+BYTES_PER_SAMPLE = 2
+
+
+def fetch_audio(audio_url):
+    with urllib.request.urlopen(audio_url, timeout=FETCH_TIMEOUT) as resp:
+        return resp.read()
+
+
+def _ffmpeg(args, data):
+    proc = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", *args],
+        input=data,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return proc.stdout
+
+
+def decode_pcm(data):
+    """Decode any container ffmpeg understands to 16 kHz mono s16le PCM."""
+    return _ffmpeg(
+        ["-i", "pipe:0", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+        data,
+    )
+
+
+def encode_opus(pcm):
+    """Encode raw PCM as low-bitrate mono opus in an ogg container."""
+    return _ffmpeg(
+        [
+            "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip",
+            "-f", "ogg", "pipe:1",
+        ],
+        pcm,
+    )
+
+
+def pcm_duration(pcm):
+    return len(pcm) / float(BYTES_PER_SAMPLE * SAMPLE_RATE)
+
+
+def trim_pcm(pcm, start=0.0, end=None):
+    """Cut PCM to [start, end) seconds, keeping sample alignment."""
+    lo = int(start * SAMPLE_RATE) * BYTES_PER_SAMPLE
+    hi = len(pcm) if end is None else int(end * SAMPLE_RATE) * BYTES_PER_SAMPLE
+    return pcm[lo:hi]
+
+
+def silent_clip(pcm, vad=None):
+    """Nothing to send to the providers; worker1 writes templated feedback instead."""
+    return {
+        "pcm": pcm,
+        "segments": [],
+        "filename": None,
+        "mimetype": None,
+        "duration": pcm_duration(pcm),
+        "vad": vad or {"label": SILENT, "regions": [], "speech_seconds": 0.0, "bounds": (0.0, 0.0)},
+    }
+
+
+def original_upload(raw, vad=None):
+    """The clip as uploaded, one segment, for when ffmpeg can't run or encode it."""
+    return {
+        "pcm": None,
+        "segments": [{"offset": 0.0, "duration": None, "data": raw}],
+        "filename": "audio.webm",
+        "mimetype": "audio/webm",
+        "duration": None,
+        "vad": vad,
+    }
+
+
+def prepare_audio(audio_url):
+    """
+    Fetch a clip once and normalize it for every provider.
+    Returns the decoded PCM (for local analysis), the VAD result and the
+    opus segments we upload to Deepgram and Hume, trimmed to the speech.
+    Long clips are split at pauses; silent clips are not encoded at all,
+    and neither are empty or undecodable ones, which count as silent.
+    """
+    raw = fetch_audio(audio_url)
+    if not raw:
+        log.warning("Empty upload %s, treating it as silent", audio_url)
+        return silent_clip(b"")
+    try:
+        pcm = decode_pcm(raw)
+    except subprocess.CalledProcessError as e:
+        # The providers would reject it too, retrying into the DLQ and stalling
+        # worker2's in-order sequence; as silence the presentation moves on
+        detail = (e.stderr or b"").decode(errors="replace").strip()[-500:]
+        log.error("Failed to decode %s, treating it as silent: %s", audio_url, detail)
+        return silent_clip(b"")
+    except FileNotFoundError as e:
+        # No ffmpeg here, which says nothing about the clip; let the providers try
+        log.error("Failed to transcode %s: %s", audio_url, e)
+        return original_upload(raw)
+
+    vad = classify(pcm, SAMPLE_RATE)
+    if vad["label"] == SILENT:
+        return silent_clip(pcm, vad)
+
+    # Leading/trailing silence is dropped here so neither provider pays for it
+    start, end = vad["bounds"]
+    pcm = trim_pcm(pcm, start, end)
+    vad["regions"] = [(s - start, e - start) for s, e in vad["regions"]]
+    duration = pcm_duration(pcm)
+
+    def encode(bounds):
+        lo, hi = bounds
+        return {"offset": lo, "duration": hi - lo, "data": encode_opus(trim_pcm(pcm, lo, hi))}
+
+    try:
+        segments = map_segments(encode, plan_segments(vad["regions"], duration))
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        # Same fallback as a failed decode; the VAD label still holds
+        log.error("Failed to encode %s: %s", audio_url, e)
+        return original_upload(raw, vad)
+
+    return {
+        "pcm": pcm,
+        "segments": segments,
+        "filename": "audio.ogg",
+        "mimetype": "audio/ogg",
+        "duration": duration,
+        "vad": vad,
+    }
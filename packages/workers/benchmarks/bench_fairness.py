@@ -0,0 +1,106 @@
+"""
+Per-presentation completion time under FIFO vs FairScheduler (deficit
+round-robin plus priority lanes), on a simulated mixed workload: a few
+bulk 60-clip presentations arriving alongside many short ones.
+
+    cd packages/workers && python -m benchmarks.bench_fairness [seed]
+"""
+import sys
+import heapq
+from collections import deque
+
+import numpy as np
+
+from scheduler import FairScheduler, clip_priority
+
+WORKERS = 4
+HORIZON = 3600.0
+
+
+def workload(rng):
+    """(arrival, presentation, clip, is_end, service seconds) for every clip."""
+    clips = []
+    pres = 0
+    # Bulk uploads: every clip lands at once
+    for t in (0.0, 600.0, 1500.0):
+        for i in range(60):
+            clips.append((t, pres, i, "true" if i == 59 else "false", rng.lognormal(np.log(20), 0.4)))
+        pres += 1
+    # Interactive users: 1-5 clips, recorded a few seconds apart
+    for t in np.sort(rng.uniform(0, HORIZON, 120)):
+        n = int(rng.integers(1, 6))
+        for i in range(n):
+            clips.append((t + 5.0 * i, pres, i, "true" if i == n - 1 else "false", rng.lognormal(np.log(20), 0.4)))
+        pres += 1
+    clips.sort()
+    return clips
+
+
+class Fifo:
+    def __init__(self):
+        self.q = deque()
+
+    def __len__(self):
+        return len(self.q)
+
+    def push(self, key, item, priority=0):
+        self.q.append(item)
+
+    def pop(self):
+        return self.q.popleft()
+
+
+def simulate(clips, queue):
+    """Event-driven simulation of WORKERS consumers pulling from `queue`."""
+    events = [(c[0], 0, i) for i, c in enumerate(clips)]  # kind 0 = arrival, 1 = done
+    heapq.heapify(events)
+    free = WORKERS
+    arrived = {}
+    finished = {}
+    remaining = {}
+    for c in clips:
+        remaining[c[1]] = remaining.get(c[1], 0) + 1
+
+    while events:
+        now, kind, i = heapq.heappop(events)
+        if kind == 0:
+            arrival, pres, _, is_end, _ = clips[i]
+            arrived.setdefault(pres, arrival)
+            queue.push(pres, i, clip_priority(is_end))
+        else:
+            free += 1
+            pres = clips[i][1]
+            remaining[pres] -= 1
+            if remaining[pres] == 0:
+                finished[pres] = now
+        while free and len(queue):
+            j = queue.pop()
+            free -= 1
+            heapq.heappush(events, (now + clips[j][4], 1, j))
+
+    return {p: finished[p] - arrived[p] for p in finished}
+
+
+def report(name, times, sizes):
+    small = np.array([t for p, t in times.items() if sizes[p] <= 5])
+    large = np.array([t for p, t in times.items() if sizes[p] > 5])
+    s50, s99 = np.percentile(small, [50, 99])
+    l50, l99 = np.percentile(large, [50, 99])
+    print(f"{name:<6}{s50:>10.0f}{s99:>10.0f}{l50:>10.0f}{l99:>10.0f}")
+
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    clips = workload(np.random.default_rng(seed))
+    sizes = {}
+    for c in clips:
+        sizes[c[1]] = sizes.get(c[1], 0) + 1
+
+    print(f"{len(sizes)} presentations, {len(clips)} clips, {WORKERS} workers (seconds)")
+    print(f"{'':<6}{'short p50':>10}{'short p99':>10}{'bulk p50':>10}{'bulk p99':>10}")
+    report("fifo", simulate(clips, Fifo()), sizes)
+    report("fair", simulate(clips, FairScheduler()), sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+p50/p99 of a heavy-tailed fake provider with and without hedging.
+
+    cd packages/workers && python -m benchmarks.bench_hedging [calls]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hedging import Hedger
+
+SCALE = 0.01  # simulated seconds -> real seconds
+CONCURRENCY = 8
+
+
+def heavy_tail(rng):
+    # Mostly ~4s, with a Pareto tail of multi-minute stragglers
+    if rng.random() < 0.03:
+        return 4.0 * (1 + rng.pareto(1.2)) * 10
+    return rng.lognormal(np.log(4.0), 0.3)
+
+
+def make_provider(seed):
+    rng = np.random.default_rng(seed)
+
+    def provider(stop):
+        latency = heavy_tail(rng) * SCALE
+        deadline = time.monotonic() + latency
+        while time.monotonic() < deadline:
+            if stop.is_set():
+                return None
+            time.sleep(min(0.005, latency))
+        return latency
+    return provider
+
+
+def run(calls, hedger):
+    provider = make_provider(42)
+
+    def one(_):
+        start = time.monotonic()
+        if hedger is None:
+            provider(_NEVER)
+        else:
+            hedger.call(provider)
+        return (time.monotonic() - start) / SCALE
+
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        return np.array(list(pool.map(one, range(calls))))
+
+
+class _Never:
+    def is_set(self):
+        return False
+
+
+_NEVER = _Never()
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    base = run(calls, None)
+    hedger = Hedger("bench", default_delay=8.0 * SCALE, budget=0.05, burst=5)
+    hedged = run(calls, hedger)
+
+    print(f"{'':<10}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for name, lat in (("baseline", base), ("hedged", hedged)):
+        p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+        print(f"{name:<10}{p50:>8.1f}{p95:>8.1f}{p99:>8.1f}{lat.max():>8.1f}")
+    print(f"extra requests: {hedger.hedges}/{hedger.calls} ({100.0 * hedger.hedges / hedger.calls:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
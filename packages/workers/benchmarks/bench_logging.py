@@ -0,0 +1,101 @@
+"""
+What logging costs the thread handling a clip: microseconds per record on
+the caller's thread, one thread and many, for the old print of a whole
+message body against log.py (queued, truncated), a suppressed DEBUG line
+and a sampled polling line.
+
+stdout is a sink that takes --write-us per write under a lock, like a pipe
+the log collector is slow to drain. print waits on it; the queue handler
+doesn't, and drops what doesn't fit (ducky_log_dropped_total) instead.
+
+    cd packages/workers && python -m benchmarks.bench_logging [--records 20000] [--threads 8] [--write-us 20]
+"""
+import sys
+import time
+import argparse
+import threading
+
+import log
+from log import get_logger, bind, sample, setup_logging
+from metrics import LOG_DROPPED
+from benchmarks.bench_messages import job
+
+# What worker1 used to print for every delivery
+BODY = repr(job(300))
+
+
+class SlowSink:
+    def __init__(self, write_us):
+        self.delay = write_us / 1e6
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def write(self, text):
+        # A blocked write releases the GIL, like a full pipe
+        with self.lock:
+            time.sleep(self.delay)
+            self.writes += 1
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def per_record_us(fn, records, threads):
+    """Mean caller-thread microseconds per fn() call, records split across threads."""
+    each = records // threads
+    spent = []
+
+    def run():
+        with bind(pres="bench-pres", clip="3"):
+            start = time.perf_counter()
+            for i in range(each):
+                fn(i)
+            spent.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(spent) / (each * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging cost on the caller's thread")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--write-us", type=float, default=20)
+    args = parser.parse_args()
+
+    sink = SlowSink(args.write_us)
+    real_stdout, sys.stdout = sys.stdout, sink
+    setup_logging("bench")
+    logger = get_logger("bench")
+
+    cases = {
+        "print body": lambda i: print(f" [x] Received {BODY}", file=sink),
+        "log.info body": lambda i: logger.info("Received %s", BODY),
+        "log.debug (off)": lambda i: logger.debug("Received %s", BODY),
+        "sampled poll": lambda i: logger.info("Hume job %s: %s", "job", "IN_PROGRESS", extra=sample("hume:job")),
+    }
+    rows = []
+    for name, fn in cases.items():
+        for threads in (1, args.threads):
+            dropped = LOG_DROPPED._value.get()
+            us = per_record_us(fn, args.records, threads)
+            rows.append((name, threads, us, LOG_DROPPED._value.get() - dropped))
+            # Let the listener catch up so each case starts with an empty queue
+            while log._listener.queue.qsize():
+                time.sleep(0.01)
+
+    sys.stdout = real_stdout
+    print(f"{args.records} records per case, body {len(BODY)} chars, sink {args.write_us:g} us/write, "
+          f"queue {log.LOG_QUEUE_SIZE}")
+    print(f"{'case':<18}{'threads':>8}{'us/record':>11}{'dropped':>9}")
+    for name, threads, us, dropped in rows:
+        print(f"{name:<18}{threads:>8}{us:>11.2f}{dropped:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
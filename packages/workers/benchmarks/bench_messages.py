@@ -0,0 +1,127 @@
+"""
+Inter-stage message cost: the old path (clip JSON in the presentation hash,
+a JSON pointer on SECOND_QUEUE, worker2 re-reading the hash per field) vs
+the msgpack schema with claim-check. Codec time is serialization alone;
+Redis round trips are counted against fakeredis.
+
+    cd packages/workers && python -m benchmarks.bench_messages [iterations]
+"""
+import sys
+import json
+import time
+
+import fakeredis
+import msgpack
+import numpy as np
+
+from messages import encode_job, decode_job, CLAIM_CHECK_BYTES, SCHEMA_VERSION
+from emotions import pack_timeline
+
+VOCAB = "so the next slide shows how our revenue grew quarter over quarter and why".split()
+
+# worker2 read the clip back this many times per job before the schema
+# (slide, transcript, user, attempt id, silent, is_end x2, user, update_db)
+LEGACY_READS = 9
+
+
+class Counting:
+    def __init__(self, client):
+        self.client = client
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name == "pipeline":
+            return self._pipeline
+        if callable(attr):
+            def counted(*args, **kwargs):
+                self.calls += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+    def _pipeline(self, *args, **kwargs):
+        pipe = self.client.pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counted():
+            self.calls += 1
+            return execute()
+        pipe.execute = counted
+        return pipe
+
+
+def job(words):
+    n = max(1, words // 40)
+    begin = np.arange(n, dtype=np.float32) * 3
+    return {
+        'USER_ID': '109876543210987654321',
+        'TRANSCRIPT': " ".join(VOCAB[i % len(VOCAB)] for i in range(words)),
+        'SLIDE_URL': 'http://bucket.s3-website-us-east-1.amazonaws.com/Users/u/presentations/p/slides/slide_3.png',
+        'VIDEO_URL': 'http://bucket.s3-website-us-east-1.amazonaws.com/Users/u/presentations/p/clips/3_1729_false/3/video.webm',
+        'PRESENTATION_ID': '6718f0c2a1b2c3d4e5f60718',
+        'CLIP_ID': '3',
+        'IS_END': 'false',
+        'EMOTIONS': json.dumps([["Calmness", 0.41], ["Interest", 0.33], ["Anxiety", 0.12]]),
+        'SCORE': '0.62',
+        'TIMELINE': pack_timeline(begin, begin + 3, np.full(n, 0.5, dtype=np.float32)),
+        'SILENT': False,
+        'CLIP_TIMESTAMP': '1729350000000',
+    }
+
+
+def legacy(r, data):
+    r.hset(data['PRESENTATION_ID'], data['CLIP_ID'], json.dumps(data))
+    body = json.dumps({'PRESENTATION_ID': data['PRESENTATION_ID'], 'CLIP_ID': data['CLIP_ID']}).encode()
+    pointer = json.loads(body)
+    for _ in range(LEGACY_READS):
+        json.loads(r.hget(pointer['PRESENTATION_ID'], pointer['CLIP_ID']))
+    return len(body)
+
+
+def legacy_codec(data):
+    stored = json.dumps(data)
+    pointer = json.loads(json.dumps({'PRESENTATION_ID': data['PRESENTATION_ID'], 'CLIP_ID': data['CLIP_ID']}))
+    for _ in range(LEGACY_READS):
+        json.loads(stored)
+    return pointer
+
+
+def schema(r, data):
+    body = encode_job(data, r)
+    decode_job(body, r)
+    return len(body)
+
+
+def schema_codec(data):
+    inline = {k: v for k, v in data.items() if not (isinstance(v, str) and len(v) > CLAIM_CHECK_BYTES)}
+    return msgpack.unpackb(msgpack.packb({"v": SCHEMA_VERSION, "job": inline, "refs": {}}))
+
+
+def per_call_us(fn, data, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(data)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def round_trips(fn, data):
+    r = Counting(fakeredis.FakeRedis(decode_responses=True))
+    size = fn(r, data)
+    return r.calls, size
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"claim-check above {CLAIM_CHECK_BYTES} bytes")
+    print(f"{'words':>7}{'path':>9}{'codec us':>10}{'redis ops':>11}{'msg bytes':>11}")
+    for words in (0, 150, 1500, 6000):
+        data = job(words)
+        for name, fn, codec in (("json", legacy, legacy_codec), ("msgpack", schema, schema_codec)):
+            calls, size = round_trips(fn, data)
+            us = per_call_us(codec, data, iterations)
+            print(f"{words:>7}{name:>9}{us:>10.1f}{calls:>11}{size:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Segmented vs whole-clip transcription latency with a fake provider whose
+latency grows linearly with audio duration (like Deepgram's does).
+
+    cd packages/workers && python -m benchmarks.bench_segments [minutes]
+"""
+import sys
+import time
+
+from vad import classify
+from segments import plan_segments, map_segments, stitch_transcripts
+from benchmarks.synthetic import SAMPLE_RATE, monologue
+
+# Provider cost model: fixed overhead plus a fraction of realtime.
+# Scaled down so the benchmark finishes quickly; ratios are what matter.
+OVERHEAD = 0.8
+REALTIME_FACTOR = 0.12
+SCALE = 0.02
+
+
+def fake_transcribe(segment):
+    time.sleep((OVERHEAD + REALTIME_FACTOR * segment['duration']) * SCALE)
+    # One "word" per second so stitching order and offsets can be checked
+    words = [{'word': f"w{i}", 'punctuated_word': None, 'start': float(i), 'end': i + 0.5}
+             for i in range(int(segment['duration']))]
+    return {'results': {'channels': [{'alternatives': [{
+        'transcript': " ".join(w['word'] for w in words),
+        'words': words,
+    }]}]}}
+
+
+def run(segments, concurrency):
+    start = time.perf_counter()
+    responses = map_segments(fake_transcribe, segments, concurrency)
+    stitched = stitch_transcripts(responses, segments)
+    elapsed = (time.perf_counter() - start) / SCALE
+    starts = [w['start'] for w in stitched['words']]
+    assert starts == sorted(starts), "stitched words out of order"
+    return elapsed
+
+
+def main():
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    pcm = monologue(minutes * 60)
+    vad = classify(pcm, SAMPLE_RATE)
+    duration = len(pcm) / (2 * SAMPLE_RATE)
+
+    whole = [{'offset': 0.0, 'duration': duration}]
+    base = run(whole, 1)
+    print(f"{minutes:g} min clip, whole: {base:.1f}s (simulated)")
+
+    for seg_seconds in (30, 60, 120):
+        bounds = plan_segments(vad['regions'], duration, seg_seconds)
+        segments = [{'offset': lo, 'duration': hi - lo} for lo, hi in bounds]
+        for concurrency in (2, 4, 8):
+            elapsed = run(segments, concurrency)
+            print(f"  segments={len(segments):>3} of <= {seg_seconds}s, concurrency={concurrency}: "
+                  f"{elapsed:6.1f}s  speedup {base / elapsed:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Cold start of each worker: how long `import workerN` takes in a fresh
+interpreter, and how long `python workerN.py` takes from exec until it is
+warmed up and consuming (the "Ready" line health.py prints, also exported
+as ducky_cold_start_seconds).
+
+The workers run on the Redis Streams transport against an in-process
+fake Redis server. Mongo is only reachable with --mongo; without it the
+Mongo warm-up fails fast instead of waiting out server selection.
+
+--tree measures another checkout's imports (e.g. a `git worktree` of an
+older commit) for a before/after comparison.
+
+    cd packages/workers && python -m benchmarks.bench_startup [--runs 5] [--mongo mongodb://localhost:27017] [--tree DIR]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import statistics
+import subprocess
+
+from fakeredis import TcpFakeServer
+
+WORKERS = ("worker1", "worker2")
+READY = re.compile(r"Ready ([0-9.]+)s after process start")
+CONSUMING = re.compile(r"waiting for messages")
+
+
+def environment(redis_port, mongo):
+    return {
+        **os.environ,
+        "TRANSPORT": "redis",
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(redis_port),
+        "REDIS_PASSWORD": "",
+        "MONGO_URI": mongo or "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=200",
+        "MONGO_DB": "startup",
+        "OPEN_API_KEY": "startup",
+        "DEEPGRAM_API_KEY": "startup",
+        "HUME_API_KEY": "startup",
+        "METRICS_PORT": "0",
+        "PYTHONUNBUFFERED": "1",
+    }
+
+
+def import_seconds(tree, module, env):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=tree, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def start_seconds(tree, module, env, timeout=60):
+    """
+    (wall seconds from spawn until consuming, seconds the worker reported it
+    took to be ready). Trees without health.py never report the latter.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen([sys.executable, f"{module}.py"], cwd=tree, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    consuming = None
+    wait_ready = os.path.exists(os.path.join(tree, "health.py"))
+    try:
+        for line in process.stdout:
+            if consuming is None and CONSUMING.search(line):
+                consuming = time.monotonic() - start
+                if not wait_ready:
+                    return consuming, None
+            match = READY.search(line)
+            if match:
+                return consuming, float(match.group(1))
+            if time.monotonic() - start > timeout:
+                break
+        return consuming, None
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo")
+    parser.add_argument("--tree", default=os.getcwd(), help="packages/workers of the checkout to measure")
+    args = parser.parse_args()
+
+    server = TcpFakeServer(("127.0.0.1", 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = environment(server.server_address[1], args.mongo)
+    tree = os.path.abspath(args.tree)
+
+    print(f"{args.runs} run(s) each, medians, tree {tree}")
+    print(f"{'worker':<10}{'import s':>10}{'consuming s':>13}{'ready s':>10}")
+    for module in WORKERS:
+        imports = [import_seconds(tree, module, env) for _ in range(args.runs)]
+        runs = [start_seconds(tree, module, env) for _ in range(args.runs)]
+        consuming = [c for c, _ in runs if c is not None]
+        ready = [r for _, r in runs if r is not None]
+        print(f"{module:<10}{statistics.median(imports):>10.2f}"
+              f"{f'{statistics.median(consuming):.2f}' if consuming else '-':>13}"
+              f"{f'{statistics.median(ready):.2f}' if ready else '-':>10}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+What tracing costs per clip: the spans one clip opens in each worker
+(consumer span, one per ledger stage, provider spans, header injection)
+with tracing off (the default no-op provider) and on (SDK provider, batch
+processor, exporter that drops everything). Compare against a clip's
+end-to-end time, which is seconds.
+
+    cd packages/workers && python -m benchmarks.bench_tracing [clips]
+"""
+import sys
+import time
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+import tracing
+from tracing import span, annotate, inject_headers, run_consumer, in_context
+
+# Ledger stages plus provider calls a clip goes through in worker1 and worker2
+STAGES = ("transcribe", "hume", "hume job", "provider deepgram", "provider hume", "gpt", "provider openai")
+
+
+class Discard(SpanExporter):
+    def export(self, spans):
+        return SpanExportResult.SUCCESS
+
+
+def clip(headers):
+    def stages():
+        for stage in STAGES:
+            with span(stage, **{"presentation.id": "p", "clip.attempt": "3:abc"}):
+                annotate(**{"ledger.skipped": False})
+        in_context(lambda: None)()
+        return inject_headers()
+
+    # worker1 consumes, then worker2 consumes what it published
+    published = run_consumer("FIRST_QUEUE", headers, stages)
+    return run_consumer("SECOND_QUEUE", published, lambda: None)
+
+
+def per_clip_us(clips):
+    headers = {"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01", "x-published-at": time.time()}
+    clip(headers)
+    start = time.perf_counter()
+    for _ in range(clips):
+        clip(headers)
+    return (time.perf_counter() - start) / clips * 1e6
+
+
+def main():
+    clips = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    spans = len(STAGES) + 2
+    off = per_clip_us(clips)
+
+    provider = TracerProvider()
+    provider.add_span_processor(BatchSpanProcessor(Discard()))
+    trace.set_tracer_provider(provider)
+    tracing.tracer = trace.get_tracer("ducky.workers")
+    on = per_clip_us(clips)
+    provider.shutdown()
+
+    print(f"{spans} spans per clip, {clips} clips")
+    print(f"{'tracing':>8}{'us/clip':>10}{'us/span':>10}")
+    for name, us in (("off", off), ("on", on)):
+        print(f"{name:>8}{us:>10.1f}{us / spans:>10.2f}")
+    print(f"overhead {on - off:.0f} us per clip")
+
+
+if __name__ == "__main__":
+    main()
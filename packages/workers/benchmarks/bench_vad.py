@@ -0,0 +1,44 @@
+"""
+VAD throughput and accuracy on synthetic audio.
+
+    cd packages/workers && python -m benchmarks.bench_vad
+"""
+import time
+
+from vad import classify
+from benchmarks.synthetic import SAMPLE_RATE, clip, monologue
+
+CASES = [
+    ("empty room", "silent", [("silence", 10)]),
+    ("slide advance", "short", [("silence", 4), ("speech", 0.5), ("silence", 4)]),
+    ("normal clip", "speech", [("silence", 2), ("speech", 20), ("silence", 1), ("speech", 15), ("silence", 3)]),
+]
+
+
+def bench(pcm, repeat=20):
+    classify(pcm, SAMPLE_RATE)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = classify(pcm, SAMPLE_RATE)
+    elapsed = (time.perf_counter() - start) / repeat
+    return result, elapsed
+
+
+def main():
+    print(f"{'case':<16}{'expected':<10}{'label':<10}{'speech s':>10}{'ms':>10}{'x realtime':>14}")
+    for name, expected, pattern in CASES:
+        pcm = clip(pattern)
+        result, elapsed = bench(pcm)
+        seconds = len(pcm) / (2 * SAMPLE_RATE)
+        print(f"{name:<16}{expected:<10}{result['label']:<10}{result['speech_seconds']:>10.1f}"
+              f"{elapsed * 1000:>10.2f}{seconds / elapsed:>14.0f}")
+
+    for minutes in (1, 10, 60):
+        pcm = monologue(minutes * 60)
+        result, elapsed = bench(pcm, repeat=5)
+        print(f"{f'{minutes} min mono':<16}{'speech':<10}{result['label']:<10}{result['speech_seconds']:>10.1f}"
+              f"{elapsed * 1000:>10.2f}{minutes * 60 / elapsed:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Concurrency check for presentation bootstrap: many workers racing on the
+first clips of the same presentations must create exactly one thread each,
+and every worker must end up using it. Races worker1.bootstrap_presentation
+itself, with create_thread stubbed (no Mongo or OpenAI), and the old
+check-then-create path alongside for contrast. Then checks that a late
+creator (one whose lock expired mid-create) can't reset next/pending on a
+presentation already in progress.
+
+Uses fakeredis unless a Redis URL is given (real Redis exercises the real
+network interleavings).
+
+    cd packages/workers && python -m benchmarks.check_single_flight [redis://localhost:6379/0]
+"""
+import sys
+import json
+import time
+import random
+import threading
+from collections import Counter
+
+import fakeredis
+import redis
+
+import worker1
+
+PRESENTATIONS = 20
+WORKERS_PER_PRESENTATION = 16
+USER_ID = "check-user"
+
+
+def race(r, bootstrap):
+    created = Counter()
+    seen = {}
+    lock = threading.Lock()
+    start = threading.Barrier(PRESENTATIONS * WORKERS_PER_PRESENTATION)
+
+    def create_thread(pres_id):
+        # Mongo lookup plus OpenAI round trips
+        time.sleep(random.uniform(0.05, 0.2))
+        with lock:
+            created[pres_id] += 1
+            return f"thread_{pres_id}_{created[pres_id]}"
+
+    def worker(pres_id):
+        start.wait()
+        bootstrap(r, pres_id, create_thread)
+        with lock:
+            seen.setdefault(pres_id, set()).add(r.hget(pres_id, "thread_id"))
+
+    threads = [
+        threading.Thread(target=worker, args=(f"check:pres:{p}",))
+        for p in range(PRESENTATIONS) for _ in range(WORKERS_PER_PRESENTATION)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return created, seen
+
+
+def unguarded(r, pres_id, create_thread):
+    # worker1 before single-flight
+    if r.hget(pres_id, "thread_id") is None:
+        thread_id = create_thread(pres_id)
+        r.hset(pres_id, "next", 0)
+        r.hset(pres_id, "thread_id", thread_id)
+        r.hset(pres_id, "pending", json.dumps({}))
+
+
+def shipped(r, pres_id, create_thread):
+    # worker1.re is r (see main)
+    worker1.create_thread = lambda user_id, pres_id: create_thread(pres_id)
+    worker1.bootstrap_presentation(USER_ID, pres_id)
+
+
+def late_creator(r):
+    """True if a second create on a presentation in progress leaves it alone."""
+    pres_id = "check:pres:late"
+    shipped(r, pres_id, lambda pres_id: "thread_first")
+    # worker2 has moved on: clip 3 is next and clip 5 is parked
+    r.hset(pres_id, mapping={"next": 3, "pending": json.dumps({"5": 1})})
+    before = r.hgetall(pres_id)
+    created = worker1.redis_create_presentation(pres_id, "thread_late", USER_ID)
+    after = r.hgetall(pres_id)
+    print(f"late creator   created: {created}, presentation unchanged: {before == after}")
+    return not created and before == after
+
+
+def main():
+    if len(sys.argv) > 1:
+        # A connection per racing worker, plus their lock renewals
+        r = redis.Redis.from_url(sys.argv[1], decode_responses=True,
+                                 max_connections=2 * PRESENTATIONS * WORKERS_PER_PRESENTATION)
+    else:
+        r = fakeredis.FakeRedis(decode_responses=True)
+    worker1.re = r
+
+    ok = True
+    for name, bootstrap in (("unguarded", unguarded), ("single-flight", shipped)):
+        for key in r.scan_iter(match="check:pres:*"):
+            r.delete(key)
+        created, seen = race(r, bootstrap)
+        extra = sum(created.values()) - PRESENTATIONS
+        split = sum(1 for ids in seen.values() if len(ids) > 1)
+        print(f"{name:<14} threads created: {sum(created.values()):>4} "
+              f"(expected {PRESENTATIONS}, {extra} extra), presentations with workers on different threads: {split}")
+        if name == "single-flight":
+            ok = extra == 0 and split == 0 and all(created[p] == 1 for p in seen)
+    ok = late_creator(r) and ok
+    for key in r.scan_iter(match="check:pres:*"):
+        r.delete(key)
+
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
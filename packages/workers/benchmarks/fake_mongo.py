@@ -0,0 +1,225 @@
+"""
+A stand-in for mongod, for benchmarks that need Mongo where none can be
+run. Speaks the wire protocol (OP_MSG, and OP_QUERY for pymongo's first
+hello) in front of a mongomock client, so the workers connect to it with
+an ordinary MONGO_URI. Covers what the workers and the load test use:
+find (with a positional `field.$` projection), insert, update (with the
+positional `$`), delete, aggregate and the handshake commands.
+
+Every reply fits in the first batch, and one lock serialises all
+operations. Timings taken against it say nothing about mongod. Needs
+mongomock (pip install mongomock).
+
+    cd packages/workers && python -m benchmarks.fake_mongo [port]
+"""
+import sys
+import struct
+import datetime
+import threading
+import socketserver
+
+import bson
+import mongomock
+from mongomock.filtering import filter_applies
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+
+HELLO = {
+    "ismaster": True, "isWritablePrimary": True, "helloOk": True,
+    "maxBsonObjectSize": 16 * 1024 * 1024, "maxMessageSizeBytes": 48000000, "maxWriteBatchSize": 100000,
+    "logicalSessionTimeoutMinutes": 30, "minWireVersion": 0, "maxWireVersion": 17, "readOnly": False,
+}
+# Driver plumbing with nothing to do here
+NOOPS = {"ping", "endsessions", "killcursors", "createindexes", "dropindexes", "getmore"}
+
+
+def _elements(document, path):
+    value = document
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value if isinstance(value, list) else []
+
+
+def _position(document, filter_, path):
+    """Index the positional `$` stands for: the first element of `path` the filter matched."""
+    conditions = {}
+    for key, value in filter_.items():
+        if key == path and isinstance(value, dict) and "$elemMatch" in value:
+            conditions.update(value["$elemMatch"])
+        elif key.startswith(path + "."):
+            conditions[key[len(path) + 1:]] = value
+    for i, element in enumerate(_elements(document, path)):
+        if isinstance(element, dict) and filter_applies(conditions, element):
+            return i
+    return None
+
+
+class Store:
+    def __init__(self):
+        self.client = mongomock.MongoClient()
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def command(self, db, cmd):
+        name = next(iter(cmd))
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if name.lower() in ("hello", "ismaster"):
+            with self.lock:
+                self.connections += 1
+                return {**HELLO, "connectionId": self.connections, "localTime": datetime.datetime.utcnow(), "ok": 1}
+        if name.lower() in NOOPS:
+            return {"cursor": {"id": 0, "ns": f"{db}.{cmd[name]}", "nextBatch": []}, "ok": 1} \
+                if name.lower() == "getmore" else {"ok": 1}
+        if handler is None:
+            return {"ok": 0, "errmsg": f"no such command: '{name}'", "code": 59, "codeName": "CommandNotFound"}
+        try:
+            with self.lock:
+                return {**handler(self.client[db][cmd[name]], cmd), "ok": 1}
+        except Exception as e:
+            return {"ok": 0, "errmsg": f"{type(e).__name__}: {e}", "code": 8}
+
+    def cmd_buildinfo(self, collection, cmd):
+        return {"version": "6.0.0", "versionArray": [6, 0, 0, 0]}
+
+    def cmd_find(self, collection, cmd):
+        projection = cmd.get("projection") or None
+        positional = [key[:-2] for key in projection or {} if key.endswith(".$")]
+        if positional:
+            projection = None
+        cursor = collection.find(cmd.get("filter", {}), projection)
+        if cmd.get("sort"):
+            cursor = cursor.sort(list(cmd["sort"].items()))
+        cursor = cursor.skip(cmd.get("skip", 0)).limit(abs(cmd.get("limit", 0)))
+        docs = list(cursor)
+        for i, document in enumerate(docs):
+            if positional:
+                kept = {"_id": document["_id"]}
+                for path in positional:
+                    index = _position(document, cmd.get("filter", {}), path)
+                    if index is not None:
+                        kept[path] = [_elements(document, path)[index]]
+                docs[i] = kept
+        return {"cursor": {"id": 0, "ns": collection.full_name, "firstBatch": docs}}
+
+    def cmd_insert(self, collection, cmd):
+        collection.insert_many(cmd["documents"], ordered=cmd.get("ordered", True))
+        return {"n": len(cmd["documents"])}
+
+    def cmd_update(self, collection, cmd):
+        matched = modified = 0
+        upserted = []
+        for index, update in enumerate(cmd["updates"]):
+            filter_, change = update["q"], update["u"]
+            if any(".$." in path or path.endswith(".$") for fields in change.values() for path in fields):
+                # mongomock can't create paths under `$`; resolve it against the matched document
+                target = collection.find_one(filter_)
+                if target is None:
+                    continue
+                change = {op: {self._resolve(target, filter_, path): value for path, value in fields.items()}
+                          for op, fields in change.items()}
+                filter_ = {"_id": target["_id"]}
+            kwargs = {"upsert": update.get("upsert", False)}
+            if update.get("arrayFilters"):
+                kwargs["array_filters"] = update["arrayFilters"]
+            apply = collection.update_many if update.get("multi") else collection.update_one
+            result = apply(filter_, change, **kwargs)
+            matched += result.matched_count
+            modified += result.modified_count
+            if result.upserted_id is not None:
+                upserted.append({"index": index, "_id": result.upserted_id})
+        return {"n": matched + len(upserted), "nModified": modified, **({"upserted": upserted} if upserted else {})}
+
+    @staticmethod
+    def _resolve(document, filter_, path):
+        head, _, tail = path.partition(".$")
+        index = _position(document, filter_, head)
+        if index is None:
+            raise ValueError(f"The positional operator did not find the match needed from the query: {path}")
+        return f"{head}.{index}{tail}"
+
+    def cmd_delete(self, collection, cmd):
+        n = 0
+        for delete in cmd["deletes"]:
+            remove = collection.delete_one if delete.get("limit") == 1 else collection.delete_many
+            n += remove(delete["q"]).deleted_count
+        return {"n": n}
+
+    def cmd_aggregate(self, collection, cmd):
+        docs = list(collection.aggregate(cmd["pipeline"]))
+        return {"cursor": {"id": 0, "ns": collection.full_name, "firstBatch": docs}}
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def read(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def handle(self):
+        store = self.server.store
+        try:
+            while True:
+                length, request_id, _, opcode = struct.unpack("<iiii", self.read(16))
+                payload = self.read(length - 16)
+                if opcode == OP_MSG:
+                    db, cmd = self.parse_msg(payload)
+                    reply = struct.pack("<IB", 0, 0) + bson.encode(store.command(db, cmd))
+                    self.send(request_id, OP_MSG, reply)
+                elif opcode == OP_QUERY:
+                    namespace_end = payload.index(b"\0", 4)
+                    db = payload[4:namespace_end].decode().split(".")[0]
+                    cmd = bson.decode(payload[namespace_end + 9:])
+                    cmd = cmd.get("$query", cmd)
+                    reply = struct.pack("<iqii", 0, 0, 0, 1) + bson.encode(store.command(db, cmd))
+                    self.send(request_id, OP_REPLY, reply)
+                else:
+                    return
+        except (ConnectionError, OSError):
+            return
+
+    def parse_msg(self, payload):
+        flags = struct.unpack("<I", payload[:4])[0]
+        end = len(payload) - (4 if flags & 1 else 0)
+        position = 4
+        cmd, sequences = None, {}
+        while position < end:
+            kind = payload[position]
+            position += 1
+            size = struct.unpack("<i", payload[position:position + 4])[0]
+            if kind == 0:
+                cmd = bson.decode(payload[position:position + size])
+            else:
+                # Document sequence: insert's documents, update's updates, ...
+                name_end = payload.index(b"\0", position + 4)
+                sequences[payload[position + 4:name_end].decode()] = bson.decode_all(payload[name_end + 1:position + size])
+            position += size
+        cmd.update(sequences)
+        return cmd.pop("$db", "admin"), cmd
+
+    def send(self, request_id, opcode, body):
+        self.request.sendall(struct.pack("<iiii", 16 + len(body), 0, request_id, opcode) + body)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port=0):
+    """Start the server on a daemon thread. Returns its port; connect to mongodb://127.0.0.1:<port>."""
+    server = Server(("127.0.0.1", port), Handler)
+    server.store = Store()
+    threading.Thread(target=server.serve_forever, name="FakeMongo", daemon=True).start()
+    return server.server_address[1]
+
+
+if __name__ == "__main__":
+    port = serve(int(sys.argv[1]) if len(sys.argv) > 1 else 27017)
+    print(f"Fake mongod on mongodb://127.0.0.1:{port}")
+    threading.Event().wait()
@@ -0,0 +1,390 @@
+"""
+Local stand-ins for Deepgram, Hume, OpenAI and the S3 website, on one HTTP
+port, so the workers can run end to end without paying anyone.
+
+Three modes:
+  synthetic  responses are generated; latency per route is drawn from a
+             lognormal and a configurable fraction of calls fail
+  record     calls are proxied to the real providers (or RECORD_<PROVIDER>_URL)
+             and every response is appended to a capture file (the audio
+             is still synthetic)
+  replay     responses come back from a capture file, in order per route,
+             after the latency they were recorded with
+
+Point the workers at it with DEEPGRAM_URL, HUME_BASE_URL and
+OPENAI_BASE_URL (see loadtest.py); reprocess.py's batches are served too.
+Run on its own to poke at it:
+
+    cd packages/workers && python -m benchmarks.fake_providers [port]
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import wave
+import base64
+import threading
+import email.parser
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from benchmarks.synthetic import monologue, SAMPLE_RATE
+
+# Where record mode proxies to; overridable to record through another server
+UPSTREAM = {
+    "deepgram": os.getenv("RECORD_DEEPGRAM_URL", "https://api.deepgram.com"),
+    "hume": os.getenv("RECORD_HUME_URL", "https://api.hume.ai"),
+    "openai": os.getenv("RECORD_OPENAI_URL", "https://api.openai.com"),
+}
+
+# Median seconds and lognormal sigma. hume_job, openai_run and openai_batch are
+# how long a job, run or batch takes to finish, the rest are per request.
+DEFAULT_LATENCY = {
+    "audio": (0.05, 0.3),
+    "deepgram": (1.2, 0.4),
+    "hume": (0.15, 0.3),
+    "hume_job": (6.0, 0.5),
+    "openai": (0.3, 0.3),
+    "openai_run": (8.0, 0.5),
+    "openai_batch": (20.0, 0.5),
+}
+
+VOCAB = "so the next slide shows how our revenue grew quarter over quarter and why it matters".split()
+EMOTIONS = ("Calmness", "Interest", "Concentration", "Anxiety", "Confusion", "Boredom", "Determination")
+
+# Ids in paths, so recorded responses are found again for other threads and jobs
+_IDS = re.compile(r"/(?:(thread|run|msg|asst|batch)_[A-Za-z0-9]+|(file)-[A-Za-z0-9]+|[0-9a-f]{8}-[0-9a-f-]{27})")
+
+
+def route(method, path):
+    path = path.split("?")[0]
+    return f"{method} {_IDS.sub(lambda m: '/' + (m.group(1) or m.group(2) or 'job') + '_*', path)}"
+
+
+def provider_of(path):
+    if path.startswith("/v1/listen"):
+        return "deepgram"
+    if path.startswith("/v0/"):
+        return "hume"
+    if path.startswith("/v1/"):
+        return "openai"
+    return "audio"
+
+
+def wav(seconds, seed):
+    """A clip the workers can decode; ffmpeg ignores the .webm in the name."""
+    out = io.BytesIO()
+    with wave.open(out, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(monologue(seconds, seed=seed))
+    return out.getvalue()
+
+
+class Synthetic:
+    """Just enough provider state for the workers' call patterns."""
+
+    def __init__(self, latency, errors, clip_seconds, seed=0):
+        self.latency = {**DEFAULT_LATENCY, **latency}
+        self.errors = errors
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.audio = wav(clip_seconds, seed)
+        self.threads = defaultdict(list)
+        self.runs = {}
+        self.jobs = {}
+        self.files = {}
+        self.batches = {}
+
+    def draw(self, name):
+        median, sigma = self.latency[name]
+        with self.lock:
+            return float(self.rng.lognormal(np.log(median), sigma)) if median > 0 else 0.0
+
+    def fails(self, provider):
+        with self.lock:
+            return self.rng.random() < self.errors.get(provider, 0.0)
+
+    def handle(self, method, path, body, headers=None):
+        provider = provider_of(path)
+        time.sleep(self.draw(provider))
+        if provider != "audio" and self.fails(provider):
+            return 503, {"error": {"message": "injected failure"}}
+        path = path.split("?")[0]
+        if provider == "audio":
+            return 200, self.audio
+        if provider == "deepgram":
+            return 200, self.transcript(len(body))
+        if provider == "hume":
+            return 200, self.hume(method, path)
+        if path.startswith(("/v1/files", "/v1/batches", "/v1/assistants")):
+            return 200, self.openai_batch(method, path, body, headers or {})
+        return 200, self.openai(method, path, json.loads(body or b"{}"))
+
+    def transcript(self, size):
+        # Opus at ~24 kbps, near enough for billing
+        duration = round(size / 3000, 2)
+        n = max(1, int(duration * 2.5))
+        words = [VOCAB[i % len(VOCAB)] for i in range(n)]
+        return {
+            "metadata": {"request_id": str(uuid.uuid4()), "duration": duration, "channels": 1},
+            "results": {"channels": [{"alternatives": [{
+                "transcript": " ".join(words),
+                "confidence": 0.95,
+                "words": [
+                    {"word": w, "punctuated_word": w, "start": i * 0.4, "end": i * 0.4 + 0.35, "confidence": 0.95}
+                    for i, w in enumerate(words)
+                ],
+            }]}]},
+        }
+
+    def hume(self, method, path):
+        now = int(time.time() * 1000)
+        if method == "POST":
+            job_id = str(uuid.uuid4())
+            self.jobs[job_id] = now + int(self.draw("hume_job") * 1000)
+            return {"job_id": job_id}
+        job_id = path.split("/")[4]
+        if path.endswith("/predictions"):
+            return self.predictions()
+        done = now >= self.jobs.get(job_id, 0)
+        state = {"status": "COMPLETED" if done else "IN_PROGRESS", "created_timestamp_ms": now,
+                 "started_timestamp_ms": now}
+        if done:
+            state.update(ended_timestamp_ms=now, num_predictions=1, num_errors=0)
+        return {"type": "INFERENCE", "job_id": job_id, "user_id": "loadtest",
+                "request": {"models": {"prosody": {}}, "files": [], "urls": [], "text": [], "notify": True},
+                "state": state}
+
+    def predictions(self):
+        with self.lock:
+            rows = self.rng.dirichlet(np.ones(len(EMOTIONS)), size=4)
+        return [{
+            "source": {"type": "file", "filename": "audio.webm", "content_type": "audio/webm", "md5sum": ""},
+            "results": {"errors": [], "predictions": [{
+                "file": "segment_0_audio.webm",
+                "models": {"prosody": {"grouped_predictions": [{"id": "unknown", "predictions": [
+                    {"time": {"begin": i * 2.0, "end": i * 2.0 + 2.0},
+                     "emotions": [{"name": n, "score": float(s)} for n, s in zip(EMOTIONS, row)]}
+                    for i, row in enumerate(rows)
+                ]}]}},
+            }]},
+        }]
+
+    def openai(self, method, path, body):
+        parts = path.strip("/").split("/")
+        now = int(time.time())
+        if parts[1:] == ["threads"]:
+            return {"id": f"thread_{uuid.uuid4().hex}", "object": "thread", "created_at": now, "metadata": {}}
+        thread_id = parts[2]
+        if parts[3] == "messages":
+            if method == "POST":
+                return self.message(thread_id, "user", body.get("content", ""))
+            data = list(reversed(self.threads[thread_id]))
+            return {"object": "list", "data": data, "has_more": False,
+                    "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None}
+        # runs
+        if method == "POST" and len(parts) == 4:
+            run = {"id": f"run_{uuid.uuid4().hex}", "object": "thread.run", "created_at": now,
+                   "thread_id": thread_id, "assistant_id": body.get("assistant_id"), "status": "queued",
+                   "usage": None, "ready_at": time.time() + self.draw("openai_run")}
+            self.runs[run["id"]] = run
+            return self.public(run)
+        run = self.runs[parts[4]]
+        if parts[-1] == "cancel" and run["status"] != "completed":
+            run["status"] = "cancelled"
+        elif run["status"] in ("queued", "in_progress"):
+            if time.time() >= run["ready_at"]:
+                self.message(thread_id, "assistant", "- Clear structure\n- Slow down on the numbers\n\n**Score: 7/10**")
+                run["status"] = "completed"
+                # A slide image is roughly 800 prompt tokens
+                prompt = 800 + 40 * len(self.threads[thread_id])
+                run["usage"] = {"prompt_tokens": prompt, "completion_tokens": 250, "total_tokens": prompt + 250}
+            else:
+                run["status"] = "in_progress"
+        return self.public(run)
+
+    def openai_batch(self, method, path, body, headers):
+        """Just enough of the Files and Batch APIs for reprocess.py, plus the assistant it reads."""
+        parts = path.strip("/").split("/")
+        now = int(time.time())
+        if parts[1] == "assistants":
+            return {"id": parts[2], "object": "assistant", "created_at": now, "name": "fake", "description": None,
+                    "model": "gpt-4o", "instructions": "You give feedback on presentations.", "tools": [],
+                    "metadata": {}, "temperature": 1.0, "top_p": 1.0}
+        if parts[1] == "files":
+            if method == "POST":
+                # Multipart upload; only the file part matters
+                form = email.parser.BytesParser().parsebytes(
+                    f"Content-Type: {headers.get('Content-Type', '')}\r\n\r\n".encode() + body
+                )
+                content = next(part.get_payload(decode=True) for part in form.get_payload() if part.get_filename())
+                return self.file(content, "batch")
+            return self.files[parts[2]]["content"]
+        if method == "POST" and len(parts) == 2:
+            body = json.loads(body)
+            requests = [json.loads(line) for line in self.files[body["input_file_id"]]["content"].splitlines()]
+            batch = {"id": f"batch_{uuid.uuid4().hex}", "object": "batch", "endpoint": body["endpoint"],
+                     "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                     "status": "validating", "created_at": now, "metadata": body.get("metadata"),
+                     "output_file_id": None, "error_file_id": None,
+                     "request_counts": {"total": len(requests), "completed": 0, "failed": 0},
+                     "ready_at": time.time() + self.draw("openai_batch")}
+            self.batches[batch["id"]] = (batch, requests)
+            return self.public(batch)
+        batch, requests = self.batches[parts[2]]
+        if batch["status"] != "completed":
+            if time.time() >= batch["ready_at"]:
+                self.finish_batch(batch, requests)
+            else:
+                batch["status"] = "in_progress"
+        return self.public(batch)
+
+    def finish_batch(self, batch, requests):
+        output, errors = [], []
+        for request in requests:
+            line = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"]}
+            if self.fails("openai"):
+                errors.append({**line, "response": None, "error": {"code": "server_error", "message": "injected failure"}})
+                continue
+            messages = request["body"]["messages"]
+            # A slide image is roughly 800 prompt tokens
+            prompt = sum(
+                800 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+                for m in messages for part in (m["content"] if isinstance(m["content"], list) else [{"text": m["content"]}])
+            )
+            output.append({**line, "error": None, "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                "model": request["body"]["model"], "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                    "role": "assistant", "content": "- Clearer structure\n- Slow down on the numbers\n\n**Score: 8/10**"}}],
+                "usage": {"prompt_tokens": prompt, "completion_tokens": 250, "total_tokens": prompt + 250},
+            }}})
+        if output:
+            batch["output_file_id"] = self.file("".join(json.dumps(l) + "\n" for l in output).encode(), "batch_output")["id"]
+        if errors:
+            batch["error_file_id"] = self.file("".join(json.dumps(l) + "\n" for l in errors).encode(), "batch_output")["id"]
+        batch["request_counts"].update(completed=len(output), failed=len(errors))
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    def file(self, content, purpose):
+        entry = {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(content),
+                 "created_at": int(time.time()), "filename": f"{purpose}.jsonl", "purpose": purpose}
+        self.files[entry["id"]] = {**entry, "content": content}
+        return entry
+
+    def message(self, thread_id, role, content):
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        message = {
+            "id": f"msg_{uuid.uuid4().hex}", "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "status": "completed",
+            "content": [
+                {"type": "text", "text": {"value": part["text"], "annotations": []}}
+                for part in content if part.get("type") == "text"
+            ],
+        }
+        self.threads[thread_id].append(message)
+        return message
+
+    @staticmethod
+    def public(entry):
+        return {k: v for k, v in entry.items() if k != "ready_at"}
+
+
+class Recorder:
+    """Proxies to the real providers and appends every response to `capture`."""
+
+    def __init__(self, capture, clip_seconds):
+        self.out = open(capture, "a")
+        self.lock = threading.Lock()
+        self.audio = wav(clip_seconds, 0)
+
+    def handle(self, method, path, body, headers):
+        provider = provider_of(path)
+        if provider == "audio":
+            return 200, self.audio
+        request = urllib.request.Request(UPSTREAM[provider] + path, data=body or None, method=method, headers={
+            k: v for k, v in headers.items() if k.lower() not in ("host", "content-length", "accept-encoding")
+        })
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as resp:
+                status, payload = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        with self.lock:
+            self.out.write(json.dumps({
+                "route": route(method, path), "status": status, "seconds": time.monotonic() - start,
+                "body": base64.b64encode(payload).decode(),
+            }) + "\n")
+            self.out.flush()
+        return status, payload
+
+
+class Replayer:
+    """Serves a capture back, cycling through each route's responses in order."""
+
+    def __init__(self, capture, clip_seconds):
+        self.responses = defaultdict(list)
+        with open(capture) as f:
+            for line in f:
+                entry = json.loads(line)
+                self.responses[entry["route"]].append(entry)
+        self.next = defaultdict(int)
+        self.lock = threading.Lock()
+        self.audio = wav(clip_seconds, 0)
+
+    def handle(self, method, path, body, headers=None):
+        if provider_of(path) == "audio":
+            return 200, self.audio
+        key = route(method, path)
+        with self.lock:
+            recorded = self.responses.get(key)
+            if not recorded:
+                return 404, {"error": {"message": f"nothing recorded for {key}"}}
+            entry = recorded[self.next[key] % len(recorded)]
+            self.next[key] += 1
+        time.sleep(entry["seconds"])
+        return entry["status"], base64.b64decode(entry["body"])
+
+
+def serve(backend, port=0):
+    """Start the server on a daemon thread. Returns it; the base URL is http://127.0.0.1:<server_port>."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def respond(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            status, payload = backend.handle(self.command, self.path, body, dict(self.headers))
+            if not isinstance(payload, bytes):
+                payload = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json" if payload[:1] in (b"{", b"[") else "audio/webm")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST = do_DELETE = respond
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="FakeProviders", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    server = serve(Synthetic({}, {}, clip_seconds=20), int(sys.argv[1]) if len(sys.argv) > 1 else 8089)
+    print(f"Fake providers on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
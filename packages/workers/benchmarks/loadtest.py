@@ -0,0 +1,307 @@
+"""
+Offline end-to-end load test. Synthetic S3 events go through the audio
+Lambda's handler code (lifted from infra/__main__.py), real worker1 and
+worker2 processes consume them, and fake providers answer every Deepgram,
+Hume and OpenAI call (see fake_providers.py). Reports clips/sec,
+per-presentation completion percentiles and a per-stage breakdown from
+the usage ledger, and can save them as JSON to compare runs.
+
+Needs local Redis and Mongo (and RabbitMQ with --transport rabbitmq), e.g.
+`docker run -p 6379:6379 redis:6.2-alpine`, `docker run -p 27017:27017 mongo:4.4`,
+plus ffmpeg and boto3 (the handler imports it). Where those can't run,
+benchmarks.fake_mongo and benchmarks.fake_broker stand in for Mongo and
+RabbitMQ; the timings then say nothing about either.
+
+Reference runs are kept in loadtest-*.json next to this file.
+
+    cd packages/workers && python -m benchmarks.loadtest --presentations 20 --clips 8 \\
+        [--latency openai_run=8:0.5] [--errors deepgram=0.02] \\
+        [--providers record|replay --capture capture.jsonl] [--json results.json]
+"""
+import os
+import ast
+import sys
+import json
+import time
+import uuid
+import argparse
+import subprocess
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import numpy as np
+import pika
+import redis
+from pymongo import MongoClient
+
+from benchmarks.fake_providers import serve, Synthetic, Recorder, Replayer
+from usage import USAGE_STREAM
+
+WORKERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INFRA = os.path.join(WORKERS_DIR, "..", "..", "infra", "__main__.py")
+# Paths and endpoints, left out of --json so results compare across machines
+LOCAL_ARGS = ("json", "logs", "capture", "redis", "rabbitmq", "mongo", "mongo_db")
+
+
+def load_handler(endpoint, transport, redis_url, rabbitmq_url, queue):
+    """The audio Lambda's code, exec'd as a module with its environment pointed at us."""
+    tree = ast.parse(open(INFRA).read())
+    code = {
+        node.targets[0].id: node.value.value for node in tree.body
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], "id", "").startswith("lambda_code_")
+    }
+    # As deployed: the handler with the shared publishers appended
+    source = code["lambda_code_audio"] + code["lambda_code_publish"]
+    os.environ.update({
+        "S3_BUCKET_WEBSITE_ENDPOINT": endpoint,
+        "TRANSPORT": transport,
+        "STREAM_REDIS_URL": redis_url,
+        "RABBITMQ_QUEUE": queue,
+        "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+    })
+    module = {"__name__": "lambda_audio"}
+    exec(compile(source, "lambda_code_audio", "exec"), module)
+    if transport == "rabbitmq":
+        # The Lambda talks TLS to Amazon MQ; publish the same message to the local broker
+        def publish_to_rabbitmq(message, priority, headers):
+            connection = pika.BlockingConnection(pika.URLParameters(rabbitmq_url))
+            connection.channel().basic_publish(
+                exchange="", routing_key=queue, body=json.dumps(message),
+                properties=pika.BasicProperties(delivery_mode=2, priority=priority, headers=headers),
+            )
+            connection.close()
+        module["publish_to_rabbitmq"] = publish_to_rabbitmq
+    return module["handler"]
+
+
+def s3_event(user_id, pres_id, clip, stamp, is_end):
+    key = f"Users/{user_id}/presentations/{pres_id}/clips/{clip}_{stamp}_{str(is_end).lower()}/{clip}/audio.webm"
+    return {"Records": [{"s3": {"bucket": {"name": "loadtest"}, "object": {"key": key}}}]}
+
+
+def seed_mongo(database, presentations):
+    users = database["users"]
+    for user_id, pres_id in presentations:
+        users.update_one(
+            {"googleId": user_id},
+            {"$push": {"presentations": {"_id": pres_id, "preset": {}, "clips": {}}}},
+            upsert=True,
+        )
+
+
+def start_workers(args, provider_url, first, second):
+    redis_url = urlparse(args.redis)
+    env = {
+        **os.environ,
+        "REDIS_HOST": redis_url.hostname or "localhost",
+        "REDIS_PORT": str(redis_url.port or 6379),
+        "REDIS_PASSWORD": redis_url.password or "",
+        "MONGO_URI": args.mongo,
+        "MONGO_DB": args.mongo_db,
+        "TRANSPORT": args.transport,
+        "RABBITMQ_URI": args.rabbitmq or "",
+        "FIRST_QUEUE": first,
+        "SECOND_QUEUE": second,
+        "DEEPGRAM_URL": provider_url,
+        "HUME_BASE_URL": provider_url,
+        "OPENAI_BASE_URL": f"{provider_url}/v1",
+        "DEEPGRAM_API_KEY": os.getenv("DEEPGRAM_API_KEY", "fake"),
+        "HUME_API_KEY": os.getenv("HUME_API_KEY", "fake"),
+        "OPEN_API_KEY": os.getenv("OPEN_API_KEY", "fake"),
+        "ASSISTANT_ID": os.getenv("ASSISTANT_ID", "asst_loadtest"),
+        # The load test reads the usage stream itself
+        "USAGE_ROLLUP_INTERVAL": "86400",
+        "PYTHONUNBUFFERED": "1",
+    }
+    processes = []
+    os.makedirs(args.logs, exist_ok=True)
+    for script, count in (("worker1.py", args.worker1), ("worker2.py", args.worker2)):
+        for i in range(count):
+            log = open(os.path.join(args.logs, f"{script[:-3]}-{i}.log"), "w")
+            processes.append(subprocess.Popen(
+                [sys.executable, script], cwd=WORKERS_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+            ))
+    return processes
+
+
+def wait_for_queue(rabbitmq_url, queue, timeout=60):
+    """RabbitMQ drops messages to a queue nobody declared yet; worker1 declares it on start."""
+    deadline = time.time() + timeout
+    while True:
+        connection = pika.BlockingConnection(pika.URLParameters(rabbitmq_url))
+        try:
+            connection.channel().queue_declare(queue=queue, passive=True)
+            return
+        except pika.exceptions.ChannelClosedByBroker:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.5)
+        finally:
+            if connection.is_open:
+                connection.close()
+
+
+def drive(handler, presentations, args):
+    """Each presentation records its clips at presenter pace; presentations start at --rate per second."""
+    published = defaultdict(list)
+
+    def present(user_id, pres_id):
+        for clip in range(args.clips):
+            stamp = int(time.time() * 1000)
+            handler(s3_event(user_id, pres_id, clip, stamp, clip == args.clips - 1), None)
+            published[pres_id].append(time.time())
+            if clip < args.clips - 1:
+                time.sleep(args.clip_seconds)
+
+    threads = []
+    for user_id, pres_id in presentations:
+        thread = threading.Thread(target=present, args=(user_id, pres_id), daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(1 / args.rate)
+    return threads, published
+
+
+def wait_done(r, pres_ids, timeout):
+    """When each presentation's hash was marked done by worker2."""
+    done = {}
+    deadline = time.time() + timeout
+    while len(done) < len(pres_ids) and time.time() < deadline:
+        pending = [p for p in pres_ids if p not in done]
+        pipe = r.pipeline()
+        for pres_id in pending:
+            pipe.hget(pres_id, "done")
+        for pres_id, flag in zip(pending, pipe.execute()):
+            if flag is not None:
+                done[pres_id] = time.time()
+        time.sleep(0.2)
+    return done
+
+
+def usage_entries(r, pres_ids, since_ms):
+    wanted = set(pres_ids)
+    return [
+        (int(entry_id.split("-")[0]) / 1000, fields)
+        for entry_id, fields in r.xrange(USAGE_STREAM, min=since_ms)
+        if fields["pres"] in wanted
+    ]
+
+
+def summarize(args, started, published, done, entries):
+    finished = [t for t, fields in entries if fields["worker"] == "worker2" and fields.get("ok") == "1"]
+    elapsed = (max(finished) - started) if finished else float("nan")
+    after_last = np.array([done[p] - published[p][-1] for p in done])
+    total = np.array([done[p] - published[p][0] for p in done])
+
+    stages = defaultdict(list)
+    for _, fields in entries:
+        for name, value in fields.items():
+            if name.startswith("wall_"):
+                stages[name[len("wall_"):-len("_s")]].append(float(value))
+
+    def pct(values):
+        return dict(zip(("p50", "p95", "p99"), np.percentile(values, [50, 95, 99]).round(3).tolist())) if len(values) else {}
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in LOCAL_ARGS},
+        "clips": len(finished),
+        "clips_per_s": round(len(finished) / elapsed, 3) if finished else 0,
+        "presentations_done": len(done),
+        "presentations": len(published),
+        "failed_attempts": sum(1 for _, fields in entries if fields.get("ok") == "0"),
+        "completion_after_last_clip_s": pct(after_last),
+        "completion_total_s": pct(total),
+        "stages_s": {stage: {**pct(values), "mean": round(float(np.mean(values)), 3)} for stage, values in sorted(stages.items())},
+    }
+
+
+def report(results):
+    print(f"{results['clips']} clips, {results['clips_per_s']} clips/s, "
+          f"{results['presentations_done']}/{results['presentations']} presentations done, "
+          f"{results['failed_attempts']} failed attempts")
+    print(f"\n{'':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'mean':>9}")
+    for name in ("completion_after_last_clip_s", "completion_total_s"):
+        row = results[name]
+        if row:
+            print(f"{name[:-2]:<28}{row['p50']:>9.2f}{row['p95']:>9.2f}{row['p99']:>9.2f}")
+    for stage, row in results["stages_s"].items():
+        print(f"{'stage ' + stage:<28}{row['p50']:>9.2f}{row['p95']:>9.2f}{row['p99']:>9.2f}{row['mean']:>9.2f}")
+
+
+def pairs(values, cast):
+    out = {}
+    for value in values:
+        name, _, spec = value.partition("=")
+        out[name] = cast(spec)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test")
+    parser.add_argument("--presentations", type=int, default=10)
+    parser.add_argument("--clips", type=int, default=6, help="clips per presentation")
+    parser.add_argument("--clip-seconds", type=float, default=20, help="clip length, also the gap between clips")
+    parser.add_argument("--rate", type=float, default=1.0, help="presentations started per second")
+    parser.add_argument("--worker1", type=int, default=1, help="worker1 processes")
+    parser.add_argument("--worker2", type=int, default=1,
+                        help="worker2 processes; more than one isn't supported (see worker2.py)")
+    parser.add_argument("--transport", choices=("redis", "rabbitmq"), default="redis")
+    parser.add_argument("--redis", default="redis://localhost:6379/0")
+    parser.add_argument("--rabbitmq", help="amqp:// URL, with --transport rabbitmq")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017")
+    parser.add_argument("--mongo-db", default="loadtest")
+    parser.add_argument("--providers", choices=("synthetic", "record", "replay"), default="synthetic")
+    parser.add_argument("--capture", default="capture.jsonl", help="record/replay file")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="ROUTE=MEDIAN:SIGMA",
+                        help="audio, deepgram, hume, hume_job, openai, openai_run")
+    parser.add_argument("--errors", nargs="*", default=[], metavar="PROVIDER=RATE")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--logs", default="loadtest-logs")
+    parser.add_argument("--json", help="write results here")
+    args = parser.parse_args()
+    if args.transport == "rabbitmq" and not args.rabbitmq:
+        parser.error("--transport rabbitmq needs --rabbitmq")
+
+    if args.providers == "synthetic":
+        latency = pairs(args.latency, lambda spec: tuple(float(x) for x in spec.split(":")))
+        backend = Synthetic(latency, pairs(args.errors, float), args.clip_seconds)
+    elif args.providers == "record":
+        backend = Recorder(args.capture, args.clip_seconds)
+    else:
+        backend = Replayer(args.capture, args.clip_seconds)
+    server = serve(backend)
+    provider_url = f"http://127.0.0.1:{server.server_port}"
+
+    run = uuid.uuid4().hex[:8]
+    first, second = f"loadtest_{run}_first", f"loadtest_{run}_second"
+    presentations = [(f"loadtest-user-{i % 5}", f"loadtest-{run}-{i}") for i in range(args.presentations)]
+    r = redis.Redis.from_url(args.redis, decode_responses=True)
+    database = MongoClient(args.mongo)[args.mongo_db]
+    seed_mongo(database, presentations)
+
+    processes = start_workers(args, provider_url, first, second)
+    try:
+        if args.transport == "rabbitmq":
+            wait_for_queue(args.rabbitmq, first)
+        handler = load_handler(provider_url[len("http://"):], args.transport, args.redis, args.rabbitmq, first)
+        started = time.time()
+        threads, published = drive(handler, presentations, args)
+        done = wait_done(r, [p for _, p in presentations], args.timeout + len(presentations) / args.rate
+                         + args.clips * args.clip_seconds)
+        entries = usage_entries(r, [p for _, p in presentations], int(started * 1000))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    results = summarize(args, started, published, done, entries)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Microbenchmarks for the workers' hot paths, checked against stored
+baselines so a slowdown fails before it ships.
+
+Each measurement is the best time per call over several rounds, relative
+to a fixed reference workload timed right around it, so a busy or
+throttled machine slows the reference too instead of failing every case.
+The whole suite is measured --repeat times, interleaved, and each case
+reports its median. With a baseline, a case fails when it is slower than
+baseline * (1 + limit). The limit is the case's own "threshold" from the
+baseline file if it has one. Otherwise it is --threshold, or SPREAD_FACTOR
+times the spread --save measured across repeats, whichever is larger:
+some cases (fakeredis, numpy) swing more than others run to run. Baselines
+are still best recorded with --save on the box that runs the check.
+
+Redis cases run against fakeredis unless --redis is given; the Mongo case
+needs --mongo and is skipped without it.
+
+    cd packages/workers && python -m benchmarks.micro [--only drain] [--save] \\
+        [--baseline benchmarks/baselines.json] [--threshold 0.25] [--repeat 5] \\
+        [--redis redis://localhost:6379/15] [--mongo mongodb://localhost:27017]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import fakeredis
+import numpy as np
+import redis
+
+# worker2 builds its clients on import; keep it off RabbitMQ and give OpenAI a key
+os.environ.setdefault("TRANSPORT", "redis")
+os.environ.setdefault("OPEN_API_KEY", "bench")
+os.environ.setdefault("MONGO_DB", "microbench")
+
+from messages import encode_job, decode_job, parse
+from emotions import load_predictions, score, pack_timeline
+from benchmarks.fake_providers import EMOTIONS
+from benchmarks.bench_messages import job as sample_job
+from benchmarks.loadtest import load_handler, s3_event
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_THRESHOLD = float(os.getenv("MICROBENCH_THRESHOLD", 0.25))
+DEFAULT_REPEAT = int(os.getenv("MICROBENCH_REPEAT", 5))
+# A case's limit is at least this many times its recorded spread
+SPREAD_FACTOR = 2.0
+PRES = "microbench-pres"
+
+# Hume's prosody model scores this many emotions per segment
+EMOTION_NAMES = [f"{EMOTIONS[i % len(EMOTIONS)]}{i}" for i in range(48)]
+
+
+def timed(fn, setup=None, number=100, rounds=7):
+    """Best seconds per call of fn(); setup() runs before each call, outside the clock."""
+    samples = []
+    for _ in range(rounds + 1):
+        elapsed = 0.0
+        for _ in range(number):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            elapsed += time.perf_counter() - start
+        samples.append(elapsed / number)
+    # The first round warms caches and connections; the fastest is the least disturbed
+    return min(samples[1:])
+
+
+REFERENCE = {"clips": [{"id": i, "text": "word " * 20, "score": i / 7} for i in range(50)]}
+
+
+def reference():
+    """Interpreter-bound work that doesn't change with our code, to scale by machine speed."""
+    sorted(json.loads(json.dumps(REFERENCE))["clips"], key=lambda clip: -clip["score"])
+
+
+class Worker2Cases:
+    def __init__(self, redis_url):
+        import worker2
+        self.w = worker2
+        if redis_url:
+            worker2.redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+            worker2.redis_bytes = redis.Redis.from_url(redis_url)
+        else:
+            server = fakeredis.FakeServer()
+            worker2.redis_client = fakeredis.FakeRedis(server=server, decode_responses=True)
+            worker2.redis_bytes = fakeredis.FakeRedis(server=server)
+        # Stand-in for the GPT stage, so the drain measures only its own bookkeeping
+        worker2.process_gpt_job = lambda job_data: None
+        self.r = worker2.redis_client
+
+    def reset(self, pending=()):
+        self.r.delete(PRES)
+        self.r.hset(PRES, mapping={"next": 0, "thread_id": "thread_bench", "pending": json.dumps({})})
+        for clip in pending:
+            data = self.clip(clip)
+            self.w.redis_park_job(data)
+            self.w.addPendingClip(PRES, str(clip))
+
+    @staticmethod
+    def clip(clip_id):
+        return {**sample_job(150), "PRESENTATION_ID": PRES, "CLIP_ID": str(clip_id), "IS_END": "false"}
+
+    def cases(self):
+        w = self.w
+        clip = self.clip(3)
+        yield "redis get_next", lambda: w.redis_get_next(PRES), self.reset, 500
+        yield "redis get_threadid", lambda: w.redis_get_threadid(PRES), None, 500
+        yield "redis park+get clip", lambda: (w.redis_park_job(clip), w.redis_get_job_data(PRES, "3")), None, 500
+        yield "redis add+remove pending", lambda: (w.addPendingClip(PRES, "3"), w.removePendingClip(PRES, "3")), None, 500
+        for n in (10, 100, 1000):
+            # Clip 0 arrives last and releases n parked clips
+            yield (f"drain {n} clips", lambda: w.handle_job(self.clip(0)),
+                   lambda n=n: self.reset(range(1, n + 1)), max(1, 200 // n))
+
+
+def mongo_cases(mongo_url):
+    from pymongo import MongoClient
+    import worker2
+    database = MongoClient(mongo_url)["microbench"]
+    worker2.database = database
+    database["users"].delete_many({"googleId": "microbench-user"})
+    database["users"].insert_one({"googleId": "microbench-user", "presentations": [{"_id": PRES, "clips": {}}]})
+    data = {**sample_job(150), "PRESENTATION_ID": PRES, "CLIP_ID": "3"}
+    yield "mongo update_db", lambda: worker2.update_db("microbench-user", PRES, "3", "- feedback " * 50, data), None, 50
+
+
+def hume_response(segments, rng):
+    """The attribute shape load_predictions walks, without needing the hume SDK."""
+    predictions = [
+        SimpleNamespace(
+            time=SimpleNamespace(begin=i * 2.0, end=i * 2.0 + 2.0),
+            emotions=[SimpleNamespace(name=n, score=float(s)) for n, s in zip(EMOTION_NAMES, row)],
+        )
+        for i, row in enumerate(rng.dirichlet(np.ones(len(EMOTION_NAMES)), size=segments))
+    ]
+    model = SimpleNamespace(prosody=SimpleNamespace(grouped_predictions=[SimpleNamespace(predictions=predictions)]))
+    return [SimpleNamespace(results=SimpleNamespace(predictions=[SimpleNamespace(file="segment_0_audio.webm", models=model)]))]
+
+
+def emotion_cases():
+    rng = np.random.default_rng(0)
+    for minutes, segments in ((1, 30), (10, 300)):
+        response = hume_response(segments, rng)
+
+        def parse_and_score(response=response):
+            names, matrix, begin, end = load_predictions(response, {"segment_0_audio.webm": 0.0})
+            scored = score(names, matrix, begin, end)
+            pack_timeline(begin, end, scored["confidence"])
+        yield f"emotions {minutes} min clip", parse_and_score, None, 50
+
+
+def message_cases():
+    r = fakeredis.FakeRedis()
+    data = sample_job(150)
+    body = encode_job(data, r)
+    lambda_body = json.dumps({
+        "userID": "109876543210987654321", "presentationID": "6718f0c2a1b2c3d4e5f60718", "clipIndex": "3",
+        "clipTimestamp": "1729350000000", "isEnd": "false", "slideURL": "http://bucket/slides/slide_3.png",
+        "audioURL": "http://bucket/clips/3/audio.webm", "videoURL": "http://bucket/clips/3/video.webm",
+    }).encode()
+    yield "message encode", lambda: encode_job(data, r), None, 2000
+    yield "message decode", lambda: decode_job(body, r), None, 2000
+    yield "message parse lambda json", lambda: parse(lambda_body), None, 5000
+
+
+def lambda_cases():
+    handler = load_handler("bucket.s3-website-us-east-1.amazonaws.com", "redis", "redis://unused", None, "bench")
+    # Everything but the network publish
+    handler.__globals__["publish_to_redis_stream"] = lambda message, priority, headers: None
+    event = s3_event("109876543210987654321", "6718f0c2a1b2c3d4e5f60718", 3, 1729350000000, False)
+    yield "lambda parse+build", lambda: handler(event, None), None, 2000
+
+
+def measure(fn, setup, number):
+    """(us per call, reference us per call timed around it)."""
+    before = timed(reference, number=200, rounds=3)
+    # The workers print per clip; keep that out of the report, not out of the timing
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        seconds = timed(fn, setup, number)
+    # Machine speed drifts, so compare against the reference timed around this case
+    return seconds * 1e6, (before + timed(reference, number=200, rounds=3)) / 2 * 1e6
+
+
+def run(args):
+    """name -> (us, reference_us, spread): the median repeat, and how far the repeats ranged around it."""
+    groups = [Worker2Cases(args.redis).cases(), emotion_cases(), message_cases(), lambda_cases()]
+    if args.mongo:
+        groups.append(mongo_cases(args.mongo))
+    else:
+        print("mongo update_db: skipped, no --mongo")
+    cases = [case for group in groups for case in group if not args.only or re.search(args.only, case[0])]
+    samples = {name: [] for name, *_ in cases}
+    # Whole passes rather than one case at a time, so a slow spell hits one sample of many cases
+    for _ in range(args.repeat):
+        for name, fn, setup, number in cases:
+            samples[name].append(measure(fn, setup, number))
+    results = {}
+    for name, measured in samples.items():
+        ratios = sorted(us / reference_us for us, reference_us in measured)
+        median = statistics.median_low(ratios)
+        us, reference_us = next(m for m in measured if m[0] / m[1] == median)
+        results[name] = (us, reference_us, (ratios[-1] - ratios[0]) / median)
+    return results
+
+
+def limit(base, threshold):
+    if "threshold" in base:
+        return base["threshold"]
+    return max(threshold, SPREAD_FACTOR * base.get("spread", 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker hot-path microbenchmarks")
+    parser.add_argument("--only", help="regex on case names")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="record these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="passes over the suite, the median counts")
+    parser.add_argument("--redis")
+    parser.add_argument("--mongo")
+    args = parser.parse_args()
+
+    results = run(args)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+
+    failed = []
+    print(f"{'case':<28}{'us/call':>12}{'spread':>8}{'baseline':>12}{'change':>9}{'limit':>8}")
+    for name, (us, reference_us, spread) in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<28}{us:>12.1f}{spread:>8.0%}{'-':>12}")
+            continue
+        change = (us / reference_us) / (base["us"] / base["reference_us"]) - 1
+        allowed = limit(base, args.threshold)
+        flag = " FAIL" if change > allowed else ""
+        if flag:
+            failed.append(name)
+        print(f"{name:<28}{us:>12.1f}{spread:>8.0%}{base['us']:>12.1f}{change:>+8.0%}{allowed:>+7.0%}{flag}")
+
+    if args.save:
+        # Keep per-case thresholds someone tuned by hand
+        cases = {**baseline, **{
+            name: {**baseline.get(name, {}), "us": round(us, 2), "reference_us": round(reference_us, 2),
+                   "spread": round(spread, 3)}
+            for name, (us, reference_us, spread) in results.items()
+        }}
+        with open(args.baseline, "w") as f:
+            json.dump({"recorded": time.strftime("%Y-%m-%d"), "python": sys.version.split()[0], "cases": cases}, f, indent=2)
+            f.write("\n")
+        print(f"Saved {len(cases)} case(s) to {args.baseline}")
+    elif failed:
+        print(f"{len(failed)} regression(s) over threshold: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+def noise(seconds, db=-60.0, rng=None):
+    rng = rng or np.random.default_rng(0)
+    amp = 10 ** (db / 20.0)
+    return (rng.standard_normal(int(seconds * SAMPLE_RATE)) * amp).astype(np.float32)
+
+
+def speech(seconds, db=-20.0, rng=None):
+    """Voiced, syllable-rate amplitude-modulated harmonics. Not speech, but VAD can't tell."""
+    rng = rng or np.random.default_rng(1)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi)))
+    signal = voiced * envelope
+    signal *= 10 ** (db / 20.0) / (np.sqrt(np.mean(signal ** 2)) + 1e-9)
+    return signal.astype(np.float32)
+
+
+def clip(pattern, floor_db=-60.0, seed=0):
+    """
+    Build a clip from a list of ("speech" | "silence", seconds) pairs on top
+    of a constant noise floor. Returns s16le PCM bytes.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [speech(sec, rng=rng) if kind == "speech" else np.zeros(int(sec * SAMPLE_RATE), np.float32)
+             for kind, sec in pattern]
+    signal = np.concatenate(parts) if parts else np.zeros(0, np.float32)
+    signal = signal + noise(len(signal) / SAMPLE_RATE, floor_db, rng)
+    return (np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def monologue(seconds, phrase=6.0, pause=0.8, seed=0):
+    """A long clip of phrases separated by short pauses."""
+    pattern = [("silence", 0.5)]
+    while sum(sec for _, sec in pattern) < seconds:
+        pattern += [("speech", phrase), ("silence", pause)]
+    return clip(pattern, seed=seed)
@@ -0,0 +1,165 @@
+import os
+import time
+import signal
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+import health
+from metrics import DRAIN_SECONDS, tracked, record_outcome
+from retry import declare_topology, retry_later
+from ratelimit import ProviderUnavailable
+from scheduler import FairScheduler, PRIORITY_NORMAL
+from tracing import run_consumer
+from log import get_logger
+
+log = get_logger("consumer")
+
+RABBITMQ_HEARTBEAT = int(os.getenv("RABBITMQ_HEARTBEAT", 60))
+RABBITMQ_BLOCKED_TIMEOUT = int(os.getenv("RABBITMQ_BLOCKED_TIMEOUT", 300))
+
+# Set by SIGTERM (docker stop, the supervisor scaling down): stop taking work,
+# finish and ack what's running, then return from the consume loop
+DRAINING = threading.Event()
+
+
+def drain_on_sigterm():
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: DRAINING.set())
+    except ValueError:
+        # Not the main thread, whoever owns it handles signals
+        pass
+
+
+def connection_params(url):
+    params = pika.URLParameters(url)
+    params.heartbeat = RABBITMQ_HEARTBEAT
+    params.blocked_connection_timeout = RABBITMQ_BLOCKED_TIMEOUT
+    return params
+
+
+def _finish(channel, queue, method, properties, body, future):
+    """Ack or reschedule a finished job. Always runs on the connection's thread."""
+    error = future.exception()
+    if isinstance(error, ProviderUnavailable):
+        # Provider is degraded, wait at least until the breaker may close
+        log.warning("%s. Retrying later.", error)
+        retry_later(channel, queue, body, properties, error, min_delay=error.retry_after)
+    elif error is not None:
+        log.error("Error processing message: %s", error)
+        retry_later(channel, queue, body, properties, error)
+    # Only ack once the work is done or safely rescheduled
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+    record_outcome(queue, error)
+
+
+def _marshal(connection, callback):
+    try:
+        connection.add_callback_threadsafe(callback)
+    except Exception as e:
+        # The delivery dies with the connection and will be redelivered;
+        # the ledger makes the second run cheap
+        log.warning("Connection closed before ack: %s", e)
+
+
+def message_priority(body, properties):
+    return properties.priority if properties.priority is not None else PRIORITY_NORMAL
+
+
+def start_consumer(url, queue, process, name, concurrency=1, prefetch=None, fair_key=None,
+                   priority=message_priority, head_of_line=None):
+    """
+    Consume `queue`, running process(body) on a thread pool so long jobs
+    never block the pika I/O loop and heartbeats keep flowing. Acks and
+    retries are handed back to the connection thread with
+    add_callback_threadsafe, since pika channels are not thread-safe.
+
+    Up to `prefetch` deliveries are buffered locally and handed to the pool
+    by a FairScheduler keyed on fair_key(body), so one large presentation
+    can't monopolise the worker. priority(body, properties) picks the lane.
+    head_of_line.key(body) tags a delivery as it arrives, and whichever
+    buffered delivery head_of_line.is_head(tag) accepts when a slot frees
+    goes first. Both run on the I/O thread, so neither may block.
+    """
+    prefetch = max(prefetch or concurrency, concurrency)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+    process = tracked(queue, process)
+    drain_on_sigterm()
+    while not DRAINING.is_set():
+        try:
+            connection = pika.BlockingConnection(connection_params(url))
+            channel = connection.channel()
+            declare_topology(channel, queue)
+            channel.basic_qos(prefetch_count=prefetch)
+
+            # Per connection: deliveries from a dead channel are redelivered anyway
+            scheduler = FairScheduler()
+            in_flight = [0]
+            drain_started = []
+
+            def dispatch():
+                while in_flight[0] < concurrency and len(scheduler) and not drain_started:
+                    delivery = scheduler.pop(head_of_line.is_head if head_of_line else None)
+                    in_flight[0] += 1
+                    future = pool.submit(run_consumer, queue, delivery[2].headers, process, delivery[3])
+                    future.add_done_callback(lambda f, d=delivery: _marshal(
+                        connection, functools.partial(done, d, f)
+                    ))
+
+            def done(delivery, future):
+                in_flight[0] -= 1
+                _finish(delivery[0], queue, *delivery[1:], future)
+                dispatch()
+                if drain_started and not in_flight[0]:
+                    drained()
+
+            def drained():
+                seconds = time.monotonic() - drain_started[0]
+                DRAIN_SECONDS.observe(seconds)
+                log.info("%s drained in %.1fs", name, seconds)
+                channel.stop_consuming()
+
+            def watch_drain():
+                if not DRAINING.is_set():
+                    health.beat()
+                    connection.call_later(0.5, watch_drain)
+                    return
+                health.draining()
+                drain_started.append(time.monotonic())
+                log.info("%s draining: %d in flight, %d buffered", name, in_flight[0], len(scheduler))
+                channel.basic_cancel(consumer_tag)
+                # Buffered deliveries go straight back to the queue for the other workers
+                while len(scheduler):
+                    ch, method = scheduler.pop()[:2]
+                    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+                if not in_flight[0]:
+                    drained()
+
+            def on_message(ch, method, properties, body):
+                key = fair_key(body) if fair_key else None
+                tag = head_of_line.key(body) if head_of_line else None
+                scheduler.push(key, (ch, method, properties, body), priority(body, properties), tag=tag)
+                dispatch()
+
+            log.info("%s waiting for messages in %s", name, queue)
+            consumer_tag = channel.basic_consume(queue=queue, on_message_callback=on_message)
+            connection.call_later(0.5, watch_drain)
+            health.broker_up(True)
+            channel.start_consuming()
+            # Only returns once drained
+            connection.close()
+        except pika.exceptions.AMQPConnectionError as e:
+            health.broker_up(False)
+            log.warning("Connection error: %s. Retrying in 5 seconds...", e)
+            time.sleep(5)
+        except KeyboardInterrupt:
+            log.info("%s stopped.", name)
+            pool.shutdown(wait=True)
+            break
+        except Exception as e:
+            health.broker_up(False)
+            log.error("Unexpected error: %s. Retrying in 5 seconds...", e)
+            time.sleep(5)
+    pool.shutdown(wait=True)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Inspect and replay dead-lettered messages: the `<queue>.dlq` queue, or
+with TRANSPORT=redis the `<queue>.dlq` stream.
+
+    python dlq.py list TRANSCRIPTION [--limit 20]
+    python dlq.py replay TRANSCRIPTION [--count 5]
+    python dlq.py purge TRANSCRIPTION
+"""
+import os
+import sys
+import json
+import argparse
+import pika
+import redis
+
+from retry import dead_letter_queue, declare_topology, RETRY_HEADER
+from messages import parse
+from transport import TRANSPORT, entry_fields
+
+RABBITMQ_URL = os.getenv("RABBITMQ_URI")
+# Entries read per round trip when replaying a stream
+STREAM_BATCH = 100
+
+
+def connect():
+    if not RABBITMQ_URL:
+        print("RABBITMQ_URL is not defined in the environment variables.")
+        sys.exit(1)
+    connection = pika.BlockingConnection(pika.URLParameters(RABBITMQ_URL))
+    return connection, connection.channel()
+
+
+def readable(body):
+    """SECOND_QUEUE's msgpack bodies unpacked (claim-check refs left as keys), anything else as text."""
+    try:
+        return parse(body)
+    except ValueError:
+        return body.decode(errors="replace")
+
+
+def list_messages(queue, limit):
+    connection, channel = connect()
+    dlq = dead_letter_queue(queue)
+    count = channel.queue_declare(queue=dlq, durable=True).method.message_count
+    print(f"{dlq}: {count} message(s)")
+    for _ in range(min(limit, count)):
+        method, properties, body = channel.basic_get(dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = properties.headers or {}
+        print(json.dumps({
+            "retries": headers.get(RETRY_HEADER),
+            "error": headers.get("x-last-error"),
+            "body": readable(body),
+        }, indent=2, default=str))
+    # Closing without acking puts every message we peeked at back on the queue
+    connection.close()
+
+
+def replay(queue, count):
+    connection, channel = connect()
+    declare_topology(channel, queue)
+    dlq = dead_letter_queue(queue)
+    replayed = 0
+    while count is None or replayed < count:
+        method, properties, body = channel.basic_get(dlq, auto_ack=False)
+        if method is None:
+            break
+        headers = dict(properties.headers or {})
+        target = headers.pop("x-original-queue", queue)
+        headers.pop(RETRY_HEADER, None)
+        channel.basic_publish(
+            exchange="",
+            routing_key=target,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.DeliveryMode.Persistent,
+                headers=headers,
+                priority=properties.priority,
+            ),
+        )
+        channel.basic_ack(method.delivery_tag)
+        replayed += 1
+    print(f"Replayed {replayed} message(s) from {dlq}")
+    connection.close()
+
+
+def purge(queue):
+    connection, channel = connect()
+    dlq = dead_letter_queue(queue)
+    purged = channel.queue_purge(dlq).method.message_count
+    print(f"Purged {purged} message(s) from {dlq}")
+    connection.close()
+
+
+def stream_client():
+    # Not decoded: bodies may be msgpack
+    return redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD", ""),
+    )
+
+
+def stream_list_messages(queue, limit):
+    client = stream_client()
+    dlq = dead_letter_queue(queue)
+    print(f"{dlq}: {client.xlen(dlq)} message(s)")
+    for entry_id, raw in client.xrange(dlq, count=limit):
+        fields = entry_fields(raw)
+        print(json.dumps({
+            "id": entry_id.decode(),
+            "retries": fields["retries"],
+            "error": raw.get(b"error", b"").decode(errors="replace") or None,
+            "body": readable(fields["body"]),
+        }, indent=2, default=str))
+
+
+def stream_replay(queue, count):
+    client = stream_client()
+    dlq = dead_letter_queue(queue)
+    replayed = 0
+    while count is None or replayed < count:
+        batch = STREAM_BATCH if count is None else min(STREAM_BATCH, count - replayed)
+        entries = client.xrange(dlq, count=batch)
+        if not entries:
+            break
+        pipe = client.pipeline()
+        for entry_id, raw in entries:
+            fields = entry_fields(raw)
+            # A fresh set of retries, as on RabbitMQ
+            pipe.xadd(queue, {
+                "body": fields["body"], "priority": fields["priority"], "retries": 0,
+                "headers": json.dumps(fields["headers"]),
+            })
+            pipe.xdel(dlq, entry_id)
+        pipe.execute()
+        replayed += len(entries)
+    print(f"Replayed {replayed} message(s) from {dlq}")
+
+
+def stream_purge(queue):
+    client = stream_client()
+    dlq = dead_letter_queue(queue)
+    pipe = client.pipeline()
+    pipe.xlen(dlq)
+    pipe.delete(dlq)
+    purged, _ = pipe.execute()
+    print(f"Purged {purged} message(s) from {dlq}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and replay dead-lettered messages")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("list")
+    p.add_argument("queue")
+    p.add_argument("--limit", type=int, default=20)
+    p = sub.add_parser("replay")
+    p.add_argument("queue")
+    p.add_argument("--count", type=int, default=None)
+    p = sub.add_parser("purge")
+    p.add_argument("queue")
+    args = parser.parse_args()
+
+    streams = TRANSPORT == "redis"
+    if args.command == "list":
+        (stream_list_messages if streams else list_messages)(args.queue, args.limit)
+    elif args.command == "replay":
+        (stream_replay if streams else replay)(args.queue, args.count)
+    else:
+        (stream_purge if streams else purge)(args.queue)
@@ -0,0 +1,87 @@
+import os
+import json
+import base64
+import numpy as np
+
+BAD_EMOTIONS = ["Awkwardness", "Anxiety", "Confusion", "Doubt", "Embarrassment", "Fear", "Tiredness"]
+GOOD_EMOTIONS = ["Calmness", "Concentration", "Determination", "Excitement", "Interest", "Joy"]
+
+# Same score as the old good_avg - bad_avg, expressed as weights
+DEFAULT_WEIGHTS = {
+    **{name: -1.0 / len(BAD_EMOTIONS) for name in BAD_EMOTIONS},
+    **{name: 1.0 / len(GOOD_EMOTIONS) for name in GOOD_EMOTIONS},
+}
+
+# e.g. EMOTION_WEIGHTS='{"Anxiety": -0.3, "Calmness": 0.2}' replaces the defaults
+EMOTION_WEIGHTS = json.loads(os.getenv("EMOTION_WEIGHTS", "null")) or DEFAULT_WEIGHTS
+EMOTION_TOP_K = int(os.getenv("EMOTION_TOP_K", 3))
+
+
+def load_predictions(audio_resp, offsets=None):
+    """
+    Flatten every prosody prediction of a Hume job into a segments x emotions
+    float32 matrix. `offsets` maps a prediction's file name to where that
+    file starts in the clip, so begin/end are clip-relative.
+    Returns (names, matrix, begin, end).
+    """
+    offsets = offsets or {}
+    names = None
+    rows = []
+    begin = []
+    end = []
+    for source in audio_resp:
+        for prediction in source.results.predictions:
+            offset = offsets.get(prediction.file, 0.0)
+            for group in prediction.models.prosody.grouped_predictions:
+                for p in group.predictions:
+                    if names is None:
+                        names = [e.name for e in p.emotions]
+                    rows.append([e.score for e in p.emotions])
+                    begin.append(offset + p.time.begin)
+                    end.append(offset + p.time.end)
+
+    if not rows:
+        return [], np.zeros((0, 0), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)
+    return (
+        names,
+        np.asarray(rows, dtype=np.float32),
+        np.asarray(begin, dtype=np.float32),
+        np.asarray(end, dtype=np.float32),
+    )
+
+
+def weight_vector(names, weights=None):
+    weights = EMOTION_WEIGHTS if weights is None else weights
+    return np.array([weights.get(name, 0.0) for name in names], dtype=np.float32)
+
+
+def score(names, matrix, begin, end, weights=None, top_k=EMOTION_TOP_K):
+    """
+    Score a clip from its prediction matrix.
+    confidence is 0-100 per segment, the overall score is the
+    duration-weighted mean of it and top emotions come from the
+    duration-weighted mean of every emotion column.
+    """
+    durations = np.maximum(end - begin, 1e-3)
+    share = durations / durations.sum()
+
+    confidence = np.clip(50.0 * (matrix @ weight_vector(names, weights) + 1.0), 0.0, 100.0)
+    overall = float(share @ confidence)
+
+    means = share @ matrix
+    top = np.argsort(-means)[:top_k]
+    return {
+        'top': [names[i] for i in top],
+        'score': overall,
+        'confidence': confidence.astype(np.float32),
+    }
+
+
+def pack_timeline(begin, end, confidence):
+    """Base64 of little-endian float32 rows of (begin, end, confidence)."""
+    rows = np.column_stack((begin, end, confidence)).astype("<f4")
+    return base64.b64encode(rows.tobytes()).decode("ascii")
+
+
+def unpack_timeline(packed):
+    return np.frombuffer(base64.b64decode(packed), dtype="<f4").reshape(-1, 3)
@@ -0,0 +1,175 @@
+"""
+Liveness and readiness for the workers, served on HEALTH_PORT:
+
+  /livez   200 while the consume loop keeps turning (or the process is
+           still starting), 503 once it has been stuck LIVENESS_TIMEOUT
+  /readyz  200 once warmed up and consuming with the broker, Redis and
+           Mongo all answering; 503 while starting, draining or when one
+           of them is down
+
+Both return the state as JSON, e.g.
+{"ready": false, "checks": {"broker": "ok", "redis": "ok", "mongo": "ServerSelectionTimeoutError: ..."}}
+
+The supervisor serves the same endpoints with its own readiness (see
+supervisor.py).
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import COLD_START_SECONDS
+from log import get_logger
+
+log = get_logger("health")
+
+# 0 disables the endpoint
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", 0))
+LIVENESS_TIMEOUT = float(os.getenv("LIVENESS_TIMEOUT", 60))
+# Probes inside this window reuse the last result instead of pinging again
+CHECK_TTL = float(os.getenv("HEALTH_CHECK_TTL", 5))
+
+_IMPORTED = time.monotonic()
+_checks = {}
+_results = {}
+_lock = threading.Lock()
+_state = {"warm": False, "broker": False, "draining": False, "beat": None, "cold_start": None}
+
+
+def process_age():
+    """Seconds since this process started, interpreter and imports included."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _IMPORTED
+
+
+def describe(error):
+    # pymongo's errors carry the whole topology description
+    return f"{type(error).__name__}: {error}"[:200]
+
+
+def register(name, check):
+    """check() raises when `name` is unhealthy."""
+    _checks[name] = check
+
+
+def beat():
+    """The consume loop is still turning."""
+    _state["beat"] = time.monotonic()
+
+
+def broker_up(up):
+    _state["broker"] = up
+    beat()
+    _maybe_started()
+
+
+def draining():
+    _state["draining"] = True
+
+
+def warm_up(steps, wait=True):
+    """
+    Run steps (name -> fn) at once: client construction, SDK imports and
+    first connections. With wait=False it runs in the background, alongside
+    the broker connection; jobs that arrive first wait on the Lazy clients.
+    """
+    if not wait:
+        threading.Thread(target=warm_up, args=(steps,), name="WarmUp", daemon=True).start()
+        return
+    start = time.monotonic()
+
+    def timed(name, step):
+        t = time.monotonic()
+        try:
+            step()
+            return f"{name} {time.monotonic() - t:.2f}s"
+        except Exception as e:
+            # Not fatal: readiness reports it until it recovers
+            return f"{name} failed after {time.monotonic() - t:.2f}s ({describe(e)})"
+
+    with ThreadPoolExecutor(max_workers=len(steps) or 1, thread_name_prefix="WarmUp") as pool:
+        done = list(pool.map(lambda item: timed(*item), steps.items()))
+    log.info("Warmed up in %.2fs: %s", time.monotonic() - start, ", ".join(done))
+    _state["warm"] = True
+    _maybe_started()
+
+
+def _maybe_started():
+    if _state["warm"] and _state["broker"] and _state["cold_start"] is None:
+        _state["cold_start"] = process_age()
+        COLD_START_SECONDS.set(_state["cold_start"])
+        log.info("Ready %.2fs after process start", _state["cold_start"])
+
+
+def _run_checks():
+    now = time.monotonic()
+    with _lock:
+        for name, check in _checks.items():
+            checked = _results.get(name)
+            if checked and now - checked[0] < CHECK_TTL:
+                continue
+            try:
+                check()
+                _results[name] = (now, "ok")
+            except Exception as e:
+                _results[name] = (now, describe(e))
+        return {name: result for name, (_, result) in _results.items()}
+
+
+def live():
+    since = _state["beat"] if _state["beat"] is not None else _IMPORTED
+    return time.monotonic() - since < LIVENESS_TIMEOUT
+
+
+def readiness():
+    checks = {"broker": "ok" if _state["broker"] else "not consuming", **_run_checks()}
+    ready = _state["warm"] and not _state["draining"] and all(result == "ok" for result in checks.values())
+    return ready, checks
+
+
+def worker_readiness():
+    ok, checks = readiness()
+    return ok, {"ready": ok, "draining": _state["draining"], "cold_start_s": _state["cold_start"], "checks": checks}
+
+
+def start_health(port=HEALTH_PORT, ready=worker_readiness):
+    """Serve /livez and /readyz; ready() returns (ok, JSON body) for /readyz."""
+    if not port:
+        return
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/livez":
+                ok, body = live(), {"live": live()}
+            elif self.path == "/readyz":
+                ok, body = ready()
+            else:
+                self.send_error(404)
+                return
+            payload = json.dumps(body).encode()
+            try:
+                self.send_response(200 if ok else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # The prober gave up waiting (the supervisor's own is short)
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="Health", daemon=True).start()
+    log.info("Health on :%s/livez and :%s/readyz", port, port)
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from tracing import in_context, annotate
+from log import get_logger
+
+log = get_logger("hedging")
+
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+# Clips worker2 is blocked on hedge earlier
+HEDGE_HEAD_PERCENTILE = float(os.getenv("HEDGE_HEAD_PERCENTILE", 75))
+# Fraction of calls that may be duplicated, and how many hedges can burst at once
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", 0.05))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", 5))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", 200))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", 16))
+
+_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+
+
+class Hedger:
+    """
+    Issues a backup request once the primary has been running longer than
+    the observed p95 latency, and returns whichever finishes first.
+
+    The wrapped function receives a threading.Event; it is set on the
+    attempt that lost so polling loops can stop early. A token budget caps
+    extra spend at HEDGE_BUDGET of all calls.
+    """
+
+    def __init__(self, name, default_delay, min_delay=0.0, max_delay=None,
+                 percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET, burst=HEDGE_BURST):
+        self.name = name
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.latencies = deque(maxlen=HEDGE_WINDOW)
+        self.tokens = burst
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def observe(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def threshold(self, percentile=None):
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                delay = self.default_delay
+            else:
+                delay = float(np.percentile(self.latencies, percentile or self.percentile))
+        delay = max(delay, self.min_delay)
+        return delay if self.max_delay is None else min(delay, self.max_delay)
+
+    def record_call(self):
+        with self.lock:
+            self.calls += 1
+            self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def try_acquire(self):
+        with self.lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    def call(self, fn, *args, delay=None, expedite=False, **kwargs):
+        self.record_call()
+        start = time.monotonic()
+        if delay is None:
+            delay = self.threshold(HEDGE_HEAD_PERCENTILE if expedite else None)
+
+        stops = [threading.Event()]
+        futures = [_executor.submit(in_context(fn), stops[0], *args, **kwargs)]
+        done, _ = wait(futures, timeout=delay)
+
+        if not done and self.try_acquire():
+            log.info("[hedge] %s slower than %.1fs, issuing backup", self.name, delay)
+            stops.append(threading.Event())
+            futures.append(_executor.submit(in_context(fn), stops[1], *args, **kwargs))
+            annotate(**{f"hedge.{self.name}": True})
+
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is not None:
+                    error = fut.exception()
+                    continue
+                # Tell the loser to give up; a request already in flight just gets dropped
+                for other, stop in zip(futures, stops):
+                    if other is not fut:
+                        stop.set()
+                        other.cancel()
+                # When the backup wins this is a lower bound on the primary's latency,
+                # which keeps the threshold from drifting down after every hedge
+                self.observe(time.monotonic() - start)
+                return fut.result()
+        raise error
+
+
+HEDGERS = {
+    "deepgram": Hedger("deepgram", default_delay=30.0, min_delay=2.0),
+    "hume": Hedger("hume", default_delay=60.0, min_delay=5.0),
+    "openai_run": Hedger("openai_run", default_delay=45.0, min_delay=5.0),
+}
@@ -0,0 +1,27 @@
+import threading
+
+
+class Lazy:
+    """
+    A client built by factory() on first use. Importing a worker then costs
+    neither the provider SDK imports nor any connection; start_worker warms
+    them up in parallel instead (see health.warm_up).
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Lifetime of the per-presentation Redis hashes: expire them once the
+presentation is complete, sweep the ones nobody finished, and report what
+they cost.
+
+    python lifecycle.py report [--top 20]
+    python lifecycle.py sweep [--scan] [--dry-run]
+"""
+import os
+import json
+import time
+import zlib
+import argparse
+import threading
+from collections import defaultdict
+
+import msgpack
+import redis
+
+from log import get_logger
+
+log = get_logger("lifecycle")
+
+# Kept around after completion for late redeliveries
+DONE_TTL = int(os.getenv("PRESENTATION_DONE_TTL", 24 * 3600))
+# No clip in this long means the user walked away
+ABANDONED_AFTER = int(os.getenv("PRESENTATION_ABANDONED_AFTER", 7 * 24 * 3600))
+SWEEP_INTERVAL = int(os.getenv("PRESENTATION_SWEEP_INTERVAL", 3600))
+
+ACTIVE_KEY = "presentations:active"
+SWEEP_LOCK = "presentations:sweep-lock"
+# Parked clips at or above this size are compressed
+COMPRESS_BYTES = int(os.getenv("CLIP_COMPRESS_BYTES", 512))
+_PACKED = b"\x01"
+_COMPRESSED = b"\x02"
+
+
+def pack_clip(job):
+    """Parked clip as msgpack, zlib'd when large. Much smaller than the old JSON."""
+    packed = msgpack.packb(job)
+    if len(packed) >= COMPRESS_BYTES:
+        return _COMPRESSED + zlib.compress(packed)
+    return _PACKED + packed
+
+
+def unpack_clip(raw):
+    if raw[:1] == _COMPRESSED:
+        return msgpack.unpackb(zlib.decompress(raw[1:]))
+    if raw[:1] == _PACKED:
+        return msgpack.unpackb(raw[1:])
+    # Written before compaction
+    return json.loads(raw)
+
+
+def touch(redis_client, pres_id):
+    redis_client.zadd(ACTIVE_KEY, {pres_id: time.time()})
+
+
+def finish(redis_client, pres_id):
+    """The presentation is complete: stop tracking it and let the hash expire."""
+    pipe = redis_client.pipeline()
+    pipe.hset(pres_id, "done", 1)
+    pipe.expire(pres_id, DONE_TTL)
+    pipe.zrem(ACTIVE_KEY, pres_id)
+    pipe.execute()
+
+
+def sweep(redis_client, dry_run=False):
+    """Delete presentations with no activity for ABANDONED_AFTER. Returns their ids."""
+    cutoff = time.time() - ABANDONED_AFTER
+    stale = redis_client.zrangebyscore(ACTIVE_KEY, "-inf", cutoff)
+    if stale and not dry_run:
+        pipe = redis_client.pipeline()
+        for pres_id in stale:
+            pipe.unlink(pres_id)
+            pipe.zrem(ACTIVE_KEY, pres_id)
+        pipe.execute()
+    return stale
+
+
+def idle_hashes(redis_client, batch=500):
+    """
+    (key, idle seconds) for every hash. Idle time comes from OBJECT IDLETIME,
+    read before anything else touches the key: any read (HGET, HEXISTS)
+    resets it. None under an LFU maxmemory policy, where Redis doesn't keep it.
+    """
+    keys = []
+    for key in redis_client.scan_iter(_type="hash", count=batch):
+        keys.append(key)
+        if len(keys) == batch:
+            yield from zip(keys, _idle_times(redis_client, keys))
+            keys = []
+    yield from zip(keys, _idle_times(redis_client, keys))
+
+
+def _idle_times(redis_client, keys):
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.object("idletime", key)
+    return [None if isinstance(idle, redis.ResponseError) else idle for idle in pipe.execute(raise_on_error=False)]
+
+
+def is_presentation(redis_client, key):
+    """Presentation hashes are recognised by their `next` pointer. Resets the key's idle time."""
+    return redis_client.hexists(key, "next")
+
+
+def sweep_untracked(redis_client, dry_run=False):
+    """
+    Hashes from before the active set existed, judged by Redis' own idle time.
+    Only hashes already idle long enough are checked for `next`, so live ones
+    keep their idle clock. A dry run skips that check too (it would reset the
+    clock it just judged) and lists every idle hash without a TTL.
+    """
+    swept = []
+    for key, idle in idle_hashes(redis_client):
+        if idle is None:
+            log.warning("Idle time isn't tracked under an LFU maxmemory policy, not sweeping untracked hashes")
+            return swept
+        if idle <= ABANDONED_AFTER or redis_client.ttl(key) != -1:
+            continue
+        if dry_run:
+            swept.append(key)
+        elif is_presentation(redis_client, key):
+            swept.append(key)
+            redis_client.unlink(key)
+    return swept
+
+
+def start_sweeper(redis_client, interval=SWEEP_INTERVAL):
+    """Sweep in the background; a lock keeps it to one process per interval."""
+    def loop():
+        while True:
+            try:
+                if redis_client.set(SWEEP_LOCK, os.getpid(), nx=True, ex=interval):
+                    swept = sweep(redis_client)
+                    if swept:
+                        log.info("Swept %d abandoned presentation(s)", len(swept))
+            except redis.RedisError as e:
+                log.warning("Sweep failed: %s", e)
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="PresentationSweeper", daemon=True).start()
+
+
+def report(redis_client, top):
+    """
+    Memory per presentation and user. Reading the hashes resets their idle
+    time, so run `sweep --scan` before this, not after.
+    """
+    by_pres = defaultdict(int)
+    users = {}
+    reclaimable = 0
+    lfu = False
+    for key, idle in idle_hashes(redis_client):
+        if not is_presentation(redis_client, key):
+            continue
+        size = redis_client.memory_usage(key) or 0
+        by_pres[key] += size
+        users[key] = redis_client.hget(key, "user_id") or "?"
+        done = redis_client.hexists(key, "done")
+        lfu = lfu or idle is None
+        if done or (idle is not None and idle > ABANDONED_AFTER):
+            reclaimable += size
+    # Ledger and claim-check entries are keyed by presentation too, and expire on their own
+    for pattern in ("ledger:*", "claim:*"):
+        for key in redis_client.scan_iter(match=pattern, count=500):
+            by_pres[key.split(":")[1]] += redis_client.memory_usage(key) or 0
+
+    by_user = defaultdict(int)
+    for pres_id, size in by_pres.items():
+        by_user[users.get(pres_id, "?")] += size
+
+    total = sum(by_pres.values())
+    print(f"{len(by_pres)} presentation(s), {total / 1024:.1f} KiB, {reclaimable / 1024:.1f} KiB reclaimable")
+    if lfu:
+        print("(LFU maxmemory policy: idle time isn't tracked, only completed presentations count as reclaimable)")
+    print(f"\n{'presentation':<28}{'user':<24}{'KiB':>10}")
+    for pres_id, size in sorted(by_pres.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"{pres_id:<28}{users.get(pres_id, '?'):<24}{size / 1024:>10.1f}")
+    print(f"\n{'user':<24}{'KiB':>10}")
+    for user, size in sorted(by_user.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"{user:<24}{size / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Presentation memory in Redis")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report")
+    p.add_argument("--top", type=int, default=20)
+    p = sub.add_parser("sweep")
+    p.add_argument("--scan", action="store_true", help="also sweep hashes missing from the active set")
+    p.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD", ""),
+        decode_responses=True,
+    )
+    if args.command == "report":
+        report(client, args.top)
+    else:
+        swept = sweep(client, args.dry_run)
+        if args.scan:
+            swept += sweep_untracked(client, args.dry_run)
+        verb = "Would sweep" if args.dry_run else "Swept"
+        print(f"{verb} {len(swept)} presentation(s)")
+        for pres_id in swept:
+            print(f"  {pres_id}")
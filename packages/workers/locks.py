@@ -0,0 +1,72 @@
+import os
+import time
+import uuid
+import threading
+
+import redis
+
+from log import get_logger
+
+log = get_logger("locks")
+
+# Renewed every third of this while create() runs, so it only bounds how
+# long a crashed holder keeps the others waiting
+SINGLE_FLIGHT_TTL = int(os.getenv("SINGLE_FLIGHT_TTL", 60))
+# How long losers wait for the winner before giving up (and retrying the message)
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", 90))
+POLL_SECONDS = 0.2
+
+# Delete the lock only if we still hold it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Push the expiry out only if we still hold the lock
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _renew(redis_client, key, token, ttl, stop):
+    while not stop.wait(ttl / 3):
+        try:
+            if not redis_client.eval(RENEW_SCRIPT, 1, key, token, int(ttl * 1000)):
+                # Expired during a stall and maybe taken; create() must not clobber the winner
+                log.warning("Lost %s while creating", key)
+                return
+        except redis.RedisError as e:
+            log.warning("Could not renew %s: %s", key, e)
+
+
+def single_flight(redis_client, key, done, create, ttl=SINGLE_FLIGHT_TTL, wait=SINGLE_FLIGHT_WAIT):
+    """
+    Run create() once across every process, unless done() is already true.
+    Whoever takes the lock creates; the others poll done() until the winner's
+    result is visible. The lock is renewed while create() runs; if the
+    winner dies it expires and a waiter takes over.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not done():
+        if redis_client.set(key, token, nx=True, ex=ttl):
+            stop = threading.Event()
+            threading.Thread(
+                target=_renew, args=(redis_client, key, token, ttl, stop), name="LockRenewal", daemon=True
+            ).start()
+            try:
+                # Someone may have finished between our check and the lock
+                if not done():
+                    create()
+            finally:
+                stop.set()
+                redis_client.eval(RELEASE_SCRIPT, 1, key, token)
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Gave up waiting on {key} after {wait:.0f}s")
+        time.sleep(POLL_SECONDS)
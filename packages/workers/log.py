@@ -0,0 +1,163 @@
+"""
+Structured, non-blocking logging for the workers.
+
+Loggers only put records on a bounded queue; a listener thread formats
+and writes them, so a consumer thread never waits on stdout. A full
+queue drops the record (counted in ducky_log_dropped_total) instead of
+blocking. Records carry the worker, whatever bind() set for the clip
+being processed and the trace id when tracing is on. Messages are cut at
+LOG_MAX_CHARS.
+
+Polling loops log with extra=sample(key): one record per key every
+LOG_SAMPLE_SECONDS, carrying how many were skipped. They log at DEBUG, so
+at the default level they cost one level check.
+
+    LOG_LEVEL=INFO LOG_FORMAT=json|text
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from opentelemetry import trace
+
+from metrics import LOG_DROPPED
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_CHARS = int(os.getenv("LOG_MAX_CHARS", 500))
+LOG_SAMPLE_SECONDS = float(os.getenv("LOG_SAMPLE_SECONDS", 30))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+_fields = contextvars.ContextVar("log_fields", default={})
+_listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"ducky.{name}")
+
+
+@contextmanager
+def bind(**fields):
+    """Add fields (pres, clip, ...) to every record logged in the block on this thread."""
+    token = _fields.set({**_fields.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _fields.reset(token)
+
+
+def sample(key):
+    return {"sample": key}
+
+
+def truncate(text, limit=LOG_MAX_CHARS):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+class ContextFilter(logging.Filter):
+    """Runs on the caller's thread, before the record is queued: sampling and correlation fields."""
+
+    def __init__(self, worker):
+        super().__init__()
+        self.worker = worker
+        self.sampled = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is not None and LOG_SAMPLE_SECONDS > 0:
+            now = time.monotonic()
+            with self.lock:
+                last = self.sampled.get(key)
+                if last and now - last[0] < LOG_SAMPLE_SECONDS:
+                    last[1] += 1
+                    return False
+                record.skipped = last[1] if last else 0
+                if len(self.sampled) > 1000:
+                    # Keys are per job or run; forget the finished ones
+                    self.sampled = {k: v for k, v in self.sampled.items() if now - v[0] < LOG_SAMPLE_SECONDS}
+                self.sampled[key] = [now, 0]
+        record.worker = self.worker
+        record.fields = _fields.get()
+        context = trace.get_current_span().get_span_context()
+        record.trace_id = format(context.trace_id, "032x") if context.is_valid else None
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Render here, while the arguments are still what the caller meant.
+        # This is the only handler on ducky.*, so the record is ours to change.
+        record.msg = truncate(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "worker": record.worker,
+            **record.fields,
+            "msg": record.msg,
+        }
+        if record.trace_id:
+            entry["trace_id"] = record.trace_id
+        if getattr(record, "skipped", 0):
+            entry["skipped"] = record.skipped
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = "".join(f" {k}={v}" for k, v in record.fields.items())
+        skipped = f" (+{record.skipped} skipped)" if getattr(record, "skipped", 0) else ""
+        line = f"{self.formatTime(record)} {record.levelname} {record.worker}{fields} {record.msg}{skipped}"
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+def setup_logging(worker):
+    """Route the ducky.* loggers through the queue. Call once, first thing in the entry point."""
+    global _listener
+    if _listener is not None:
+        return
+    # The formatters never show caller, process or thread; skip collecting them per record
+    logging._srcfile = None
+    logging.logThreads = logging.logProcesses = logging.logMultiprocessing = False
+    logging.logAsyncioTasks = False
+    out = logging.StreamHandler(sys.stdout)
+    out.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    records = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(ContextFilter(worker))
+    logger = logging.getLogger("ducky")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+    _listener = QueueListener(records, out)
+    _listener.start()
+    # Flush what's queued on the way out
+    atexit.register(_listener.stop)
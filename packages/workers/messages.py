@@ -0,0 +1,75 @@
+import os
+import json
+import msgpack
+
+# Bump when a field changes meaning; consumers reject versions they don't know
+SCHEMA_VERSION = 1
+# Fields longer than this travel by reference (claim-check) instead of inline
+CLAIM_CHECK_BYTES = int(os.getenv("CLAIM_CHECK_BYTES", 16 * 1024))
+CLAIM_CHECK_TTL = int(os.getenv("CLAIM_CHECK_TTL", 7 * 24 * 3600))
+
+
+class MessageError(ValueError):
+    pass
+
+
+def claim_key(job, field):
+    return f"claim:{job['PRESENTATION_ID']}:{job['CLIP_ID']}_{job.get('CLIP_TIMESTAMP', '')}:{field}"
+
+
+def _size(value):
+    """Bytes on the wire; CLAIM_CHECK_BYTES is a byte limit, and non-ASCII text is longer than its len()."""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+    return 0
+
+
+def encode_job(job, redis_client):
+    """
+    Pack a clip job for SECOND_QUEUE. Long fields (transcripts, emotion
+    timelines) are stored under their own key and replaced by a reference.
+    """
+    inline = {}
+    refs = {}
+    pipe = redis_client.pipeline(transaction=False)
+    for field, value in job.items():
+        if _size(value) > CLAIM_CHECK_BYTES:
+            refs[field] = claim_key(job, field)
+            pipe.set(refs[field], value, ex=CLAIM_CHECK_TTL)
+        else:
+            inline[field] = value
+    if refs:
+        pipe.execute()
+    return msgpack.packb({"v": SCHEMA_VERSION, "job": inline, "refs": refs})
+
+
+def parse(body):
+    """
+    The message as a dict without resolving references. Bodies from before
+    the schema are JSON pointers like {"PRESENTATION_ID": ..., "CLIP_ID": ...}.
+    """
+    if body[:1] in (b"{", "{"):
+        return {"v": 0, "job": json.loads(body), "refs": {}}
+    try:
+        message = msgpack.unpackb(body)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise MessageError(f"Unreadable message: {e}") from e
+    if message.get("v", 0) > SCHEMA_VERSION:
+        raise MessageError(f"Message schema v{message['v']} is newer than v{SCHEMA_VERSION}")
+    return message
+
+
+def decode_job(body, redis_client):
+    """(version, job) with claim-checked fields fetched back in one round trip."""
+    message = parse(body)
+    job = message["job"]
+    refs = message.get("refs") or {}
+    if refs:
+        values = redis_client.mget(list(refs.values()))
+        for field, value in zip(refs, values):
+            if value is None:
+                raise MessageError(f"Claim-checked {field} expired ({refs[field]})")
+            job[field] = value
+    return message["v"], job
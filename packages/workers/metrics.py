@@ -0,0 +1,147 @@
+import os
+import functools
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# 0 disables the endpoint
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+STAGE_SECONDS = Histogram(
+    "ducky_stage_seconds",
+    "Time spent in a pipeline stage (ledger hits are not observed)",
+    ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+MESSAGES_CONSUMED = Counter(
+    "ducky_messages_consumed_total",
+    "Deliveries handed to a worker thread",
+    ["queue"],
+)
+MESSAGES_ACKED = Counter(
+    "ducky_messages_acked_total",
+    "Deliveries acked, after success or after being rescheduled",
+    ["queue"],
+)
+MESSAGES_FAILED = Counter(
+    "ducky_messages_failed_total",
+    "Deliveries whose processing raised, by exception type",
+    ["queue", "error"],
+)
+IN_FLIGHT = Gauge(
+    "ducky_messages_in_flight",
+    "Deliveries currently being processed",
+    ["queue"],
+)
+POLLS = Counter(
+    "ducky_poll_iterations_total",
+    "Iterations of polling loops waiting on a provider or on pending clips",
+    ["loop"],
+)
+DRAIN_SECONDS = Histogram(
+    "ducky_drain_seconds",
+    "Time from SIGTERM until the last in-flight delivery was acked",
+    buckets=(0.5, 1, 5, 15, 30, 60, 120, 300, 600),
+)
+SUPERVISOR_PROCESSES = Gauge(
+    "ducky_supervisor_processes",
+    "Worker processes the supervisor runs, draining ones excluded",
+    ["worker"],
+)
+SUPERVISOR_SCALE_EVENTS = Counter(
+    "ducky_supervisor_scale_total",
+    "Supervisor scaling decisions",
+    ["worker", "direction"],
+)
+SUPERVISOR_RESTARTS = Counter(
+    "ducky_supervisor_restarts_total",
+    "Worker processes that exited unasked and were replaced",
+    ["worker"],
+)
+QUEUE_READY = Gauge(
+    "ducky_queue_ready",
+    "Messages waiting in the queue, as the supervisor last saw it",
+    ["queue"],
+)
+QUEUE_UNACKED = Gauge(
+    "ducky_queue_unacked",
+    "Messages delivered and not yet acked, as the supervisor last saw it",
+    ["queue"],
+)
+QUEUE_UTILISATION = Gauge(
+    "ducky_queue_consumer_utilisation",
+    "RabbitMQ consumer utilisation, as the supervisor last saw it",
+    ["queue"],
+)
+SUPERVISED_DRAIN_SECONDS = Histogram(
+    "ducky_supervisor_drain_seconds",
+    "Time from the supervisor's SIGTERM until a worker process exited",
+    ["worker"],
+    buckets=(0.5, 1, 5, 15, 30, 60, 120, 300, 600),
+)
+REORDER_DEPTH = Gauge(
+    "ducky_reorder_buffer_depth",
+    "Clips parked in worker2's pending dict waiting for an earlier clip",
+    ["presentation"],
+)
+HEAD_OF_LINE_WAIT = Histogram(
+    "ducky_head_of_line_wait_seconds",
+    "Time from a presentation's first parked clip until its next clip arrives",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800),
+)
+HEAD_OF_LINE_EXPEDITED = Counter(
+    "ducky_head_of_line_expedited_total",
+    "Clips worker1 expedited because worker2 is waiting on them",
+)
+THREAD_POOL_TAKEN = Counter(
+    "ducky_thread_pool_taken_total",
+    "Presentation bootstraps that found a spare OpenAI thread (hit) or had to create one (miss)",
+    ["result"],
+)
+COLD_START_SECONDS = Gauge(
+    "ducky_cold_start_seconds",
+    "Seconds from process start until warmed up and consuming",
+)
+LOG_DROPPED = Counter(
+    "ducky_log_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+
+
+def stage_timer(stage):
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def tracked(queue, process):
+    """process(body), counted as consumed and in flight on `queue`."""
+    @functools.wraps(process)
+    def run(body):
+        MESSAGES_CONSUMED.labels(queue=queue).inc()
+        with IN_FLIGHT.labels(queue=queue).track_inprogress():
+            return process(body)
+    return run
+
+
+def record_outcome(queue, error):
+    if error is not None:
+        MESSAGES_FAILED.labels(queue=queue, error=type(error).__name__).inc()
+    MESSAGES_ACKED.labels(queue=queue).inc()
+
+
+def set_reorder_depth(pres_id, depth):
+    if depth:
+        REORDER_DEPTH.labels(presentation=pres_id).set(depth)
+    else:
+        # Drop the series so finished presentations don't accumulate
+        try:
+            REORDER_DEPTH.remove(pres_id)
+        except KeyError:
+            pass
+
+
+def start_metrics(port=METRICS_PORT):
+    # Imported here: log imports metrics
+    from log import get_logger
+
+    if port:
+        start_http_server(port)
+        get_logger("metrics").info("Metrics on :%s/metrics", port)
@@ -0,0 +1,122 @@
+"""
+Fused mode for small and self-hosted deployments: worker1's transcription
+stage and worker2's feedback stage in one process, joined by an asyncio
+queue instead of a hop through SECOND_QUEUE.
+
+    python pipeline.py
+"""
+import os
+import json
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future
+
+from scheduler import fair_key
+from metrics import start_metrics
+from health import register, warm_up, start_health
+from log import get_logger, bind, setup_logging
+from tracing import setup_tracing
+from usage import start_rollup, USAGE_COLLECTION
+from lifecycle import start_sweeper
+
+log = get_logger("pipeline")
+
+
+class FeedbackStage:
+    """
+    Runs handle(job_params) on its own event loop. A single consumer drains
+    the queue, so worker2's next/pending bookkeeping sees one clip at a time
+    exactly as it does with WORKER2_CONCURRENCY=1.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.loop = asyncio.new_event_loop()
+        self.queue = None
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), name="FeedbackStage", daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.loop.call_soon(ready.set)
+        self.loop.run_until_complete(self._consume())
+
+    async def _consume(self):
+        while True:
+            job_params, done, context = await self.queue.get()
+            try:
+                # GPT runs block, keep the loop free to accept hand-offs
+                await asyncio.to_thread(context.run, self.handle, job_params)
+            except Exception as e:
+                done.set_exception(e)
+            else:
+                done.set_result(None)
+
+    def submit(self, job_params):
+        """Hand a clip over from any thread. Resolves once it ran or was parked."""
+        done = Future()
+        # The submitter's trace continues into the feedback stage
+        context = contextvars.copy_context()
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (job_params, done, context))
+        return done
+
+
+def fused_process(transcribe, feedback, prewarm):
+    """process(body) for FIRST_QUEUE deliveries that runs both stages."""
+    def process(body):
+        message = body.decode()
+        clip = json.loads(message)
+        with bind(pres=clip.get('presentationID'), clip=clip.get('clipIndex')):
+            log.info("Received %s", clip.get('type', 'clip'))
+            log.debug("Message: %s", message)
+            if clip.get('type') == 'prewarm':
+                prewarm(clip['userID'], clip['presentationID'])
+                return
+            job_params = transcribe(clip)
+            job_params.pop('ATTEMPT_ID', None)
+            # Ack the delivery only once the feedback stage is done with the clip,
+            # so a crash in between redelivers it; both stages are ledgered
+            feedback.submit(job_params).result()
+    return process
+
+
+def start_pipeline():
+    setup_logging("pipeline")
+    import worker1
+    import worker2
+
+    if worker1.TRANSPORT == "rabbitmq" and not worker1.RABBITMQ_URL:
+        log.error("RABBITMQ_URL is not defined in the environment variables.")
+        exit(1)
+
+    concurrency = int(os.getenv("PIPELINE_CONCURRENCY", worker1.WORKER1_CONCURRENCY))
+    prefetch = int(os.getenv("PIPELINE_PREFETCH", worker1.WORKER1_PREFETCH))
+    process = fused_process(worker1.process_transcription_job, FeedbackStage(worker2.handle_job), worker1.prewarm)
+
+    start_metrics()
+    register("redis", worker1.re.ping)
+    register("mongo", lambda: worker2.database.client.admin.command("ping"))
+    start_health()
+    warm_up({
+        "redis": worker1.re.ping,
+        "mongo": lambda: worker2.database.client.admin.command("ping"),
+        "providers": lambda: (
+            worker1.OPENAI_CLIENT.get(), worker2.OPENAI_CLIENT.get(), worker1.HUME_CLIENT.get(), worker1.deepgram.get()
+        ),
+    }, wait=False)
+    setup_tracing("pipeline")
+    worker1.start_thread_pool()
+    start_sweeper(worker2.redis_client)
+    start_rollup(worker2.redis_client, worker2.database[USAGE_COLLECTION])
+    worker1.transport.consume(
+        worker1.QUEUE_NAME, process, "Pipeline",
+        concurrency=concurrency, prefetch=prefetch, fair_key=fair_key,
+        head_of_line=worker1.HEAD_OF_LINE,
+    )
+
+
+if __name__ == "__main__":
+    start_pipeline()
@@ -0,0 +1,38 @@
+"""
+What the assistant is told, shared by the live workers (one OpenAI thread
+per presentation) and reprocess.py (the same conversation, rebuilt as
+chat completion requests).
+"""
+
+
+def context_prompt(preset):
+    """First message of a presentation's conversation, from its preset."""
+    presentation_description = preset.get('presentationDescription') or "None"
+    audience_description = preset.get('audienceDescription') or "None"
+    tone_description = preset.get('toneDescription') or "None"
+    return (
+        "Now you will be given descriptions of the presentation's context, the audience, and the tone.\n"
+        f"This presentation is about: {presentation_description}. "
+        f"The audience is: {audience_description}. "
+        f"The tone should be: {tone_description}."
+    )
+
+
+def clip_prompt(index, transcript):
+    return (
+        "Transcript "
+        + str(index)
+        + ": "
+        + transcript
+        + "\nNow evaluate this segment according the criteria, using the presentation description, audience description, and tone description given earlier. Format your response as bullet points under the relevant headers. Afterwards, list suggestions for improvements if there are any (be as specific as possible). Finally, give an overall score out of 10. Give your entire response in markdown format (but keep as bullet points under each main criteria, not subheaders)."
+    )
+
+
+def clip_content(index, transcript, slide):
+    return [
+        {"type": "text", "text": clip_prompt(index, transcript)},
+        {"type": "image_url", "image_url": {"url": slide}},
+    ]
+
+
+SUMMARY_PROMPT = "The presentation is over. Give a score out of 10 for the entire presentation. Keeping in mind the presentation description, audience description, and tone description, summarize all your feedback, emphasizing the most important suggestions for improvement and if the presentation was effective in achieving its goal. Keep in mind the visuals of slides, accuracy of content, if it concluded in a satisfying manner, the overall narrative flow and how all the segments fit together. Give your entire response in markdown format"
@@ -0,0 +1,228 @@
+import os
+import json
+import time
+
+from tracing import span
+from log import get_logger
+
+log = get_logger("ratelimit")
+
+# Requests per second and burst capacity per provider endpoint, shared by
+# every worker process through Redis. Override with e.g.
+# RATE_LIMITS='{"openai:runs": [2, 10]}'
+DEFAULT_LIMITS = {
+    "deepgram:listen": [4.0, 20],
+    "hume:jobs": [1.0, 5],
+    "hume:status": [5.0, 20],
+    "openai:threads": [2.0, 10],
+    "openai:runs": [2.0, 10],
+    "openai:status": [10.0, 30],
+    # reprocess.py's uploads and batch calls; a bucket of its own, never the live ones
+    "openai:batch": [1.0, 5],
+}
+RATE_LIMITS = {**DEFAULT_LIMITS, **json.loads(os.getenv("RATE_LIMITS", "{}"))}
+# Longest a caller will wait for a token before giving up
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 30))
+
+CB_FAILURE_THRESHOLD = int(os.getenv("CB_FAILURE_THRESHOLD", 5))
+CB_WINDOW = int(os.getenv("CB_WINDOW", 60))
+CB_COOLDOWN = float(os.getenv("CB_COOLDOWN", 30))
+
+# Refill, then try to take `cost` tokens. Returns how many ms to wait (0 = granted).
+# Uses the Redis clock so every process agrees on time.
+ACQUIRE_SCRIPT = """
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate')
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(b[3]) or tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local tokens = tonumber(b[1]) or capacity
+local ts = tonumber(b[2]) or now
+if now > ts then
+  tokens = math.min(capacity, tokens + (now - ts) / 1000 * rate)
+  ts = now
+end
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ts, 'rate', tostring(rate))
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return wait
+"""
+
+# Apply what the provider told us: new refill rate, tokens actually left,
+# and an optional pause (Retry-After) during which nothing refills.
+ADJUST_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local remaining = tonumber(ARGV[2])
+local pause = tonumber(ARGV[3])
+if rate > 0 then redis.call('HSET', KEYS[1], 'rate', tostring(rate)) end
+if remaining >= 0 then
+  local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens')) or remaining
+  redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tokens, remaining)), 'ts', now)
+end
+if pause > 0 then
+  redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', now + pause)
+end
+redis.call('PEXPIRE', KEYS[1], 3600000)
+return 0
+"""
+
+_redis = None
+_guards = {}
+
+
+class ProviderUnavailable(Exception):
+    """The call was not attempted; the message should be retried after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimited(ProviderUnavailable):
+    pass
+
+
+class CircuitOpen(ProviderUnavailable):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit open, retry in {retry_after:.1f}s", retry_after)
+        self.name = name
+
+
+def configure(redis_client):
+    global _redis
+    _redis = redis_client
+
+
+def _parse_duration(value):
+    """OpenAI reset headers look like '1s', '6m0s' or '20ms'."""
+    total = 0.0
+    num = ""
+    i = 0
+    while i < len(value):
+        c = value[i]
+        if c.isdigit() or c == ".":
+            num += c
+        elif value.startswith("ms", i):
+            total += float(num) / 1000.0
+            num = ""
+            i += 1
+        else:
+            total += float(num) * {"h": 3600, "m": 60, "s": 1}.get(c, 0)
+            num = ""
+        i += 1
+    return total + (float(num) if num else 0.0)
+
+
+def _status(error):
+    return getattr(error, "status_code", None) or getattr(error, "status", None)
+
+
+def _headers(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "headers", None) or {}
+
+
+class ProviderGuard:
+    """Token bucket plus circuit breaker for one provider endpoint."""
+
+    def __init__(self, name, rate, capacity):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = int(capacity)
+        self.bucket_key = f"ratelimit:{name}"
+        self.breaker_key = f"breaker:{name}"
+        self.acquire_script = _redis.register_script(ACQUIRE_SCRIPT)
+        self.adjust_script = _redis.register_script(ADJUST_SCRIPT)
+
+    def acquire(self, cost=1, max_wait=RATE_LIMIT_MAX_WAIT):
+        waited = 0.0
+        while True:
+            wait = int(self.acquire_script(keys=[self.bucket_key], args=[self.rate, self.capacity, cost])) / 1000.0
+            if wait == 0:
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimited(f"{self.name}: no capacity within {max_wait}s", wait)
+            time.sleep(wait)
+            waited += wait
+
+    def update_from_headers(self, headers, retry_after=0.0):
+        """Adapt the shared bucket to the provider's own rate-limit headers."""
+        rate = -1.0
+        remaining = -1
+        limit = headers.get("x-ratelimit-limit-requests")
+        reset = headers.get("x-ratelimit-reset-requests")
+        if headers.get("x-ratelimit-remaining-requests") is not None:
+            remaining = int(headers["x-ratelimit-remaining-requests"])
+        if limit:
+            # Limits are per minute
+            rate = int(limit) / 60.0
+        if remaining == 0 and reset:
+            retry_after = max(retry_after, _parse_duration(reset))
+        if headers.get("retry-after"):
+            retry_after = max(retry_after, float(headers["retry-after"]))
+        if rate > 0 or remaining >= 0 or retry_after > 0:
+            self.adjust_script(keys=[self.bucket_key], args=[rate, remaining, int(retry_after * 1000)])
+
+    def check_breaker(self):
+        opened_until = _redis.hget(self.breaker_key, "opened_until")
+        if opened_until is None:
+            return
+        remaining = float(opened_until) - time.time()
+        if remaining > 0:
+            raise CircuitOpen(self.name, remaining)
+        # Half-open: one process probes the provider, everyone else keeps failing fast
+        if not _redis.set(f"{self.breaker_key}:probe", 1, nx=True, px=int(CB_COOLDOWN * 1000)):
+            raise CircuitOpen(self.name, CB_COOLDOWN)
+
+    def record_success(self):
+        if _redis.exists(self.breaker_key):
+            _redis.delete(self.breaker_key, f"{self.breaker_key}:probe")
+
+    def record_failure(self):
+        pipe = _redis.pipeline()
+        pipe.hincrby(self.breaker_key, "failures", 1)
+        pipe.expire(self.breaker_key, CB_WINDOW)
+        failures = pipe.execute()[0]
+        if failures >= CB_FAILURE_THRESHOLD:
+            log.warning("[breaker] %s open after %d failures", self.name, failures)
+            pipe = _redis.pipeline()
+            pipe.hset(self.breaker_key, "opened_until", time.time() + CB_COOLDOWN)
+            pipe.expire(self.breaker_key, int(CB_WINDOW + CB_COOLDOWN))
+            pipe.delete(f"{self.breaker_key}:probe")
+            pipe.execute()
+
+    def call(self, fn, *args, **kwargs):
+        with span(f"provider {self.name}") as current:
+            self.check_breaker()
+            current.set_attribute("ratelimit.wait_s", self.acquire())
+            return self._call(fn, *args, **kwargs)
+
+    def _call(self, fn, *args, **kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            status = _status(e)
+            if status == 429:
+                headers = _headers(e)
+                self.update_from_headers(headers, retry_after=float(headers.get("retry-after", 1)))
+            # Client errors are our fault, not a sign the provider is degraded
+            if status is None or status == 429 or status >= 500:
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+def get_guard(name):
+    if name not in _guards:
+        rate, capacity = RATE_LIMITS[name]
+        _guards[name] = ProviderGuard(name, rate, capacity)
+    return _guards[name]
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Regenerate feedback for stored presentations after a prompt or assistant
+change, through OpenAI's Batch API instead of the live queue.
+
+Clips of complete presentations are read from Mongo and written as chat
+completion requests (the assistant's instructions and model, the
+presentation's context, then the clip) to JSONL files of at most
+REPROCESS_BATCH_SIZE requests, which are uploaded and submitted as
+batches. A presentation's clips always go in the same batch. A poller
+thread checks the open batches in the background while the rest are
+submitted, and writes each finished one back with bulk writes; a clip
+re-recorded since it was read (its video changed) is left alone. Once a
+presentation's clips are back, its summary goes out in a second batch.
+
+Each clip is judged with the presentation's context but, unlike a live
+thread, without the clips before it; the summary sees them all. Clips
+stored before transcripts were kept, and silent ones, are skipped.
+
+Nothing here shares quota with the live workers: no queue or Redis
+presentation state, a rate-limit bucket of its own (openai:batch), and
+Batch API limits, which OpenAI keeps apart from the synchronous ones.
+REPROCESS_OPENAI_API_KEY / REPROCESS_OPENAI_PROJECT move it to another
+project altogether. Tokens land in the usage ledger as batch_*.
+
+Batches are tracked in the reprocess_batches collection, so `watch`
+picks up what an interrupted run left open. A batch that can't be checked
+or written back REPROCESS_MAX_ATTEMPTS times in a row is closed with its
+error. Against the fake providers (benchmarks/fake_providers.py), set
+OPENAI_BASE_URL=http://127.0.0.1:8089/v1.
+
+    python reprocess.py run [--user ID] [--presentation ID] [--limit N] [--no-summaries] [--dry-run]
+    python reprocess.py watch
+    python reprocess.py status [--run ID]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+
+import redis
+from pymongo import MongoClient, UpdateOne
+
+from ratelimit import configure as configure_ratelimits, get_guard
+from usage import add as add_usage, recording
+from prompts import context_prompt, clip_content, SUMMARY_PROMPT
+from log import get_logger, setup_logging
+
+log = get_logger("reprocess")
+
+ASSISTANT_ID = os.getenv("ASSISTANT_ID")
+# Another key or project keeps reprocessing off the live project's limits entirely
+REPROCESS_API_KEY = os.getenv("REPROCESS_OPENAI_API_KEY") or os.getenv("OPEN_API_KEY")
+REPROCESS_PROJECT = os.getenv("REPROCESS_OPENAI_PROJECT") or os.getenv("OPENAI_PROJECT")
+ORGANIZATION_ID = os.getenv("OPENAI_ORGANIZATION")
+# Defaults to the assistant's model
+REPROCESS_MODEL = os.getenv("REPROCESS_MODEL")
+
+# Smaller batches finish sooner and cost less to redo; OpenAI allows 50,000
+REPROCESS_BATCH_SIZE = int(os.getenv("REPROCESS_BATCH_SIZE", 1000))
+REPROCESS_POLL_SECONDS = float(os.getenv("REPROCESS_POLL_SECONDS", 60))
+REPROCESS_WRITE_BATCH = int(os.getenv("REPROCESS_WRITE_BATCH", 500))
+# Failed checks in a row after which a batch is given up on (done_at and error set)
+REPROCESS_MAX_ATTEMPTS = int(os.getenv("REPROCESS_MAX_ATTEMPTS", 10))
+
+BATCHES_COLLECTION = "reprocess_batches"
+ENDPOINT = "/v1/chat/completions"
+# Expired and cancelled batches still return what they finished
+TERMINAL = ("completed", "expired", "cancelled", "failed")
+
+
+def openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=REPROCESS_API_KEY, organization=ORGANIZATION_ID, project=REPROCESS_PROJECT)
+
+
+def load_prompt(client):
+    """The live assistant's instructions and sampling, so batch requests ask what a thread run would."""
+    assistant = get_guard("openai:batch").call(client.beta.assistants.retrieve, ASSISTANT_ID)
+    return {
+        "model": REPROCESS_MODEL or assistant.model,
+        "instructions": assistant.instructions or "",
+        "temperature": getattr(assistant, "temperature", None),
+        "top_p": getattr(assistant, "top_p", None),
+    }
+
+
+def select(database, user=None, presentations=None, limit=None):
+    """Complete presentations with their preset, clips and summary."""
+    pipeline = [
+        {"$match": {"googleId": user} if user else {}},
+        {"$unwind": "$presentations"},
+        {"$match": {
+            "presentations.presentationStatus": "complete",
+            **({"presentations._id": {"$in": presentations}} if presentations else {}),
+        }},
+        {"$project": {
+            "_id": 0,
+            "user": "$googleId",
+            "pres": "$presentations._id",
+            "preset": "$presentations.preset",
+            "clips": "$presentations.clips",
+            "summary": "$presentations.summary",
+        }},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    return database["users"].aggregate(pipeline, batchSize=100)
+
+
+def spoken_clips(presentation):
+    """(clip id, clip) in order, for clips that have a transcript to judge."""
+    clips = presentation.get("clips") or {}
+    for clip_id in sorted(clips, key=int):
+        if clips[clip_id].get("transcript"):
+            yield clip_id, clips[clip_id]
+
+
+def request_body(prompt, presentation, turns):
+    messages = [{"role": "system", "content": prompt["instructions"]}] if prompt["instructions"] else []
+    messages.append({"role": "user", "content": context_prompt(presentation.get("preset") or {})})
+    body = {"model": prompt["model"], "messages": messages + turns}
+    for name in ("temperature", "top_p"):
+        if prompt.get(name) is not None:
+            body[name] = prompt[name]
+    return body
+
+
+def clip_requests(prompt, presentation):
+    """
+    (custom_id, body, item) per clip. item is what the write-back needs:
+    user, presentation, clip id, video and how many slide images were sent.
+    """
+    user, pres = presentation["user"], presentation["pres"]
+    return [
+        (
+            f"{pres}:{clip_id}",
+            request_body(prompt, presentation, [
+                {"role": "user", "content": clip_content(clip_id, clip["transcript"], clip.get("slideUUID"))},
+            ]),
+            [user, pres, clip_id, clip.get("video"), 1],
+        )
+        for clip_id, clip in spoken_clips(presentation)
+    ]
+
+
+def summary_request(prompt, presentation):
+    """The whole conversation a live thread would have had, then the summary prompt."""
+    turns = []
+    clips = list(spoken_clips(presentation))
+    for clip_id, clip in clips:
+        turns.append({"role": "user", "content": clip_content(clip_id, clip["transcript"], clip.get("slideUUID"))})
+        turns.append({"role": "assistant", "content": (clip.get("feedback") or {}).get("text", "")})
+    turns.append({"role": "user", "content": SUMMARY_PROMPT})
+    pres = presentation["pres"]
+    # Every clip's slide goes out again
+    return f"{pres}:summary", request_body(prompt, presentation, turns), [presentation["user"], pres, None, None, len(clips)]
+
+
+def plan(requests_per_presentation, size=REPROCESS_BATCH_SIZE):
+    """Pack whole presentations into batches of at most `size` requests (one bigger presentation stays whole)."""
+    batch = []
+    for requests in requests_per_presentation:
+        if batch and len(batch) + len(requests) > size:
+            yield batch
+            batch = []
+        batch.extend(requests)
+    if batch:
+        yield batch
+
+
+def write_op(item, text):
+    user, pres, clip_id, video, _ = item
+    if clip_id is None:
+        return UpdateOne(
+            {"googleId": user, "presentations._id": pres},
+            {"$set": {"presentations.$.summary": text}},
+        )
+    # Only if the clip is still the recording that was judged
+    return UpdateOne(
+        {"googleId": user, "presentations": {"$elemMatch": {"_id": pres, f"clips.{clip_id}.video": video}}},
+        {"$set": {f"presentations.$.clips.{clip_id}.feedback.text": text}},
+    )
+
+
+class Reprocessor:
+    def __init__(self, client, database, redis_client):
+        self.client = client
+        self.database = database
+        self.redis = redis_client
+        self.batches = database[BATCHES_COLLECTION]
+        self.guard = get_guard("openai:batch")
+        self.submitted_all = threading.Event()
+
+    def submit(self, run_id, kind, requests, prompt, summaries=False):
+        lines = "".join(
+            json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}) + "\n"
+            for custom_id, body, _ in requests
+        )
+        upload = self.guard.call(
+            self.client.files.create, file=(f"reprocess-{run_id}-{kind}.jsonl", lines.encode()), purpose="batch"
+        )
+        batch = self.guard.call(
+            self.client.batches.create,
+            input_file_id=upload.id, endpoint=ENDPOINT, completion_window="24h",
+            metadata={"run": run_id, "kind": kind},
+        )
+        self.batches.insert_one({
+            "_id": batch.id,
+            "run": run_id,
+            "kind": kind,
+            "status": batch.status,
+            "input_file": upload.id,
+            "requests": len(requests),
+            "items": [[custom_id, *item] for custom_id, _, item in requests],
+            "prompt": prompt,
+            "summaries": summaries,
+            "submitted_at": time.time(),
+        })
+        log.info("Submitted %s batch %s: %d requests, %.1f KiB", kind, batch.id, len(requests), len(lines) / 1024)
+        return batch.id
+
+    def run(self, run_id, presentations, prompt, summaries=True):
+        """Submit every clip batch, with the poller writing finished ones back meanwhile."""
+        poller = threading.Thread(target=self.watch, args=(run_id,), name="BatchPoller", daemon=True)
+        poller.start()
+        try:
+            for requests in plan(clip_requests(prompt, p) for p in presentations):
+                self.submit(run_id, "clips", requests, prompt, summaries)
+        finally:
+            self.submitted_all.set()
+        poller.join()
+
+    def watch(self, run_id=None):
+        """Poll open batches until there are none left and nothing more is coming."""
+        while True:
+            query = {"done_at": {"$exists": False}, **({"run": run_id} if run_id else {})}
+            open_batches = list(self.batches.find(query, {"items": 0}))
+            if not open_batches and self.submitted_all.is_set():
+                return
+            for doc in open_batches:
+                try:
+                    self.poll(doc)
+                except Exception as e:
+                    self.failed(doc, e)
+                    continue
+                if doc.get("attempts"):
+                    self.batches.update_one({"_id": doc["_id"]}, {"$unset": {"attempts": "", "last_error": ""}})
+            time.sleep(REPROCESS_POLL_SECONDS)
+
+    def failed(self, doc, error):
+        """Try again next round, unless this batch has failed REPROCESS_MAX_ATTEMPTS times in a row."""
+        attempts = doc.get("attempts", 0) + 1
+        update = {"$set": {"attempts": attempts, "last_error": str(error)[:500]}}
+        if attempts >= REPROCESS_MAX_ATTEMPTS:
+            update["$set"].update(done_at=time.time(), error=str(error)[:500])
+            log.error("Giving up on batch %s after %d attempts: %s", doc["_id"], attempts, error)
+        else:
+            log.warning("Could not check batch %s (attempt %d/%d): %s", doc["_id"], attempts, REPROCESS_MAX_ATTEMPTS, error)
+        self.batches.update_one({"_id": doc["_id"]}, update)
+
+    def poll(self, doc):
+        batch = self.guard.call(self.client.batches.retrieve, doc["_id"])
+        if batch.status not in TERMINAL:
+            if batch.status != doc["status"]:
+                self.batches.update_one({"_id": doc["_id"]}, {"$set": {"status": batch.status}})
+            return
+        doc = self.batches.find_one({"_id": doc["_id"]})
+        counts = self.write_back(doc, batch)
+        if doc["kind"] == "clips" and doc["summaries"]:
+            self.submit_summaries(doc)
+        # A crash before this line repeats the writes, which is harmless, and the summaries
+        self.batches.update_one({"_id": doc["_id"]}, {"$set": {"status": batch.status, "done_at": time.time(), **counts}})
+        log.info(
+            "Batch %s %s: %d ok, %d failed, %d written, %d skipped (changed since)",
+            doc["_id"], batch.status, counts["ok"], counts["failed"], counts["written"], counts["skipped"],
+        )
+
+    def results(self, batch):
+        """custom_id -> response body for the requests that succeeded."""
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.guard.call(self.client.files.content, file_id).text
+            for line in content.splitlines():
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if not entry.get("error") and response.get("status_code") == 200:
+                    results[entry["custom_id"]] = response["body"]
+        return results
+
+    def write_back(self, doc, batch):
+        results = self.results(batch)
+        ops = []
+        tokens = defaultdict(lambda: defaultdict(float))
+        for custom_id, *item in doc["items"]:
+            body = results.get(custom_id)
+            if body is None:
+                continue
+            ops.append(write_op(item, body["choices"][0]["message"]["content"]))
+            usage = tokens[(item[1], item[0])]
+            usage["batch_prompt_tokens"] += body["usage"]["prompt_tokens"]
+            usage["batch_completion_tokens"] += body["usage"]["completion_tokens"]
+            usage["images"] += item[4]
+
+        written = 0
+        users = self.database["users"]
+        for start in range(0, len(ops), REPROCESS_WRITE_BATCH):
+            written += users.bulk_write(ops[start:start + REPROCESS_WRITE_BATCH], ordered=False).matched_count
+
+        for (pres, user), amounts in tokens.items():
+            with recording(self.redis, "reprocess", pres, user, doc["kind"]):
+                add_usage(**amounts)
+        return {"ok": len(results), "failed": doc["requests"] - len(results), "written": written, "skipped": len(ops) - written}
+
+    def submit_summaries(self, doc):
+        presentations = list({pres for _, _, pres, clip_id, *_ in doc["items"] if clip_id is not None})
+        requests = [
+            [summary_request(doc["prompt"], p)]
+            for p in select(self.database, presentations=presentations)
+            # Presentations that never got a summary live don't get one now
+            if p.get("summary") and any(True for _ in spoken_clips(p))
+        ]
+        for batch in plan(requests):
+            self.submit(doc["run"], "summaries", batch, doc["prompt"])
+
+
+def status(batches, run_id=None):
+    docs = list(batches.find({"run": run_id} if run_id else {}, {"items": 0}).sort("submitted_at", 1))
+    print(f"{len(docs)} batch(es), {sum(1 for doc in docs if 'done_at' not in doc)} open")
+    print(f"\n{'run':<17}{'batch':<40}{'kind':<11}{'status':<12}{'requests':>9}{'ok':>7}{'failed':>7}{'written':>8}{'skipped':>8}")
+    for doc in docs:
+        print(
+            f"{doc['run']:<17}{doc['_id']:<40}{doc['kind']:<11}{doc['status']:<12}{doc['requests']:>9}"
+            f"{doc.get('ok', '-'):>7}{doc.get('failed', '-'):>7}{doc.get('written', '-'):>8}{doc.get('skipped', '-'):>8}"
+        )
+    given_up = [doc for doc in docs if doc.get("error")]
+    if given_up:
+        print()
+    for doc in given_up:
+        print(f"{doc['_id']} given up after {doc['attempts']} attempts: {doc['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Regenerate stored feedback through the Batch API")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run")
+    p.add_argument("--user", help="only this googleId")
+    p.add_argument("--presentation", action="append", help="only these presentations (repeatable)")
+    p.add_argument("--limit", type=int, help="at most this many presentations")
+    p.add_argument("--no-summaries", action="store_true", help="leave the summaries as they are")
+    p.add_argument("--dry-run", action="store_true", help="count the requests, submit nothing")
+    sub.add_parser("watch")
+    p = sub.add_parser("status")
+    p.add_argument("--run")
+    args = parser.parse_args()
+
+    setup_logging("reprocess")
+    database = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB")]
+    if args.command == "status":
+        status(database[BATCHES_COLLECTION], args.run)
+        raise SystemExit
+
+    redis_client = redis.Redis(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        password=os.getenv("REDIS_PASSWORD", ""),
+        decode_responses=True,
+    )
+    configure_ratelimits(redis_client)
+    reprocessor = Reprocessor(openai_client(), database, redis_client)
+    if args.command == "watch":
+        reprocessor.submitted_all.set()
+        reprocessor.watch()
+        raise SystemExit
+
+    presentations = select(database, args.user, args.presentation, args.limit)
+    if args.dry_run:
+        placeholder = {"model": REPROCESS_MODEL or "-", "instructions": ""}
+        batches = list(plan(clip_requests(placeholder, p) for p in presentations))
+        print(f"Would submit {sum(len(batch) for batch in batches)} clip request(s) in {len(batches)} batch(es)")
+        raise SystemExit
+
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    reprocessor.run(run_id, presentations, load_prompt(reprocessor.client), summaries=not args.no_summaries)
+    status(database[BATCHES_COLLECTION], run_id)
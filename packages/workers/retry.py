@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import pika
+
+from metrics import stage_timer
+from tracing import span
+from usage import add as add_usage
+from log import get_logger
+
+log = get_logger("retry")
+
+# Delay tiers in seconds. Each tier is a queue whose messages expire back
+# onto the work queue, so retries wait without holding a consumer.
+RETRY_DELAYS = [int(d) for d in os.getenv("RETRY_DELAYS", "5,30,120,600").split(",")]
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 6))
+LEDGER_TTL = int(os.getenv("LEDGER_TTL", 7 * 24 * 3600))
+# How long the broker lets a delivery stay unacked before closing the channel.
+# Must cover the longest job; changing it means recreating the work queues.
+CONSUMER_TIMEOUT = os.getenv("RABBITMQ_CONSUMER_TIMEOUT")
+# Broker priority lanes on the work queues, off by default: queues already
+# declared without x-max-priority refuse the declare (406), so turning this
+# on means deleting and recreating them first. Set it everywhere at once,
+# infra/create_queues.py included.
+QUEUE_MAX_PRIORITY = int(os.getenv("QUEUE_MAX_PRIORITY", 0))
+
+RETRY_HEADER = "x-retry-count"
+
+
+def retry_queue(queue, delay):
+    return f"{queue}.retry.{delay}s"
+
+
+def dead_letter_queue(queue):
+    return f"{queue}.dlq"
+
+
+def work_queue_arguments():
+    arguments = {}
+    if CONSUMER_TIMEOUT:
+        arguments["x-consumer-timeout"] = int(CONSUMER_TIMEOUT)
+    if QUEUE_MAX_PRIORITY:
+        arguments["x-max-priority"] = QUEUE_MAX_PRIORITY
+    return arguments
+
+
+def declare_topology(channel, queue):
+    """Declare the work queue, one delay queue per tier and the dead-letter queue."""
+    channel.queue_declare(queue=queue, durable=True, arguments=work_queue_arguments())
+    for delay in RETRY_DELAYS:
+        channel.queue_declare(
+            queue=retry_queue(queue, delay),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay * 1000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue,
+            },
+        )
+    channel.queue_declare(queue=dead_letter_queue(queue), durable=True)
+
+
+def retry_count(properties):
+    headers = (properties and properties.headers) or {}
+    return int(headers.get(RETRY_HEADER, 0))
+
+
+def pick_delay(attempt, min_delay=0):
+    """Exponential backoff over the tiers, never shorter than min_delay."""
+    tier = min(attempt - 1, len(RETRY_DELAYS) - 1)
+    for delay in RETRY_DELAYS[tier:]:
+        if delay >= min_delay:
+            return delay
+    return RETRY_DELAYS[-1]
+
+
+def retry_later(channel, queue, body, properties, error, min_delay=0):
+    """
+    Schedule a failed message for another attempt, or dead-letter it once
+    MAX_RETRIES is reached. The caller acks the original delivery afterwards.
+    """
+    attempt = retry_count(properties) + 1
+    headers = dict((properties and properties.headers) or {})
+    headers[RETRY_HEADER] = attempt
+    headers["x-last-error"] = str(error)[:500]
+
+    if attempt > MAX_RETRIES:
+        headers["x-original-queue"] = queue
+        target = dead_letter_queue(queue)
+        log.warning("Giving up after %d retries, dead-lettering to %s", attempt - 1, target)
+    else:
+        target = retry_queue(queue, pick_delay(attempt, min_delay))
+        log.info("Retry %d/%d via %s", attempt, MAX_RETRIES, target)
+
+    channel.basic_publish(
+        exchange="",
+        routing_key=target,
+        body=body,
+        properties=pika.BasicProperties(
+            delivery_mode=pika.DeliveryMode.Persistent,
+            headers=headers,
+            priority=properties and properties.priority,
+        ),
+    )
+
+
+class Ledger:
+    """
+    Records which (presentation, clip, stage) steps already succeeded, with
+    their result, so a redelivered message skips finished provider calls.
+    """
+
+    def __init__(self, redis_client, ttl=LEDGER_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def key(self, pres_id, clip_id, stage):
+        return f"ledger:{pres_id}:{clip_id}:{stage}"
+
+    def get(self, pres_id, clip_id, stage):
+        """The recorded entry as {'result': ...}, or None if the stage hasn't run."""
+        value = self.redis.get(self.key(pres_id, clip_id, stage))
+        return None if value is None else json.loads(value)
+
+    def put(self, pres_id, clip_id, stage, result=None):
+        self.redis.set(self.key(pres_id, clip_id, stage), json.dumps({"result": result}), ex=self.ttl)
+
+    def once(self, pres_id, clip_id, stage, fn, *args, **kwargs):
+        """Return the recorded result of `stage`, or run fn and record it."""
+        # Every pipeline stage goes through here, so it is also where stages get their spans
+        with span(stage, **{"presentation.id": pres_id, "clip.attempt": clip_id}) as current:
+            done = self.get(pres_id, clip_id, stage)
+            if done is not None:
+                log.info("Skipping %s for %s/%s, already done", stage, pres_id, clip_id)
+                current.set_attribute("ledger.skipped", True)
+                return done["result"]
+            start = time.monotonic()
+            with stage_timer(stage):
+                result = fn(*args, **kwargs)
+            add_usage(**{f"wall_{stage}_s": time.monotonic() - start})
+            self.put(pres_id, clip_id, stage, result)
+            return result
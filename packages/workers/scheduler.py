@@ -0,0 +1,111 @@
+import os
+from collections import deque
+
+from messages import parse, MessageError
+
+# Message priorities; the Lambda mirrors these values. Workers always order
+# their own buffer by them; the broker does too when the work queues are
+# declared with x-max-priority (QUEUE_MAX_PRIORITY in retry.py).
+PRIORITY_BULK = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 5
+
+# "presentation" or "user": who gets an equal share of a worker
+FAIR_KEY = os.getenv("FAIR_KEY", "presentation")
+FAIR_QUANTUM = float(os.getenv("FAIR_QUANTUM", 1))
+
+
+def clip_priority(is_end):
+    """
+    The final clip unblocks the summary and completes the presentation, and
+    a single-clip review is its own final clip, so both jump the backlog.
+    """
+    return PRIORITY_HIGH if str(is_end).lower() == "true" else PRIORITY_NORMAL
+
+
+def fair_key(body):
+    """Flow key of a FIRST_QUEUE or SECOND_QUEUE message."""
+    try:
+        job = parse(body)["job"]
+    except (ValueError, MessageError):
+        return None
+    user = job.get("userID") or job.get("USER_ID")
+    if FAIR_KEY == "user" and user:
+        return user
+    return job.get("presentationID") or job.get("PRESENTATION_ID")
+
+
+class FairScheduler:
+    """
+    Strict priority between lanes, deficit round-robin between flows
+    (presentations or users) inside a lane. One presentation with 60 queued
+    clips gets the same share as one with 2.
+
+    pop(expedite) lets a tagged item jump all of that, decided when it is
+    popped rather than when it was pushed.
+    """
+
+    def __init__(self, quantum=FAIR_QUANTUM):
+        self.quantum = quantum
+        # priority -> {"active": deque of keys, "flows": key -> deque of (cost, item, tag)}
+        self.lanes = {}
+        self.deficit = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, key, item, priority=PRIORITY_NORMAL, cost=1.0, tag=None):
+        lane = self.lanes.setdefault(priority, {"active": deque(), "flows": {}})
+        flow = lane["flows"].get(key)
+        if flow is None:
+            flow = lane["flows"][key] = deque()
+            lane["active"].append(key)
+            self.deficit[(priority, key)] = 0.0
+        flow.append((cost, item, tag))
+        self.size += 1
+
+    def pop(self, expedite=None):
+        if expedite is not None:
+            item = self._pop_expedited(expedite)
+            if item is not None:
+                return item
+        for priority in sorted(self.lanes, reverse=True):
+            lane = self.lanes[priority]
+            if lane["active"]:
+                return self._pop_lane(priority, lane)
+        raise IndexError("pop from empty scheduler")
+
+    def _pop_expedited(self, expedite):
+        """First item, highest lane first, whose tag expedite(tag) accepts. Not charged to its flow."""
+        for priority in sorted(self.lanes, reverse=True):
+            lane = self.lanes[priority]
+            for key, flow in lane["flows"].items():
+                for entry in flow:
+                    if entry[2] is not None and expedite(entry[2]):
+                        flow.remove(entry)
+                        self._taken(priority, lane, key)
+                        return entry[1]
+        return None
+
+    def _pop_lane(self, priority, lane):
+        active = lane["active"]
+        while True:
+            key = active[0]
+            flow = lane["flows"][key]
+            cost, item, _ = flow[0]
+            if self.deficit[(priority, key)] >= cost:
+                self.deficit[(priority, key)] -= cost
+                flow.popleft()
+                self._taken(priority, lane, key)
+                return item
+            self.deficit[(priority, key)] += self.quantum
+            active.rotate(-1)
+
+    def _taken(self, priority, lane, key):
+        self.size -= 1
+        if not lane["flows"][key]:
+            # Idle flows don't bank credit
+            lane["active"].remove(key)
+            del lane["flows"][key]
+            del self.deficit[(priority, key)]
@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import in_context
+
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", 60))
+# Clips shorter than this are sent whole, splitting only adds overhead
+SEGMENT_MIN_CLIP_SECONDS = float(os.getenv("SEGMENT_MIN_CLIP_SECONDS", 90))
+SEGMENT_CONCURRENCY = int(os.getenv("SEGMENT_CONCURRENCY", 4))
+
+
+def plan_segments(regions, duration, max_seconds=SEGMENT_SECONDS):
+    """
+    Split [0, duration) into segments no longer than max_seconds, cutting in
+    the middle of the silence between speech regions wherever possible.
+    """
+    if duration <= max(max_seconds, SEGMENT_MIN_CLIP_SECONDS):
+        return [(0.0, duration)]
+
+    gaps = [(e + s) / 2.0 for (_, e), (s, _) in zip(regions, regions[1:])]
+    bounds = []
+    start = 0.0
+    i = 0
+    while duration - start > max_seconds:
+        limit = start + max_seconds
+        cut = None
+        while i < len(gaps) and gaps[i] <= limit:
+            if gaps[i] > start:
+                cut = gaps[i]
+            i += 1
+        if cut is None:
+            # No pause within reach, fall back to a hard cut
+            cut = limit
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, duration))
+    return bounds
+
+
+def map_segments(fn, segments, concurrency=SEGMENT_CONCURRENCY):
+    """Run fn over every segment concurrently, results in segment order."""
+    if len(segments) == 1:
+        return [fn(segments[0])]
+    # One context copy per call, so each segment's spans stay under the caller's
+    calls = [in_context(fn) for _ in segments]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(segments))) as pool:
+        return list(pool.map(lambda call, segment: call(segment), calls, segments))
+
+
+def stitch_transcripts(responses, segments):
+    """
+    Join per-segment Deepgram responses into one transcript, shifting word
+    timestamps by each segment's offset into the clip.
+    """
+    texts = []
+    words = []
+    for response, segment in zip(responses, segments):
+        alt = response['results']['channels'][0]['alternatives'][0]
+        if alt['transcript']:
+            texts.append(alt['transcript'])
+        for w in alt['words'] or []:
+            words.append({
+                'word': w['punctuated_word'] or w['word'],
+                'start': w['start'] + segment['offset'],
+                'end': w['end'] + segment['offset'],
+            })
+    return {'transcript': " ".join(texts), 'words': words}
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Runs pools of worker1 and worker2 processes and scales each between its
+bounds from its queue's depth: ready and unacked messages and consumer
+utilisation from the RabbitMQ management API, or the stream's backlog and
+pending entries with TRANSPORT=redis.
+
+Scaling has hysteresis: the load has to stay past a threshold for a few
+polls, and nothing changes again until a cooldown passes. Scaling down
+sends SIGTERM to the newest process, which stops consuming, finishes and
+acks what it's running and exits (see consumer.DRAINING); it's killed if
+it takes longer than SUPERVISOR_DRAIN_TIMEOUT.
+
+Probes go to the supervisor: /livez while its loop turns, /readyz once
+every pool has at least its minimum of children passing their own
+/readyz. Children serve theirs on HEALTH_PORT + 1 + their slot.
+
+    python supervisor.py
+"""
+import os
+import sys
+import math
+import time
+import signal
+import subprocess
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import redis
+import requests
+
+from metrics import (
+    METRICS_PORT, SUPERVISOR_PROCESSES, SUPERVISOR_SCALE_EVENTS, SUPERVISOR_RESTARTS, QUEUE_READY, QUEUE_UNACKED,
+    QUEUE_UTILISATION, SUPERVISED_DRAIN_SECONDS, start_metrics,
+)
+from transport import TRANSPORT, STREAM_GROUP
+from health import HEALTH_PORT, beat, start_health
+from log import get_logger, setup_logging
+
+log = get_logger("supervisor")
+
+RABBITMQ_URL = os.getenv("RABBITMQ_URI")
+# Defaults to https://<broker host>, which is where CloudAMQP serves it (see infra/create_queues.py)
+RABBITMQ_MANAGEMENT_URL = os.getenv("RABBITMQ_MANAGEMENT_URL")
+
+POLL_INTERVAL = float(os.getenv("SUPERVISOR_INTERVAL", 15))
+# Backlog per running job slot above which we add a process, and below which we remove one
+SCALE_UP_LOAD = float(os.getenv("SUPERVISOR_SCALE_UP_LOAD", 2.0))
+SCALE_DOWN_LOAD = float(os.getenv("SUPERVISOR_SCALE_DOWN_LOAD", 0.5))
+# Consumers at or below this utilisation are saturated (the broker is waiting on their prefetch)
+SATURATED_UTILISATION = float(os.getenv("SUPERVISOR_SATURATED_UTILISATION", 0.5))
+# Consecutive polls a condition must hold before acting on it
+SCALE_UP_POLLS = int(os.getenv("SUPERVISOR_SCALE_UP_POLLS", 2))
+SCALE_DOWN_POLLS = int(os.getenv("SUPERVISOR_SCALE_DOWN_POLLS", 8))
+COOLDOWN = float(os.getenv("SUPERVISOR_COOLDOWN", 60))
+DRAIN_TIMEOUT = float(os.getenv("SUPERVISOR_DRAIN_TIMEOUT", 600))
+# Per child, while answering the supervisor's own /readyz
+CHILD_PROBE_TIMEOUT = float(os.getenv("SUPERVISOR_CHILD_PROBE_TIMEOUT", 2))
+
+
+@dataclass
+class Pool:
+    name: str
+    script: str
+    queue: str
+    min: int
+    max: int
+    # Job slots per process, to turn queue depth into load
+    concurrency: int
+    running: list = field(default_factory=list)
+    # Popen -> when it was asked to stop
+    draining: dict = field(default_factory=dict)
+    above: int = 0
+    below: int = 0
+    last_change: float = 0.0
+
+
+def pools():
+    return [
+        Pool("worker1", "worker1.py", os.getenv("FIRST_QUEUE", "default_queue"),
+             int(os.getenv("WORKER1_MIN_PROCESSES", 1)), int(os.getenv("WORKER1_MAX_PROCESSES", 4)),
+             int(os.getenv("WORKER1_CONCURRENCY", 2))),
+        # worker2's next/pending bookkeeping isn't atomic across processes either; raise with care
+        Pool("worker2", "worker2.py", os.getenv("SECOND_QUEUE", "default_queue"),
+             int(os.getenv("WORKER2_MIN_PROCESSES", 1)), int(os.getenv("WORKER2_MAX_PROCESSES", 1)),
+             int(os.getenv("WORKER2_CONCURRENCY", 1))),
+    ]
+
+
+class RabbitDepth:
+    def __init__(self, url, management_url=None):
+        params = urllib.parse.urlparse(url)
+        self.auth = (urllib.parse.unquote(params.username or "guest"), urllib.parse.unquote(params.password or "guest"))
+        self.vhost = urllib.parse.quote(urllib.parse.unquote(params.path[1:]) or "/", safe="")
+        self.base = (management_url or f"https://{params.hostname}").rstrip("/")
+
+    def __call__(self, queue):
+        response = requests.get(f"{self.base}/api/queues/{self.vhost}/{queue}", auth=self.auth, timeout=10)
+        response.raise_for_status()
+        stats = response.json()
+        return stats.get("messages_ready", 0), stats.get("messages_unacknowledged", 0), stats.get("consumer_utilisation")
+
+
+class StreamDepth:
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def __call__(self, queue):
+        # Acked entries are deleted, so what's left is unread or pending
+        length = self.redis.xlen(queue)
+        groups = {g["name"]: g for g in self.redis.xinfo_groups(queue)} if length else {}
+        pending = groups.get(STREAM_GROUP, {}).get("pending", 0)
+        return length - pending, pending, None
+
+
+def decide(pool, ready, unacked, utilisation, now):
+    """How many processes the pool should have. Returns len(pool.running) to stay put."""
+    n = len(pool.running)
+    if n < pool.min:
+        return pool.min
+    load = (ready + unacked) / max(1, n * pool.concurrency)
+    saturated = ready > 0 and utilisation is not None and utilisation <= SATURATED_UTILISATION
+    pool.above = pool.above + 1 if (load > SCALE_UP_LOAD or saturated) else 0
+    pool.below = pool.below + 1 if (load < SCALE_DOWN_LOAD and not saturated) else 0
+    if now - pool.last_change < COOLDOWN:
+        return n
+    if pool.above >= SCALE_UP_POLLS and n < pool.max:
+        # Enough processes for the backlog at SCALE_UP_LOAD, at least one more
+        return min(pool.max, max(n + 1, math.ceil((ready + unacked) / (pool.concurrency * SCALE_UP_LOAD))))
+    if pool.below >= SCALE_DOWN_POLLS and n > pool.min:
+        return n - 1
+    return n
+
+
+class Supervisor:
+    def __init__(self, pools, depth):
+        self.pools = pools
+        self.depth = depth
+        self.stopping = False
+        self.slots = {}
+
+    def spawn(self, pool):
+        env = dict(os.environ)
+        # One metrics and health port per process, after the supervisor's own
+        slot = next(i for i in range(len(self.slots) + 1) if i not in self.slots.values())
+        env["METRICS_PORT"] = str(METRICS_PORT + 1 + slot) if METRICS_PORT else "0"
+        env["HEALTH_PORT"] = str(HEALTH_PORT + 1 + slot) if HEALTH_PORT else "0"
+        process = subprocess.Popen([sys.executable, pool.script], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        self.slots[process] = slot
+        pool.running.append(process)
+        log.info("Started %s pid %s", pool.name, process.pid)
+
+    def retire(self, pool):
+        process = pool.running.pop()
+        process.send_signal(signal.SIGTERM)
+        pool.draining[process] = time.monotonic()
+        log.info("Draining %s pid %s", pool.name, process.pid)
+
+    def reap(self, pool):
+        for process in list(pool.running):
+            if process.poll() is not None:
+                pool.running.remove(process)
+                self.slots.pop(process, None)
+                if not self.stopping:
+                    log.warning("%s pid %s exited with %s, replacing it", pool.name, process.pid, process.returncode)
+                    SUPERVISOR_RESTARTS.labels(worker=pool.name).inc()
+                    self.spawn(pool)
+        for process, since in list(pool.draining.items()):
+            if process.poll() is None and time.monotonic() - since > DRAIN_TIMEOUT:
+                log.warning("%s pid %s still draining after %.0fs, killing it", pool.name, process.pid, DRAIN_TIMEOUT)
+                process.kill()
+                process.wait()
+            if process.poll() is not None:
+                seconds = time.monotonic() - since
+                SUPERVISED_DRAIN_SECONDS.labels(worker=pool.name).observe(seconds)
+                log.info("%s pid %s drained in %.1fs", pool.name, process.pid, seconds)
+                del pool.draining[process]
+                self.slots.pop(process, None)
+
+    def step(self, pool):
+        self.reap(pool)
+        try:
+            ready, unacked, utilisation = self.depth(pool.queue)
+        except (requests.RequestException, redis.RedisError) as e:
+            log.warning("Could not read %s depth: %s", pool.queue, e)
+            ready, unacked, utilisation = 0, 0, None
+            # No data is not a reason to shrink
+            pool.below = 0
+        QUEUE_READY.labels(queue=pool.queue).set(ready)
+        QUEUE_UNACKED.labels(queue=pool.queue).set(unacked)
+        if utilisation is not None:
+            QUEUE_UTILISATION.labels(queue=pool.queue).set(utilisation)
+
+        now = time.monotonic()
+        n = len(pool.running)
+        target = decide(pool, ready, unacked, utilisation, now)
+        if target != n:
+            direction = "up" if target > n else "down"
+            log.info("%s %d -> %d (ready %s, unacked %s, utilisation %s)", pool.name, n, target, ready, unacked,
+                     utilisation if utilisation is not None else "-")
+            SUPERVISOR_SCALE_EVENTS.labels(worker=pool.name, direction=direction).inc()
+            pool.last_change = now
+            pool.above = pool.below = 0
+        while len(pool.running) < target:
+            self.spawn(pool)
+        while len(pool.running) > target:
+            self.retire(pool)
+        SUPERVISOR_PROCESSES.labels(worker=pool.name).set(len(pool.running))
+
+    def child_ready(self, process):
+        slot = self.slots.get(process)
+        if slot is None:
+            return False
+        try:
+            url = f"http://127.0.0.1:{HEALTH_PORT + 1 + slot}/readyz"
+            return requests.get(url, timeout=CHILD_PROBE_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def readiness(self):
+        """For /readyz, on the health server's thread: every pool has its minimum of ready children."""
+        running = {pool.name: list(pool.running) for pool in self.pools}
+        children = [process for processes in running.values() for process in processes]
+        # At once, so the whole probe stays inside CHILD_PROBE_TIMEOUT
+        with ThreadPoolExecutor(max_workers=len(children) or 1) as probes:
+            ready = dict(zip(children, probes.map(self.child_ready, children)))
+        pools = {
+            pool.name: {"ready": sum(ready[p] for p in running[pool.name]), "running": len(running[pool.name]), "min": pool.min}
+            for pool in self.pools
+        }
+        ok = not self.stopping and all(pools[pool.name]["ready"] >= pool.min for pool in self.pools)
+        return ok, {"ready": ok, "stopping": self.stopping, "pools": pools}
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            for pool in self.pools:
+                self.step(pool)
+            beat()
+            deadline = time.monotonic() + POLL_INTERVAL
+            while not self.stopping and time.monotonic() < deadline:
+                time.sleep(0.5)
+
+        log.info("Stopping, draining every worker")
+        for pool in self.pools:
+            while pool.running:
+                self.retire(pool)
+        while any(pool.draining for pool in self.pools):
+            for pool in self.pools:
+                self.reap(pool)
+            time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    setup_logging("supervisor")
+    start_metrics()
+    if TRANSPORT == "redis":
+        depth = StreamDepth(redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            password=os.getenv("REDIS_PASSWORD", ""),
+            decode_responses=True,
+        ))
+    elif RABBITMQ_URL:
+        depth = RabbitDepth(RABBITMQ_URL, RABBITMQ_MANAGEMENT_URL)
+    else:
+        log.error("RABBITMQ_URL is not defined in the environment variables.")
+        sys.exit(1)
+    supervisor = Supervisor(pools(), depth)
+    start_health(ready=supervisor.readiness)
+    supervisor.run()
@@ -0,0 +1,86 @@
+import os
+import time
+import functools
+import contextvars
+
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.trace import SpanKind
+from log import get_logger
+
+log = get_logger("tracing")
+
+# OTLP/HTTP collector, e.g. Phoenix. Auth comes from OTEL_EXPORTER_OTLP_HEADERS.
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT") or os.getenv("PHOENIX_COLLECTOR_ENDPOINT")
+# JSON lines, one span per line, for local runs without a collector
+TRACING_FILE = os.getenv("TRACING_FILE")
+
+# Set by every publisher next to traceparent, so consumers can report queue wait
+PUBLISHED_HEADER = "x-published-at"
+
+# A no-op until setup_tracing installs a provider
+tracer = trace.get_tracer("ducky.workers")
+
+
+def setup_tracing(service):
+    exporters = []
+    if OTLP_ENDPOINT:
+        endpoint = OTLP_ENDPOINT.rstrip("/")
+        if not endpoint.endswith("/v1/traces"):
+            endpoint += "/v1/traces"
+        exporters.append(OTLPSpanExporter(endpoint=endpoint))
+    if TRACING_FILE:
+        out = open(TRACING_FILE, "a")
+        exporters.append(ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n"))
+    if not exporters:
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service}))
+    for exporter in exporters:
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    try:
+        # GPT runs, thread and message calls as child spans
+        from openinference.instrumentation.openai import OpenAIInstrumentor
+        OpenAIInstrumentor().instrument(tracer_provider=provider)
+    except ImportError:
+        pass
+    log.info("Tracing %s to %s", service, ", ".join(type(e).__name__ for e in exporters))
+
+
+def span(name, **attributes):
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def annotate(**attributes):
+    """Set attributes on whatever span is current."""
+    trace.get_current_span().set_attributes(attributes)
+
+
+def inject_headers(headers=None):
+    """Message headers carrying the current trace context."""
+    carrier = dict(headers or {})
+    propagate.inject(carrier)
+    carrier[PUBLISHED_HEADER] = time.time()
+    return carrier
+
+
+def run_consumer(queue, headers, fn, *args):
+    """Run fn(*args) in a consumer span that continues the publisher's trace."""
+    headers = headers or {}
+    carrier = {k: v.decode() if isinstance(v, bytes) else v for k, v in headers.items() if isinstance(v, (str, bytes))}
+    attributes = {"messaging.destination.name": queue}
+    if PUBLISHED_HEADER in headers:
+        attributes["messaging.queue_wait_ms"] = (time.time() - float(headers[PUBLISHED_HEADER])) * 1000
+    with tracer.start_as_current_span(
+        f"{queue} process", context=propagate.extract(carrier), kind=SpanKind.CONSUMER, attributes=attributes
+    ):
+        return fn(*args)
+
+
+def in_context(fn):
+    """fn bound to the caller's context, for work handed to another thread."""
+    return functools.partial(contextvars.copy_context().run, fn)
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import socket
+import threading
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+import redis
+
+import health
+from consumer import DRAINING, drain_on_sigterm, start_consumer, message_priority
+from metrics import DRAIN_SECONDS, tracked, record_outcome
+from ratelimit import ProviderUnavailable
+from retry import MAX_RETRIES, CONSUMER_TIMEOUT, RETRY_HEADER, dead_letter_queue, pick_delay, work_queue_arguments
+from scheduler import FairScheduler, PRIORITY_NORMAL
+from tracing import run_consumer
+from log import get_logger
+
+log = get_logger("transport")
+
+# "rabbitmq" or "redis" (Redis Streams). Workers and the audio Lambda must agree.
+TRANSPORT = os.getenv("TRANSPORT", "rabbitmq")
+
+STREAM_GROUP = os.getenv("STREAM_GROUP", "workers")
+STREAM_BLOCK_MS = int(os.getenv("STREAM_BLOCK_MS", 1000))
+# How often to renew our own deliveries, reclaim stuck ones and release due retries
+STREAM_CLAIM_INTERVAL = float(os.getenv("STREAM_CLAIM_INTERVAL", 15))
+# A delivery nobody renewed for this long belongs to a dead consumer.
+# Same meaning as the RabbitMQ consumer timeout, so defaults to it.
+STREAM_CLAIM_IDLE_MS = int(os.getenv("STREAM_CLAIM_IDLE_MS", CONSUMER_TIMEOUT or 5 * 60 * 1000))
+
+# Stands in for pika's BasicProperties so priority() and fair_key() work on both
+StreamProperties = namedtuple("StreamProperties", "priority headers")
+
+
+class RabbitTransport:
+    def __init__(self, url):
+        self.url = url
+
+    def publish(self, queue, body, priority=None, headers=None):
+        connection = pika.BlockingConnection(pika.URLParameters(self.url))
+        channel = connection.channel()
+        channel.queue_declare(queue=queue, durable=True, arguments=work_queue_arguments())
+        channel.basic_publish(
+            exchange='', routing_key=queue, body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=pika.DeliveryMode.Persistent, priority=priority, headers=headers
+            ),
+        )
+        connection.close()
+
+    def consume(self, queue, process, name, **kwargs):
+        start_consumer(self.url, queue, process, name, **kwargs)
+
+
+def delayed_set(queue):
+    return f"{queue}.delayed"
+
+
+def delayed_bodies(queue):
+    return f"{queue}.delayed.bodies"
+
+
+# Move retries whose delay has passed back onto the stream. Members are
+# "<entry id>|<priority>|<retries>", bodies sit in a hash beside the set.
+# Atomic, so two consumers releasing at once can't duplicate a message.
+RELEASE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, item in ipairs(due) do
+  local _, priority, retries = string.match(item, '([^|]+)|([^|]+)|([^|]+)')
+  local body = redis.call('HGET', KEYS[2], item)
+  if body then
+    redis.call('XADD', KEYS[3], '*', 'body', body, 'priority', priority, 'retries', retries)
+  end
+  redis.call('ZREM', KEYS[1], item)
+  redis.call('HDEL', KEYS[2], item)
+end
+return #due
+"""
+
+
+def binary_client(redis_client):
+    """Same server as redis_client, without decoding: bodies may be msgpack."""
+    pool = redis_client.connection_pool
+    kwargs = {**pool.connection_kwargs, "decode_responses": False}
+    return redis.Redis(connection_pool=redis.ConnectionPool(connection_class=pool.connection_class, **kwargs))
+
+
+def entry_fields(raw):
+    return {
+        "body": raw[b"body"],
+        "priority": int(raw.get(b"priority", PRIORITY_NORMAL)),
+        "retries": int(raw.get(b"retries", 0)),
+        "headers": json.loads(raw[b"headers"]) if b"headers" in raw else {},
+    }
+
+
+class RedisStreamsTransport:
+    """
+    One stream per queue and one consumer group per stream. A delivery stays
+    in the group's pending list until acked; a consumer renews its own
+    deliveries with XCLAIM and takes over a dead consumer's with XAUTOCLAIM.
+    Retries wait in a sorted set, failures past MAX_RETRIES go to `<queue>.dlq`.
+    """
+
+    def __init__(self, redis_client):
+        self.redis = binary_client(redis_client)
+        self.release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def publish(self, queue, body, priority=None, headers=None):
+        fields = {
+            "body": body,
+            "priority": PRIORITY_NORMAL if priority is None else priority,
+            "retries": 0,
+        }
+        if headers:
+            fields["headers"] = json.dumps(headers)
+        self.redis.xadd(queue, fields)
+
+    def ensure_group(self, queue):
+        try:
+            # From the start of the stream, so messages published before the first consumer aren't skipped
+            self.redis.xgroup_create(queue, STREAM_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _finish(self, queue, entry_id, fields, future):
+        error = future.exception()
+        pipe = self.redis.pipeline()
+        if error is not None:
+            attempt = fields["retries"] + 1
+            min_delay = error.retry_after if isinstance(error, ProviderUnavailable) else 0
+            if attempt > MAX_RETRIES:
+                log.warning("Giving up after %d retries, dead-lettering to %s", attempt - 1, dead_letter_queue(queue))
+                pipe.xadd(dead_letter_queue(queue), {
+                    "body": fields["body"], "priority": fields["priority"], "retries": attempt,
+                    "headers": json.dumps(fields["headers"]), "error": str(error)[:500],
+                })
+            else:
+                delay = pick_delay(attempt, min_delay)
+                log.warning("Error processing message: %s. Retry %d/%d in %ss", error, attempt, MAX_RETRIES, delay)
+                # The entry id keeps identical bodies distinct in the set
+                item = f"{entry_id.decode()}|{fields['priority']}|{attempt}"
+                pipe.hset(delayed_bodies(queue), item, fields["body"])
+                pipe.zadd(delayed_set(queue), {item: time.time() + delay})
+        # Only ack once the work is done or safely rescheduled
+        pipe.xack(queue, STREAM_GROUP, entry_id)
+        pipe.xdel(queue, entry_id)
+        pipe.execute()
+        record_outcome(queue, error)
+
+    def consume(self, queue, process, name, concurrency=1, prefetch=None, fair_key=None,
+                priority=message_priority, head_of_line=None):
+        """Same contract as consumer.start_consumer, over a Redis Stream."""
+        prefetch = max(prefetch or concurrency, concurrency)
+        consumer = f"{name}-{socket.gethostname()}-{os.getpid()}"
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+        process = tracked(queue, process)
+        scheduler = FairScheduler()
+        # Buffered or running entry ids; completions arrive on pool threads
+        held = set()
+        lock = threading.RLock()
+        freed = threading.Event()
+
+        def dispatch():
+            with lock:
+                while len(held) - len(scheduler) < concurrency and len(scheduler):
+                    entry_id, fields = scheduler.pop(head_of_line.is_head if head_of_line else None)
+                    future = pool.submit(run_consumer, queue, fields["headers"], process, fields["body"])
+                    future.add_done_callback(functools.partial(done, entry_id, fields))
+
+        def done(entry_id, fields, future):
+            try:
+                self._finish(queue, entry_id, fields, future)
+            except redis.RedisError as e:
+                # Unacked, so it is reclaimed after STREAM_CLAIM_IDLE_MS
+                log.warning("Could not ack %s: %s", entry_id, e)
+            with lock:
+                held.discard(entry_id)
+            freed.set()
+            dispatch()
+
+        def push(entries):
+            with lock:
+                for entry_id, raw in entries:
+                    if entry_id in held:
+                        continue
+                    held.add(entry_id)
+                    fields = entry_fields(raw)
+                    properties = StreamProperties(fields["priority"], {RETRY_HEADER: fields["retries"]})
+                    key = fair_key(fields["body"]) if fair_key else None
+                    tag = head_of_line.key(fields["body"]) if head_of_line else None
+                    scheduler.push(key, (entry_id, fields), priority(fields["body"], properties), tag=tag)
+            dispatch()
+
+        def housekeeping():
+            self.release(keys=[delayed_set(queue), delayed_bodies(queue), queue], args=[time.time()])
+            with lock:
+                mine = list(held)
+            if mine:
+                # Renewing resets the idle time, so nobody else claims work we still have
+                self.redis.xclaim(queue, STREAM_GROUP, consumer, 0, mine, justid=True)
+            room = prefetch - len(mine)
+            if room > 0:
+                claimed = self.redis.xautoclaim(
+                    queue, STREAM_GROUP, consumer, STREAM_CLAIM_IDLE_MS, start_id="0-0", count=room
+                )
+                entries = [(entry_id, fields) for entry_id, fields in claimed[1] if fields]
+                gone = [entry_id for entry_id, fields in claimed[1] if not fields]
+                if gone:
+                    # Deleted while pending (Redis 6.2 still lists them), nothing left to run
+                    self.redis.xack(queue, STREAM_GROUP, *gone)
+                if entries:
+                    log.info("Reclaimed %d stuck message(s) from %s", len(entries), queue)
+                push(entries)
+
+        def drain():
+            start = time.monotonic()
+            with lock:
+                buffered = []
+                while len(scheduler):
+                    buffered.append(scheduler.pop())
+                held.difference_update(entry_id for entry_id, _ in buffered)
+                running = len(held)
+            health.draining()
+            log.info("%s draining: %d in flight, %d buffered", name, running, len(buffered))
+            if buffered:
+                # Re-add what we never started so the other consumers get it now,
+                # not after STREAM_CLAIM_IDLE_MS
+                pipe = self.redis.pipeline()
+                for entry_id, fields in buffered:
+                    pipe.xadd(queue, {
+                        "body": fields["body"], "priority": fields["priority"], "retries": fields["retries"],
+                        "headers": json.dumps(fields["headers"]),
+                    })
+                    pipe.xack(queue, STREAM_GROUP, entry_id)
+                    pipe.xdel(queue, entry_id)
+                pipe.execute()
+            # Running jobs ack from their done callbacks
+            pool.shutdown(wait=True)
+            DRAIN_SECONDS.observe(time.monotonic() - start)
+            log.info("%s drained in %.1fs", name, time.monotonic() - start)
+
+        log.info("%s waiting for messages in %s (Redis Streams)", name, queue)
+        drain_on_sigterm()
+        last_housekeeping = 0
+        grouped = False
+        while True:
+            health.beat()
+            if DRAINING.is_set():
+                drain()
+                break
+            try:
+                if not grouped:
+                    self.ensure_group(queue)
+                    grouped = True
+                if time.monotonic() - last_housekeeping > STREAM_CLAIM_INTERVAL:
+                    housekeeping()
+                    last_housekeeping = time.monotonic()
+                with lock:
+                    room = prefetch - len(held)
+                if room <= 0:
+                    # Short, so a drain is noticed promptly
+                    freed.wait(timeout=min(STREAM_CLAIM_INTERVAL, 1))
+                    freed.clear()
+                    continue
+                response = self.redis.xreadgroup(
+                    STREAM_GROUP, consumer, {queue: ">"}, count=room, block=STREAM_BLOCK_MS
+                )
+                health.broker_up(True)
+                for _, entries in response or []:
+                    push(entries)
+            except redis.ConnectionError as e:
+                health.broker_up(False)
+                log.warning("Connection error: %s. Retrying in 5 seconds...", e)
+                time.sleep(5)
+            except redis.ResponseError as e:
+                # NOGROUP after the stream was deleted; recreate and carry on
+                log.warning("Redis error: %s. Retrying in 5 seconds...", e)
+                grouped = False
+                time.sleep(5)
+            except KeyboardInterrupt:
+                log.info("%s stopped.", name)
+                pool.shutdown(wait=True)
+                break
+            except Exception as e:
+                health.broker_up(False)
+                log.error("Unexpected error: %s. Retrying in 5 seconds...", e)
+                time.sleep(5)
+
+
+def get_transport(redis_client, rabbitmq_url=None):
+    if TRANSPORT == "redis":
+        return RedisStreamsTransport(redis_client)
+    return RabbitTransport(rabbitmq_url or os.getenv("RABBITMQ_URI"))
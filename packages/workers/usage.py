@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+What each clip cost: audio seconds Deepgram billed, Hume job time, OpenAI
+tokens and wall time per stage. Every clip appends one entry per worker to
+a Redis stream; a rollup folds the stream into per-presentation totals in
+Mongo, which the report ranks.
+
+    python usage.py report [--by user] [--sort cost] [--top 20]
+    python usage.py rollup
+"""
+import os
+import time
+import argparse
+import threading
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+
+import redis
+from pymongo import MongoClient, UpdateOne
+
+from log import get_logger
+
+log = get_logger("usage")
+
+USAGE_STREAM = "usage:clips"
+# Only bounds the stream if the rollup stops; entries are deleted once rolled up
+USAGE_MAXLEN = int(os.getenv("USAGE_MAXLEN", 1_000_000))
+ROLLUP_INTERVAL = int(os.getenv("USAGE_ROLLUP_INTERVAL", 300))
+ROLLUP_GROUP = "rollup"
+ROLLUP_LOCK = "usage:rollup-lock"
+USAGE_COLLECTION = "usage"
+
+# List prices for the report, USD. Override when the contracts change.
+PRICE_AUDIO_MINUTE = float(os.getenv("USAGE_PRICE_AUDIO_MINUTE", 0.0043))
+PRICE_HUME_MINUTE = float(os.getenv("USAGE_PRICE_HUME_MINUTE", 0.0276))
+PRICE_PROMPT_1K = float(os.getenv("USAGE_PRICE_PROMPT_1K", 0.0025))
+PRICE_COMPLETION_1K = float(os.getenv("USAGE_PRICE_COMPLETION_1K", 0.01))
+# reprocess.py's tokens (batch_*) go through the Batch API at a discount
+PRICE_BATCH_FACTOR = float(os.getenv("USAGE_PRICE_BATCH_FACTOR", 0.5))
+
+# Fields that are not amounts
+_KEYS = ("pres", "user", "clip", "worker")
+
+_current = contextvars.ContextVar("usage", default=None)
+
+
+class ClipUsage:
+    """Amounts for one clip in one worker. Segments and hedges add from pool threads."""
+
+    def __init__(self, **keys):
+        self.keys = keys
+        self.amounts = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.amounts[name] += amount
+
+
+def add(**amounts):
+    """Charge amounts to the clip being processed, if any."""
+    usage = _current.get()
+    if usage is not None:
+        usage.add(**amounts)
+
+
+@contextmanager
+def recording(redis_client, worker, pres_id, user_id, clip_id):
+    """Collect usage for the block and append it to the ledger, even if the block fails."""
+    usage = ClipUsage(pres=pres_id, user=user_id, clip=clip_id, worker=worker)
+    token = _current.set(usage)
+    ok = False
+    try:
+        yield usage
+        ok = True
+    finally:
+        _current.reset(token)
+        entry = {**usage.keys, "ok": int(ok)}
+        entry.update({name: round(amount, 3) for name, amount in usage.amounts.items()})
+        try:
+            redis_client.xadd(USAGE_STREAM, entry, maxlen=USAGE_MAXLEN, approximate=True)
+        except redis.RedisError as e:
+            log.warning("Could not record usage for %s/%s: %s", pres_id, clip_id, e)
+
+
+def rollup(redis_client, collection, batch=1000):
+    """Fold ledger entries into per-presentation totals. Returns how many were rolled up."""
+    try:
+        redis_client.xgroup_create(USAGE_STREAM, ROLLUP_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+    rolled = 0
+    # Whatever a crashed rollup read but never acked comes first
+    start = "0"
+    while True:
+        response = redis_client.xreadgroup(ROLLUP_GROUP, "rollup", {USAGE_STREAM: start}, count=batch)
+        entries = response[0][1] if response else []
+        if not entries:
+            if start == ">":
+                return rolled
+            start = ">"
+            continue
+
+        totals = {}
+        for _, fields in entries:
+            doc = totals.setdefault(fields["pres"], {"user": fields["user"], "inc": defaultdict(float)})
+            ok = int(fields.get("ok", 1))
+            # Attempts that failed still cost; clips counts finished feedback only
+            doc["inc"]["clips"] += ok and fields["worker"] == "worker2"
+            doc["inc"]["failed"] += 1 - ok
+            for name, value in fields.items():
+                if name not in _KEYS and name != "ok":
+                    doc["inc"][name] += float(value)
+        collection.bulk_write([
+            UpdateOne(
+                {"_id": pres_id},
+                {"$inc": dict(doc["inc"]), "$set": {"user_id": doc["user"], "updated_at": time.time()}},
+                upsert=True,
+            )
+            for pres_id, doc in totals.items()
+        ], ordered=False)
+        # A crash before this line counts the batch twice, never zero times
+        ids = [entry_id for entry_id, _ in entries]
+        pipe = redis_client.pipeline()
+        pipe.xack(USAGE_STREAM, ROLLUP_GROUP, *ids)
+        pipe.xdel(USAGE_STREAM, *ids)
+        pipe.execute()
+        rolled += len(entries)
+
+
+def start_rollup(redis_client, collection, interval=ROLLUP_INTERVAL):
+    """Roll up in the background; a lock keeps it to one process per interval."""
+    def loop():
+        while True:
+            try:
+                if redis_client.set(ROLLUP_LOCK, os.getpid(), nx=True, ex=interval):
+                    rollup(redis_client, collection)
+            except Exception as e:
+                log.warning("Usage rollup failed: %s", e)
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name="UsageRollup", daemon=True).start()
+
+
+def cost(doc):
+    return (
+        doc.get("audio_s", 0) / 60 * PRICE_AUDIO_MINUTE
+        + doc.get("hume_s", 0) / 60 * PRICE_HUME_MINUTE
+        + doc.get("prompt_tokens", 0) / 1000 * PRICE_PROMPT_1K
+        + doc.get("completion_tokens", 0) / 1000 * PRICE_COMPLETION_1K
+        + (
+            doc.get("batch_prompt_tokens", 0) / 1000 * PRICE_PROMPT_1K
+            + doc.get("batch_completion_tokens", 0) / 1000 * PRICE_COMPLETION_1K
+        ) * PRICE_BATCH_FACTOR
+    )
+
+
+def report(collection, by, sort, top):
+    docs = list(collection.find())
+    if by == "user":
+        grouped = {}
+        for doc in docs:
+            user = grouped.setdefault(doc.get("user_id", "?"), defaultdict(float, _id=doc.get("user_id", "?")))
+            for name, value in doc.items():
+                if isinstance(value, (int, float)) and name != "updated_at":
+                    user[name] += value
+        docs = list(grouped.values())
+
+    for doc in docs:
+        doc["cost"] = cost(doc)
+    docs.sort(key=lambda doc: -doc.get(sort, 0))
+
+    print(f"{len(docs)} {by}(s), ${sum(doc['cost'] for doc in docs):.2f} estimated")
+    print(f"\n{by:<28}{'clips':>7}{'audio s':>10}{'hume s':>9}{'prompt':>10}{'compl.':>9}{'images':>8}{'wall s':>9}{'$':>8}")
+    for doc in docs[:top]:
+        wall = sum(value for name, value in doc.items() if name.startswith("wall_"))
+        print(
+            f"{str(doc['_id']):<28}{doc.get('clips', 0):>7.0f}{doc.get('audio_s', 0):>10.1f}{doc.get('hume_s', 0):>9.1f}"
+            f"{doc.get('prompt_tokens', 0):>10.0f}{doc.get('completion_tokens', 0):>9.0f}{doc.get('images', 0):>8.0f}"
+            f"{wall:>9.1f}{doc['cost']:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provider usage per presentation")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report")
+    p.add_argument("--by", choices=("presentation", "user"), default="presentation")
+    p.add_argument("--sort", default="cost", help="cost, audio_s, hume_s, prompt_tokens, wall_feedback_s, ...")
+    p.add_argument("--top", type=int, default=20)
+    sub.add_parser("rollup")
+    args = parser.parse_args()
+
+    database = MongoClient(os.getenv("MONGO_URI"))[os.getenv("MONGO_DB")]
+    if args.command == "report":
+        report(database[USAGE_COLLECTION], args.by, args.sort, args.top)
+    else:
+        client = redis.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            password=os.getenv("REDIS_PASSWORD", ""),
+            decode_responses=True,
+        )
+        print(f"Rolled up {rollup(client, database[USAGE_COLLECTION])} entries")
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+
+FRAME_MS = int(os.getenv("VAD_FRAME_MS", 30))
+# Frames quieter than this (dBFS) are never speech, whatever the noise floor
+SILENCE_DB = float(os.getenv("VAD_SILENCE_DB", -45))
+# How far above the clip's own noise floor a frame must be to count as speech
+FLOOR_MARGIN_DB = float(os.getenv("VAD_FLOOR_MARGIN_DB", 12))
+# Upper bound on the adaptive threshold so clips with few pauses still pass
+MAX_THRESHOLD_DB = float(os.getenv("VAD_MAX_THRESHOLD_DB", -30))
+MIN_SPEECH_SECONDS = float(os.getenv("VAD_MIN_SPEECH_SECONDS", 1.0))
+MERGE_GAP_SECONDS = float(os.getenv("VAD_MERGE_GAP_SECONDS", 0.3))
+PAD_SECONDS = float(os.getenv("VAD_PAD_SECONDS", 0.2))
+
+SILENT = "silent"
+SHORT = "short"
+SPEECH = "speech"
+
+
+def frame_features(pcm, sample_rate):
+    """Per-frame energy (dBFS) and zero-crossing rate of s16le mono PCM."""
+    frame = sample_rate * FRAME_MS // 1000
+    samples = np.frombuffer(pcm, dtype="<i2")
+    n = len(samples) // frame
+    if n == 0:
+        return np.empty(0, np.float32), np.empty(0, np.float32)
+
+    frames = samples[: n * frame].reshape(n, frame).astype(np.float32) / 32768.0
+    energy = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / float(frame - 1)
+    return energy.astype(np.float32), zcr.astype(np.float32)
+
+
+def _runs(mask):
+    """Start/end frame indices of each run of True in a boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _fill(mask, starts, ends, value):
+    """Set every frame inside the given runs to `value` without a Python loop."""
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    mask[np.repeat(starts, lengths) + offsets] = value
+
+
+def speech_mask(energy, zcr):
+    if len(energy) == 0:
+        return np.zeros(0, bool)
+
+    floor = np.percentile(energy, 10)
+    threshold = max(SILENCE_DB, min(floor + FLOOR_MARGIN_DB, MAX_THRESHOLD_DB))
+    mask = energy > threshold
+    # Hiss and breath noise: lots of zero crossings but barely above threshold
+    mask &= ~((zcr > 0.4) & (energy < threshold + 6.0))
+
+    # Close short gaps between words
+    gap = int(MERGE_GAP_SECONDS * 1000 / FRAME_MS)
+    starts, ends = _runs(~mask)
+    keep = (starts > 0) & (ends < len(mask)) & (ends - starts <= gap)
+    _fill(mask, starts[keep], ends[keep], True)
+
+    # Drop isolated clicks
+    starts, ends = _runs(mask)
+    keep = ends - starts < 3
+    _fill(mask, starts[keep], ends[keep], False)
+    return mask
+
+
+def classify(pcm, sample_rate):
+    """
+    Label a clip as silent, short or speech.
+    Returns the label, the speech regions in seconds and the (start, end)
+    bounds to trim the clip to.
+    """
+    energy, zcr = frame_features(pcm, sample_rate)
+    mask = speech_mask(energy, zcr)
+    starts, ends = _runs(mask)
+
+    step = FRAME_MS / 1000.0
+    regions = [(float(s * step), float(e * step)) for s, e in zip(starts, ends)]
+    speech_seconds = float(np.count_nonzero(mask) * step)
+    duration = len(pcm) / (2.0 * sample_rate)
+
+    if not regions:
+        label = SILENT
+        bounds = (0.0, duration)
+    else:
+        label = SHORT if speech_seconds < MIN_SPEECH_SECONDS else SPEECH
+        bounds = (
+            max(0.0, regions[0][0] - PAD_SECONDS),
+            min(duration, regions[-1][1] + PAD_SECONDS),
+        )
+
+    return {
+        "label": label,
+        "regions": regions,
+        "speech_seconds": speech_seconds,
+        "bounds": bounds,
+    }
@@ -1,14 +1,30 @@
-import pika
 import os
 import json
 from dotenv import load_dotenv
 import time
 import redis
-from openai import OpenAI
-from deepgram import DeepgramClient, PrerecordedOptions
-from hume import HumeClient
-import asyncio
+import functools
+import threading
 from pymongo import MongoClient
+from audio import prepare_audio
+from vad import SILENT, SHORT
+from segments import map_segments, stitch_transcripts
+from emotions import load_predictions, score, pack_timeline
+from hedging import HEDGERS
+from ratelimit import configure as configure_ratelimits, get_guard, ProviderUnavailable
+from retry import Ledger
+from transport import TRANSPORT, get_transport
+from messages import encode_job
+from lifecycle import touch
+from locks import single_flight
+from tracing import setup_tracing, span, annotate, inject_headers
+from usage import add as add_usage, recording
+from scheduler import fair_key, clip_priority
+from metrics import HEAD_OF_LINE_EXPEDITED, POLLS, THREAD_POOL_TAKEN, stage_timer, start_metrics
+from lazy import Lazy
+from log import get_logger, bind, sample, setup_logging
+from prompts import context_prompt
+from health import register, warm_up, start_health
 
 
 
@@ -25,22 +41,52 @@ REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', '')
 OPEN_API_KEY= os.getenv("OPEN_API_KEY")
 HUME_API_KEY=os.getenv("HUME_API_KEY")
 DEEPGRAM_API_KEY= os.getenv("DEEPGRAM_API_KEY")
+# Provider endpoints, overridden by the load test's fake providers (OpenAI reads OPENAI_BASE_URL itself)
+DEEPGRAM_URL = os.getenv("DEEPGRAM_URL", "")
+HUME_BASE_URL = os.getenv("HUME_BASE_URL")
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
+# Clips are independent, so several can be transcribed at once
+WORKER1_CONCURRENCY = int(os.getenv("WORKER1_CONCURRENCY", 2))
+# Deliveries buffered locally for fair scheduling across presentations
+WORKER1_PREFETCH = int(os.getenv("WORKER1_PREFETCH", 16))
+# How stale the head-of-line view used to pick the next buffered clip may get
+HEAD_OF_LINE_REFRESH = float(os.getenv("HEAD_OF_LINE_REFRESH", 0.5))
+# Empty OpenAI threads kept ready, so bootstrapping only posts the context message (0 disables)
+THREAD_POOL_SIZE = int(os.getenv("THREAD_POOL_SIZE", 0))
+THREAD_POOL_REFILL_INTERVAL = int(os.getenv("THREAD_POOL_REFILL_INTERVAL", 60))
+# Well inside the 60 days after which OpenAI deletes an idle thread
+THREAD_POOL_MAX_AGE = int(os.getenv("THREAD_POOL_MAX_AGE", 30 * 24 * 3600))
+THREAD_POOL_KEY = "openai:thread-pool"
+THREAD_POOL_LOCK = "openai:thread-pool-lock"
+
+# Provider SDKs are imported and their clients built on first use (or by start_worker's warm-up)
+database = Lazy(lambda: MongoClient(MONGO_URI)[MONGO_DB])
+
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(
+      api_key=OPEN_API_KEY,
+      organization=ORGANIZATION_ID,
+      project=PROJECT_ID,
+    )
 
-mongo_client = MongoClient(MONGO_URI)
-database = mongo_client[MONGO_DB]
+def _hume_client():
+    from hume import HumeClient
+    return HumeClient(
+        api_key=HUME_API_KEY,
+        base_url=HUME_BASE_URL,
+    )
 
+def _deepgram_client():
+    from deepgram import DeepgramClient, DeepgramClientOptions
+    return DeepgramClient(DEEPGRAM_API_KEY, DeepgramClientOptions(url=DEEPGRAM_URL))
 
-OPENAI_CLIENT = OpenAI(
-  api_key=OPEN_API_KEY,
-  organization=ORGANIZATION_ID,
-  project=PROJECT_ID,
-)
+OPENAI_CLIENT = Lazy(_openai_client)
+HUME_CLIENT = Lazy(_hume_client)
+deepgram = Lazy(_deepgram_client)
 
-HUME_CLIENT = HumeClient(
-    api_key=HUME_API_KEY,
-)
+log = get_logger("worker1")
 
 re = redis.Redis(
     host=REDIS_HOST,
@@ -48,25 +94,177 @@ re = redis.Redis(
     password=REDIS_PASSWORD,
     decode_responses=True
 )
-if not RABBITMQ_URL:
-    print("RABBITMQ_URL is not defined in the environment variables.")
-    exit(1)
-
-deepgram_api_key = os.getenv("DEEPGRAM_API_KEY")
-deepgram = DeepgramClient(deepgram_api_key)
+configure_ratelimits(re)
+LEDGER = Ledger(re)
+transport = get_transport(re, RABBITMQ_URL)
 
 
 
 def redis_presentation_exists(pres_id):
     return re.hget(pres_id, 'thread_id') != None
 
-def redis_create_presentation(pres_id, thread_id):
-    re.hset(pres_id, 'next', 0)
-    re.hset(pres_id, 'thread_id', thread_id)
-    re.hset(pres_id, 'pending', json.dumps({}))
+# One write, so nobody sees a thread_id without next/pending, and only if no
+# thread_id is there yet: a second creator must not reset worker2's progress
+CREATE_PRESENTATION_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'thread_id') == 1 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'thread_id', ARGV[1], 'user_id', ARGV[2])
+redis.call('HSETNX', KEYS[1], 'next', 0)
+redis.call('HSETNX', KEYS[1], 'pending', '{}')
+return 1
+"""
+
+def redis_create_presentation(pres_id, thread_id, user_id):
+    """False when another worker created the presentation first."""
+    # user_id is for the lifecycle report's per-user totals
+    return bool(re.eval(CREATE_PRESENTATION_SCRIPT, 1, pres_id, thread_id, user_id))
+
+def bootstrap_presentation(user_id, pres_id):
+    """
+    Create the presentation's OpenAI thread exactly once, even when its
+    first clips land on several workers at the same time.
+    """
+    def create():
+        log.info("Creating thread")
+        with stage_timer("thread_create"):
+            thread_id = create_thread(user_id, pres_id)
+        if thread_id is None:
+            raise RuntimeError(f"Could not create a thread for presentation {pres_id}")
+        if not redis_create_presentation(pres_id, thread_id, user_id):
+            log.warning("Presentation was created meanwhile, thread %s is unused", thread_id)
+            return
+        log.info("Created thread %s", thread_id)
+
+    with span("bootstrap", **{"presentation.id": pres_id}):
+        single_flight(re, f"bootstrap:{pres_id}", lambda: redis_presentation_exists(pres_id), create)
+
+def prewarm(user_id, pres_id):
+    """
+    Bootstrap a presentation once its slides are converted (the PDF Lambda
+    asks), so its first clip finds the thread ready.
+    """
+    touch(re, pres_id)
+    try:
+        bootstrap_presentation(user_id, pres_id)
+    except (RuntimeError, TimeoutError) as e:
+        # The first clip tries again
+        log.warning("Could not prewarm: %s", e)
 
-def redis_add_gpt_job(pres_id, user_id, clip_id, transcript, slide_url, video_url, is_end, emotion, score):
-    data = {
+def take_pooled_thread():
+    """A spare thread id, or None when the pool is empty."""
+    while True:
+        entry = re.lpop(THREAD_POOL_KEY)
+        if entry is None:
+            THREAD_POOL_TAKEN.labels(result="miss").inc()
+            return None
+        thread_id, created = entry.rsplit(':', 1)
+        if time.time() - float(created) < THREAD_POOL_MAX_AGE:
+            THREAD_POOL_TAKEN.labels(result="hit").inc()
+            return thread_id
+
+def refill_thread_pool():
+    for _ in range(THREAD_POOL_SIZE - re.llen(THREAD_POOL_KEY)):
+        thread = get_guard("openai:threads").call(OPENAI_CLIENT.beta.threads.create)
+        re.rpush(THREAD_POOL_KEY, f"{thread.id}:{time.time()}")
+
+def start_thread_pool():
+    """Keep THREAD_POOL_SIZE spare threads; a lock keeps it to one process per interval."""
+    if not THREAD_POOL_SIZE:
+        return
+
+    def loop():
+        while True:
+            try:
+                if re.set(THREAD_POOL_LOCK, os.getpid(), nx=True, ex=THREAD_POOL_REFILL_INTERVAL):
+                    refill_thread_pool()
+            except Exception as e:
+                log.warning("Thread pool refill failed: %s", e)
+            time.sleep(THREAD_POOL_REFILL_INTERVAL)
+
+    threading.Thread(target=loop, name="ThreadPoolRefill", daemon=True).start()
+
+def redis_get_next(pres_id):
+    # Before the presentation exists worker2 is waiting on clip 0
+    return int(re.hget(pres_id, 'next') or 0)
+
+def is_head_of_line(pres_id, clip_id):
+    """worker2 can't move on with this presentation until this clip lands."""
+    return int(clip_id) == redis_get_next(pres_id)
+
+class HeadOfLine:
+    """
+    Jump the clip worker2 is blocked on ahead of everything buffered, even
+    final clips: a later clip that finishes first only waits in `pending`.
+
+    The consumer asks when it picks the next delivery, so a clip that became
+    head of line while buffered still goes first. That runs on the I/O
+    thread, so is_head() only reads a copy of each presentation's `next`,
+    refreshed with one pipelined HGET per round by a background thread.
+    """
+
+    # Presentations not seen in a delivery for this long drop out of the refresh
+    FORGET_SECONDS = 600
+
+    def __init__(self, redis_client, interval=HEAD_OF_LINE_REFRESH):
+        self.redis = redis_client
+        self.interval = interval
+        self.next = {}
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def key(self, body):
+        try:
+            job = json.loads(body)
+        except ValueError as e:
+            log.warning("Could not check head of line: %s", e)
+            return None
+        # Prewarm requests have no clip for worker2 to wait on
+        if job.get('type', 'clip') != 'clip':
+            return None
+        try:
+            tag = (job['presentationID'], int(job['clipIndex']))
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning("Could not check head of line: %s", e)
+            return None
+        with self.lock:
+            if tag[0] not in self.seen:
+                # Fetch a new presentation's pointer now rather than next round
+                self.wake.set()
+            self.seen[tag[0]] = time.monotonic()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.refresh, name="HeadOfLine", daemon=True)
+                self.thread.start()
+        return tag
+
+    def is_head(self, tag):
+        return self.next.get(tag[0]) == tag[1]
+
+    def refresh(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            cutoff = time.monotonic() - self.FORGET_SECONDS
+            with self.lock:
+                self.seen = {pres_id: t for pres_id, t in self.seen.items() if t > cutoff}
+                pres_ids = list(self.seen)
+            pipe = self.redis.pipeline(transaction=False)
+            for pres_id in pres_ids:
+                pipe.hget(pres_id, 'next')
+            try:
+                values = pipe.execute()
+            except redis.RedisError as e:
+                log.debug("Could not refresh head of line: %s", e, extra=sample("head-of-line"))
+                continue
+            # Before the presentation exists worker2 is waiting on clip 0
+            self.next = {pres_id: int(value or 0) for pres_id, value in zip(pres_ids, values)}
+
+HEAD_OF_LINE = HeadOfLine(re)
+
+def gpt_job(pres_id, user_id, clip_id, transcript, slide_url, video_url, is_end, emotion, score, timeline='', silent=False, clip_timestamp=''):
+    return {
         'USER_ID': user_id,
         'TRANSCRIPT': transcript,
         'SLIDE_URL': slide_url,
@@ -75,9 +273,11 @@ def redis_add_gpt_job(pres_id, user_id, clip_id, transcript, slide_url, video_ur
         'CLIP_ID': clip_id,
         'IS_END': is_end,
         'EMOTIONS': emotion,
-        'SCORE': score
+        'SCORE': score,
+        'TIMELINE': timeline,
+        'SILENT': silent,
+        'CLIP_TIMESTAMP': clip_timestamp
     }
-    re.hset(pres_id, clip_id, json.dumps(data))
 
 def create_thread(user_id, pres_id):
     collection = database["users"]
@@ -89,170 +289,233 @@ def create_thread(user_id, pres_id):
     )
 
     if not result or 'presentations' not in result or len(result['presentations']) == 0:
-        print(f"No presentation found for user_id: {user_id}, pres_id: {pres_id}")
+        log.warning("No presentation found for user_id: %s, pres_id: %s", user_id, pres_id)
         return None  # Or handle as appropriate
 
-    preset = result['presentations'][0].get('preset', {})
-    
-    # Validate preset fields
-    presentation_description = preset.get('presentationDescription') or "None"
-    audience_description = preset.get('audienceDescription') or "None"
-    tone_description = preset.get('toneDescription') or "None"
-
-    # Construct the initial message
-    initial_message = (
-        "Now you will be given descriptions of the presentation's context, the audience, and the tone.\n"
-        f"This presentation is about: {presentation_description}. "
-        f"The audience is: {audience_description}. "
-        f"The tone should be: {tone_description}."
-    )
-    
-    # Create a new OpenAI thread
-    try:
-        thread = OPENAI_CLIENT.beta.threads.create()
-    except Exception as e:
-        print(f"Failed to create OpenAI thread: {e}")
-        return None  # Or handle as appropriate
+    initial_message = context_prompt(result['presentations'][0].get('preset', {}))
+
+    # Take a spare thread, or create a new OpenAI thread
+    thread_id = take_pooled_thread() if THREAD_POOL_SIZE else None
+    if thread_id is None:
+        try:
+            thread_id = get_guard("openai:threads").call(OPENAI_CLIENT.beta.threads.create).id
+        except ProviderUnavailable:
+            raise
+        except Exception as e:
+            log.error("Failed to create OpenAI thread: %s", e)
+            return None  # Or handle as appropriate
     
     # Structure the content as a list of message objects
     content = [{"type": "text", "text": initial_message}]
     
     # Send the initial message to the OpenAI thread
     try:
-        OPENAI_CLIENT.beta.threads.messages.create(
-            thread_id=thread.id,
+        get_guard("openai:threads").call(
+            OPENAI_CLIENT.beta.threads.messages.create,
+            thread_id=thread_id,
             role="user",
             content=content
         )
+    except ProviderUnavailable:
+        raise
     except Exception as e:
-        print(f"Failed to send initial message to OpenAI thread: {e}")
+        log.error("Failed to send initial message to OpenAI thread: %s", e)
         return None  # Or handle as appropriate
     
-    return thread.id
+    return thread_id
+
+EMPTY_EMOTIONS = {'emotions': '', 'score': '', 'timeline': ''}
 
-def get_transcript(audio_url):
+def transcribe_segment(segment, expedite=False):
+    return HEDGERS["deepgram"].call(_transcribe_segment, segment, expedite=expedite)
 
+def _transcribe_segment(stop, segment):
+    from deepgram import PrerecordedOptions
     # Define the transcription options
     options: PrerecordedOptions = PrerecordedOptions(
         model="nova-2",
         smart_format=True,
     )
 
-    audio_source = {"url": audio_url}    
-    response = deepgram.listen.rest.v("1").transcribe_url(audio_source, options, timeout=300)
-    transcript = response['results']['channels'][0]['alternatives'][0]['transcript']
-    print("transcript", transcript)
+    audio_source = {"buffer": segment['data']}
+    response = get_guard("deepgram:listen").call(
+        deepgram.listen.rest.v("1").transcribe_file, audio_source, options, timeout=300
+    )
+    # Billed per call, so a hedged duplicate counts too
+    add_usage(audio_s=response.metadata.duration, deepgram_calls=1)
+    return response
+
+def get_transcript(audio, expedite=False):
+    # Segments are transcribed concurrently and stitched back in order
+    responses = map_segments(functools.partial(transcribe_segment, expedite=expedite), audio['segments'])
+    transcript = stitch_transcripts(responses, audio['segments'])['transcript']
+    log.debug("Transcript: %s", transcript)
 
     return transcript
 
-def get_emotions(audio_url):
-    audio_job = HUME_CLIENT.expression_measurement.batch.start_inference_job(
-        urls=[audio_url],
-        notify=True,
+def run_hume_job(stop, files):
+    with span("hume job"):
+        return _run_hume_job(stop, files)
+
+def _run_hume_job(stop, files):
+    from hume.expression_measurement.batch.types import InferenceBaseRequest
+    batch = HUME_CLIENT.expression_measurement.batch
+    start = time.monotonic()
+    audio_job = get_guard("hume:jobs").call(
+        batch.start_inference_job_from_local_file,
+        file=files,
+        json=InferenceBaseRequest(notify=True),
     )
 
-    while HUME_CLIENT.expression_measurement.batch.get_job_details(id=audio_job).state.status != "COMPLETED":
+    annotate(**{"hume.job_id": str(audio_job)})
+    polls = 0
+    while (status := get_guard("hume:status").call(batch.get_job_details, id=audio_job).state.status) != "COMPLETED":
+        polls += 1
+        POLLS.labels(loop="hume").inc()
+        annotate(**{"hume.polls": polls})
+        if status == "FAILED":
+            raise RuntimeError(f"Hume job {audio_job} failed")
+        if stop.is_set():
+            # The hedged duplicate already finished
+            return None
         time.sleep(1.5)
-        print(HUME_CLIENT.expression_measurement.batch.get_job_details(id=audio_job).state.status)
+        log.debug("Hume job %s %s", audio_job, status, extra=sample(f"hume:{audio_job}"))
 
-    audio_resp = HUME_CLIENT.expression_measurement.batch.get_job_predictions(
-        id=audio_job,
-    )
+    add_usage(hume_s=time.monotonic() - start, hume_jobs=1)
+    return get_guard("hume:jobs").call(batch.get_job_predictions, id=audio_job)
 
-    emot_list = []
-    result = {}
+def get_emotions(audio, expedite=False):
+    segments = audio['segments']
+    files = [(f"segment_{i}_{audio['filename']}", seg['data'], audio['mimetype']) for i, seg in enumerate(segments)]
+    audio_resp = HEDGERS["hume"].call(run_hume_job, files, expedite=expedite)
+
+    # Every prosody segment of every uploaded file, placed on the clip's timeline
+    offsets = {name: seg['offset'] for (name, _, _), seg in zip(files, segments)}
     try:
-        for i in range(len(audio_resp[0].results.predictions[0].models.prosody.grouped_predictions[0].predictions[0].emotions)):
-            emot = audio_resp[0].results.predictions[0].models.prosody.grouped_predictions[0].predictions[0].emotions[i]
-            result[emot.name] = emot.score
-            emot_list.append({'emotion': emot.name, 'score': emot.score})
+        names, matrix, begin, end = load_predictions(audio_resp, offsets)
     except Exception as e:
-        print(f"Failed to parse emotions: {e}.")
-        return {'emotions': '', 'score': ''}
-    
-    emot_list.sort(key=lambda x: -x['score'])
-
-    bad_avg = (result['Awkwardness']+result['Anxiety']+result['Confusion']+result['Doubt']+result['Embarrassment']+result['Fear']+result['Tiredness']) / 7.0
-    good_avg = (result['Calmness'] + result['Concentration'] + result['Determination'] + result['Excitement'] + result['Interest'] + result['Joy']) / 6.0
-
-
-    print(f"Emotions: {emot_list[:3]}")
-    return {'emotions': json.dumps([x['emotion'] for x in emot_list[:3]]), 'score': str(50*(good_avg - bad_avg + 1))}
+        log.warning("Failed to parse emotions: %s", e)
+        return EMPTY_EMOTIONS
+    if len(matrix) == 0:
+        log.info("No prosody predictions returned")
+        return EMPTY_EMOTIONS
+
+    scored = score(names, matrix, begin, end)
+    log.debug("Emotions: %s", scored['top'])
+    return {
+        'emotions': json.dumps(scored['top']),
+        'score': str(scored['score']),
+        'timeline': pack_timeline(begin, end, scored['confidence']),
+    }
 
 
 
 def process_transcription_job(job_params):
-    result = get_transcript(job_params['audioURL'])
-    emot = get_emotions(job_params['audioURL'])
+    with recording(re, "worker1", job_params["presentationID"], job_params["userID"], job_params["clipIndex"]):
+        return _process_transcription_job(job_params)
 
+def _process_transcription_job(job_params):
     user_id = job_params["userID"]
     pres_id = job_params["presentationID"]
-
-    if not redis_presentation_exists(pres_id):
-        print("thread being created")
-        thread_id = create_thread(user_id, pres_id)
-        redis_create_presentation(pres_id, thread_id)
-        print("thread successful")
-    print("using existing thread")
-    redis_add_gpt_job(
+    clip_id = job_params["clipIndex"]
+    # A re-recorded clip keeps its index but gets a new timestamp
+    attempt_id = f"{clip_id}_{job_params.get('clipTimestamp', '')}"
+    # Hedge the clip worker2 is waiting on sooner, it holds up the rest
+    expedite = is_head_of_line(pres_id, clip_id)
+    if expedite:
+        HEAD_OF_LINE_EXPEDITED.inc()
+
+    # Download and transcode once, then upload the same bytes to both providers.
+    # Loaded lazily so a redelivery whose provider stages are all in the ledger skips it.
+    audio = {}
+    def load_audio():
+        if not audio:
+            audio.update(prepare_audio(job_params['audioURL']))
+        return audio
+
+    def vad_label():
+        vad = load_audio()['vad']
+        return vad['label'] if vad else None
+
+    label = LEDGER.once(pres_id, attempt_id, "vad", vad_label)
+
+    if label == SILENT:
+        # Nothing was said, skip the providers and let worker2 write templated feedback
+        log.info("Clip is silent, skipping providers")
+        result = ''
+        emot = EMPTY_EMOTIONS
+    elif label == SHORT:
+        # Too little speech for prosody to mean anything
+        result = LEDGER.once(pres_id, attempt_id, "transcribe", lambda: get_transcript(load_audio(), expedite))
+        emot = EMPTY_EMOTIONS
+    else:
+        result = LEDGER.once(pres_id, attempt_id, "transcribe", lambda: get_transcript(load_audio(), expedite))
+        emot = LEDGER.once(pres_id, attempt_id, "emotions", lambda: get_emotions(load_audio(), expedite))
+
+    touch(re, pres_id)
+    bootstrap_presentation(user_id, pres_id)
+    # The whole clip travels in the message, worker2 no longer reads it back from Redis
+    job = gpt_job(
         pres_id, 
         user_id, 
-        job_params["clipIndex"], 
+        clip_id, 
         result, 
         job_params['slideURL'],
         job_params['videoURL'],
         job_params['isEnd'],
         emot['emotions'],
-        emot['score']
+        emot['score'],
+        timeline=emot['timeline'],
+        silent=label == SILENT,
+        clip_timestamp=job_params.get('clipTimestamp', '')
     )
-    print("finished adding to redis")
 
-    return {'PRESENTATION_ID': pres_id, 'CLIP_ID': job_params["clipIndex"]}
+    return {**job, 'ATTEMPT_ID': attempt_id}
 
 def process_message(body):
     message = body.decode()
-    print(f" [x] Worker1 received: {message}")
     # TODO: Add your processing logic here
-    job_params = process_transcription_job(json.loads(message))
-    # Pass presentation id, clip id to queue 2
-    
-    print(f" [x] Worker1 sending to queue 2: {job_params}")
-    params = pika.URLParameters(RABBITMQ_URL)
-    connection = pika.BlockingConnection(params)
-    channel = connection.channel()
-    channel.queue_declare(queue=QUEUE_NAME_TWO, durable=True)
-    channel.basic_publish(exchange='', routing_key=QUEUE_NAME_TWO, body=json.dumps(job_params),properties=pika.BasicProperties(delivery_mode=pika.DeliveryMode.Persistent))
-    print(f" [x] Worker1 finished queue 2: {job_params}")
-    connection.close()
-
-def callback(ch, method, properties, body):
-    try:
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-        process_message(body)
-    except Exception as e:
-        print(f"Error processing message: {e}")
-        # Optionally, send to a dead-letter queue or retry
+    clip = json.loads(message)
+    with bind(pres=clip.get('presentationID'), clip=clip.get('clipIndex')):
+        log.info("Received %s", clip.get('type', 'clip'))
+        log.debug("Message: %s", message)
+        if clip.get('type') == 'prewarm':
+            prewarm(clip['userID'], clip['presentationID'])
+            return
+        job_params = process_transcription_job(clip)
+        # Pass presentation id, clip id to queue 2
+
+        LEDGER.once(
+            job_params['PRESENTATION_ID'], job_params.pop('ATTEMPT_ID'), "forward",
+            forward_to_queue_two, job_params, clip_priority(clip['isEnd'])
+        )
+
+def forward_to_queue_two(job_params, priority):
+    transport.publish(QUEUE_NAME_TWO, encode_job(job_params, re), priority=priority, headers=inject_headers())
+    log.info("Forwarded to %s", QUEUE_NAME_TWO)
 
 def start_worker():
-    while True:
-        try:
-            params = pika.URLParameters(RABBITMQ_URL)
-            connection = pika.BlockingConnection(params)
-            channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME, durable=True)
-            print(f" [*] Worker1 waiting for messages in {QUEUE_NAME}. To exit press CTRL+C")
-            channel.basic_qos(prefetch_count=1)
-            # calls callback when we get the message
-            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
-            print(f"Connection error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
-        except KeyboardInterrupt:
-            print("Worker1 stopped.")
-            break
-        except Exception as e:
-            print(f"Unexpected error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
+    setup_logging("worker1")
+    if TRANSPORT == "rabbitmq" and not RABBITMQ_URL:
+        log.error("RABBITMQ_URL is not defined in the environment variables.")
+        exit(1)
+    start_metrics()
+    register("redis", re.ping)
+    register("mongo", lambda: database.client.admin.command("ping"))
+    start_health()
+    warm_up({
+        "redis": re.ping,
+        "mongo": lambda: database.client.admin.command("ping"),
+        # One step: imports serialise on the import lock and the GIL anyway
+        "providers": lambda: (OPENAI_CLIENT.get(), HUME_CLIENT.get(), deepgram.get()),
+    }, wait=False)
+    setup_tracing("worker1")
+    start_thread_pool()
+    transport.consume(
+        QUEUE_NAME, process_message, "Worker1",
+        concurrency=WORKER1_CONCURRENCY, prefetch=WORKER1_PREFETCH, fair_key=fair_key,
+        head_of_line=HEAD_OF_LINE,
+    )
 
-start_worker()
\ No newline at end of file
+if __name__ == "__main__":
+    start_worker()
\ No newline at end of file
@@ -2,9 +2,21 @@ import os
 import json
 import time
 import redis
-import pika
 from pymongo import MongoClient
-from openai import OpenAI
+from hedging import HEDGERS
+from ratelimit import configure as configure_ratelimits, get_guard
+from retry import Ledger
+from transport import TRANSPORT, get_transport, binary_client
+from messages import decode_job
+from lifecycle import pack_clip, unpack_clip, touch, finish, start_sweeper
+from tracing import setup_tracing, span, annotate
+from usage import add as add_usage, recording, start_rollup, USAGE_COLLECTION
+from scheduler import fair_key
+from metrics import HEAD_OF_LINE_WAIT, POLLS, set_reorder_depth, stage_timer, start_metrics
+from lazy import Lazy
+from log import get_logger, bind, sample, setup_logging
+from prompts import clip_content, SUMMARY_PROMPT
+from health import register, warm_up, start_health
 
 # Remove load_dotenv() since Docker provides environment variables directly
 # load_dotenv()
@@ -24,38 +36,47 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "")
 
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
+# The next/pending bookkeeping is not atomic, keep one job at a time per process
+WORKER2_CONCURRENCY = int(os.getenv("WORKER2_CONCURRENCY", 1))
+# Deliveries buffered locally for fair scheduling across presentations
+WORKER2_PREFETCH = int(os.getenv("WORKER2_PREFETCH", 16))
+
+
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(
+        api_key=OPEN_API_KEY,
+        organization=ORGANIZATION_ID,
+        project=PROJECT_ID,
+    )
 
-if not RABBITMQ_URL:
-    print("RABBITMQ_URL is not defined in the environment variables.")
-    exit(1)
 
-# Initialize clients
-OPENAI_CLIENT = OpenAI(
-    api_key=OPEN_API_KEY,
-    organization=ORGANIZATION_ID,
-    project=PROJECT_ID,
-)
+# Clients are built on first use (or by start_worker's warm-up), so importing this module is cheap
+OPENAI_CLIENT = Lazy(_openai_client)
+
+log = get_logger("worker2")
 
 redis_client = redis.Redis(
     host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True
 )
+# Parked clips are stored packed
+redis_bytes = binary_client(redis_client)
 
-mongo_client = MongoClient(MONGO_URI)
-database = mongo_client[MONGO_DB]
+configure_ratelimits(redis_client)
+LEDGER = Ledger(redis_client)
+transport = get_transport(redis_client, RABBITMQ_URL)
 
-# Add debug statements
-print(f"REDIS_HOST: {REDIS_HOST}")
-print(f"REDIS_PORT: {REDIS_PORT}")
-print(f"REDIS_PASSWORD: {'***' if REDIS_PASSWORD else 'None'}")
+database = Lazy(lambda: MongoClient(MONGO_URI)[MONGO_DB])
 
-# Test Redis connection
-try:
-    redis_client.ping()  # Check if the connection works
-    print("Redis connection successful.")
-except redis.AuthenticationError:
-    print("Redis authentication failed. Check your password.")
-except Exception as e:
-    print(f"REDIS connection error: {e}")
+
+def ping_redis():
+    log.info("Redis at %s:%s, password %s", REDIS_HOST, REDIS_PORT, "***" if REDIS_PASSWORD else "None")
+    try:
+        redis_client.ping()  # Check if the connection works
+        log.info("Redis connection successful.")
+    except redis.AuthenticationError:
+        log.error("Redis authentication failed. Check your password.")
+        raise
 
 
 def redis_get_next(pres_id):
@@ -69,36 +90,90 @@ def redis_add_pending_clip(pres_id, clip_id):
 
 
 def redis_get_job_data(pres_id, clip_id):
-    return json.loads(redis_client.hget(pres_id, clip_id))
-
-
-def redis_get_slideurl(pres_id, clip_id):
-    d = redis_get_job_data(pres_id, clip_id)
-    return d["SLIDE_URL"]
+    return unpack_clip(redis_bytes.hget(pres_id, clip_id))
 
 
-def redis_get_transcript(pres_id, clip_id):
-    d = redis_get_job_data(pres_id, clip_id)
-    return d["TRANSCRIPT"]
+def redis_park_job(job_data):
+    # Only out-of-order clips are written to the hash, in-order ones arrive whole
+    redis_bytes.hset(job_data["PRESENTATION_ID"], job_data["CLIP_ID"], pack_clip(job_data))
 
 
 def redis_get_threadid(pres_id):
     return redis_client.hget(pres_id, "thread_id")
 
 
-def redis_get_final_status(pres_id, clip_id):
-    d = redis_get_job_data(pres_id, clip_id)
-    return d["IS_END"]
+SILENT_FEEDBACK = (
+    "**No speech detected**\n"
+    "- We couldn't hear anything in this clip, so there is no feedback for this slide.\n"
+    "- If you meant to present here, check that your microphone is enabled and try recording the slide again."
+)
+
+
+def create_run(assistant_id, thread_id):
+    guard = get_guard("openai:runs")
+    raw = guard.call(
+        OPENAI_CLIENT.beta.threads.runs.with_raw_response.create,
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+    )
+    # Keep the shared bucket in step with what OpenAI says is left
+    guard.update_from_headers(raw.headers)
+    return raw.parse()
+
+
+def retrieve_run(thread_id, run_id):
+    return get_guard("openai:status").call(
+        OPENAI_CLIENT.beta.threads.runs.retrieve, thread_id=thread_id, run_id=run_id
+    )
+
 
+def run_assistant(assistant_id, thread_id):
+    """
+    Create a run and poll it to completion.
+    A thread can only have one active run, so instead of a parallel
+    duplicate the hedge cancels a run that is past the p95 threshold and
+    reissues it, within the hedger's budget.
+    """
+    hedger = HEDGERS["openai_run"]
+    hedger.record_call()
+    start = time.monotonic()
+    deadline = start + hedger.threshold()
+    hedged = False
+    run = create_run(assistant_id, thread_id)
 
-def redis_get_userid(pres_id, clip_id):
-    d = redis_get_job_data(pres_id, clip_id)
-    return d["USER_ID"]
+    while run.status != "completed":
+        if run.status in ("failed", "expired", "cancelled"):
+            charge_run(run)
+            raise RuntimeError(f"Run {run.id} ended with status {run.status}")
+        if not hedged and time.monotonic() > deadline and hedger.try_acquire():
+            log.info("[hedge] run %s past %.1fs, reissuing", run.id, deadline - start)
+            hedged = True
+            get_guard("openai:runs").call(
+                OPENAI_CLIENT.beta.threads.runs.cancel, thread_id=thread_id, run_id=run.id
+            )
+            while run.status not in ("completed", "cancelled", "failed", "expired"):
+                POLLS.labels(loop="openai_run").inc()
+                time.sleep(0.5)
+                run = retrieve_run(thread_id, run.id)
+            if run.status == "completed":
+                break
+            charge_run(run)
+            run = create_run(assistant_id, thread_id)
+            continue
+        log.debug("Run %s %s", run.id, run.status, extra=sample(f"run:{run.id}"))
+        POLLS.labels(loop="openai_run").inc()
+        time.sleep(1.5)
+        run = retrieve_run(thread_id, run.id)
 
+    charge_run(run)
+    hedger.observe(time.monotonic() - start)
+    return run
 
-def redis_get_emotions(pres_id, clip_id):
-    d = redis_get_job_data(pres_id, clip_id)
-    return d["EMOTIONS"]
+
+def charge_run(run):
+    """Tokens are billed for every run that ran, including cancelled hedges."""
+    if run.usage is not None:
+        add_usage(prompt_tokens=run.usage.prompt_tokens, completion_tokens=run.usage.completion_tokens)
 
 
 def get_clip_feedback(index, slide, transcript, assistant_id, thread_id):
@@ -108,76 +183,53 @@ def get_clip_feedback(index, slide, transcript, assistant_id, thread_id):
     Send thread to assistant
     Return feedback
     """
-    print("Starting")
-    text_input = (
-        "Transcript "
-        + str(index)
-        + ": "
-        + transcript
-        + "\nNow evaluate this segment according the criteria, using the presentation description, audience description, and tone description given earlier. Format your response as bullet points under the relevant headers. Afterwards, list suggestions for improvements if there are any (be as specific as possible). Finally, give an overall score out of 10. Give your entire response in markdown format (but keep as bullet points under each main criteria, not subheaders)."
-    )
-    content = [
-        {"type": "text", "text": text_input},
-        {"type": "image_url", "image_url": {"url": slide}},
-    ]
-    msg = OPENAI_CLIENT.beta.threads.messages.create(
+    content = clip_content(index, transcript, slide)
+    # Image tokens are part of prompt_tokens, count slides to tell them apart
+    add_usage(images=1)
+    msg = get_guard("openai:threads").call(
+        OPENAI_CLIENT.beta.threads.messages.create,
         thread_id, role="user", content=content
     )
-    thread_messages = OPENAI_CLIENT.beta.threads.messages.list(thread_id)
+    thread_messages = get_guard("openai:status").call(OPENAI_CLIENT.beta.threads.messages.list, thread_id)
     msg_sz = len(thread_messages.data)
-    run = OPENAI_CLIENT.beta.threads.runs.create(
-        thread_id=thread_id, assistant_id=assistant_id
-    )
+    run_assistant(assistant_id, thread_id)
 
-    while run.status != "completed":
-        print(run.status)
-        time.sleep(1.5)
-        run = OPENAI_CLIENT.beta.threads.runs.retrieve(
-            thread_id=thread_id, run_id=run.id
-        )
-
-    thread_messages = OPENAI_CLIENT.beta.threads.messages.list(thread_id)
+    thread_messages = get_guard("openai:status").call(OPENAI_CLIENT.beta.threads.messages.list, thread_id)
 
     return thread_messages.data[0].content[0].text.value
 
 
 def get_final_summary(assistant_id, thread_id):
-    text_input = "The presentation is over. Give a score out of 10 for the entire presentation. Keeping in mind the presentation description, audience description, and tone description, summarize all your feedback, emphasizing the most important suggestions for improvement and if the presentation was effective in achieving its goal. Keep in mind the visuals of slides, accuracy of content, if it concluded in a satisfying manner, the overall narrative flow and how all the segments fit together. Give your entire response in markdown format"
-    content = [{"type": "text", "text": text_input}]
-    msg = OPENAI_CLIENT.beta.threads.messages.create(
+    content = [{"type": "text", "text": SUMMARY_PROMPT}]
+    msg = get_guard("openai:threads").call(
+        OPENAI_CLIENT.beta.threads.messages.create,
         thread_id, role="user", content=content
     )
-    thread_messages = OPENAI_CLIENT.beta.threads.messages.list(thread_id)
+    thread_messages = get_guard("openai:status").call(OPENAI_CLIENT.beta.threads.messages.list, thread_id)
     msg_sz = len(thread_messages.data)
-    run = OPENAI_CLIENT.beta.threads.runs.create(
-        thread_id=thread_id, assistant_id=assistant_id
-    )
+    run_assistant(assistant_id, thread_id)
 
-    while run.status != "completed":
-        print(run.status)
-        time.sleep(1.5)
-        run = OPENAI_CLIENT.beta.threads.runs.retrieve(
-            thread_id=thread_id, run_id=run.id
-        )
-
-    thread_messages = OPENAI_CLIENT.beta.threads.messages.list(thread_id)
+    thread_messages = get_guard("openai:status").call(OPENAI_CLIENT.beta.threads.messages.list, thread_id)
 
     return thread_messages.data[0].content[0].text.value
 
 
-def update_db(user_id, pres_id, clip_id, feedback):
+def update_db(user_id, pres_id, clip_id, feedback, job_data):
     collection = database["users"]
 
-    job_data = redis_get_job_data(pres_id, clip_id)
-
     emotions = job_data["EMOTIONS"]
     score = job_data["SCORE"]
+    timeline = job_data.get("TIMELINE", "")
     slideURL = job_data["SLIDE_URL"]
     videoURL = job_data["VIDEO_URL"]
 
+    # The transcript is kept so reprocess.py can regenerate the feedback
     collection.update_one(
         {"googleId": user_id, "presentations._id": pres_id},
-        {"$set": {f"presentations.$.clips.{clip_id}.feedback.text": feedback}},
+        {"$set": {
+            f"presentations.$.clips.{clip_id}.feedback.text": feedback,
+            f"presentations.$.clips.{clip_id}.transcript": job_data.get("TRANSCRIPT", ""),
+        }},
     )
     collection.update_one(
         {"googleId": user_id, "presentations._id": pres_id},
@@ -187,6 +239,10 @@ def update_db(user_id, pres_id, clip_id, feedback):
         {"googleId": user_id, "presentations._id": pres_id},
         {"$set": {f"presentations.$.clips.{clip_id}.feedback.emotion": emotions}},
     )
+    collection.update_one(
+        {"googleId": user_id, "presentations._id": pres_id},
+        {"$set": {f"presentations.$.clips.{clip_id}.feedback.timeline": timeline}},
+    )
     collection.update_one(
         {"googleId": user_id, "presentations._id": pres_id},
         {"$set": {f"presentations.$.clips.{clip_id}.slideUUID": slideURL}},
@@ -224,28 +280,49 @@ def update_db_summary(user_id, pres_id, summary):
     )
 
 
-def process_gpt_job(job_params):
-    clip_id = job_params["CLIP_ID"]
-    pres_id = job_params["PRESENTATION_ID"]
-    slide_url = redis_get_slideurl(pres_id, clip_id)
-    transcript = redis_get_transcript(pres_id, clip_id)
+def process_gpt_job(job_data):
+    # Drained clips run under the clip that released them, relabel
+    with bind(clip=job_data["CLIP_ID"]):
+        with recording(redis_client, "worker2", job_data["PRESENTATION_ID"], job_data["USER_ID"], job_data["CLIP_ID"]):
+            return _process_gpt_job(job_data)
+
+
+def _process_gpt_job(job_data):
+    clip_id = job_data["CLIP_ID"]
+    pres_id = job_data["PRESENTATION_ID"]
+    slide_url = job_data["SLIDE_URL"]
+    transcript = job_data["TRANSCRIPT"]
     thread_id = redis_get_threadid(pres_id)
-    user_id = redis_get_userid(pres_id, clip_id)
+    user_id = job_data["USER_ID"]
+    is_end = job_data["IS_END"]
+
+    # Redeliveries skip the GPT runs and writes that already succeeded
+    attempt_id = f"{clip_id}_{job_data.get('CLIP_TIMESTAMP', '')}"
 
     if int(clip_id) == 0:
         update_db_pending(user_id, pres_id)
 
-    feedback = get_clip_feedback(
-        clip_id, slide_url, transcript, ASSISTANT_ID, thread_id
-    )
+    if job_data.get("SILENT", False):
+        # worker1's VAD found no speech, don't spend a GPT run on it
+        feedback = SILENT_FEEDBACK
+    else:
+        feedback = LEDGER.once(
+            pres_id, attempt_id, "feedback",
+            get_clip_feedback, clip_id, slide_url, transcript, ASSISTANT_ID, thread_id
+        )
 
-    if redis_get_final_status(pres_id, clip_id) != "false":
-        summary = get_final_summary(ASSISTANT_ID, thread_id)
-        update_db_summary(user_id, pres_id, summary)
+    if is_end != "false":
+        summary = LEDGER.once(
+            pres_id, attempt_id, "summary", get_final_summary, ASSISTANT_ID, thread_id
+        )
+        with span("mongo summary"), stage_timer("db_summary"):
+            update_db_summary(user_id, pres_id, summary)
 
-    update_db(user_id, pres_id, clip_id, feedback)
-    if redis_get_final_status(pres_id, clip_id) != "false":
-        update_db_done(redis_get_userid(pres_id, clip_id), pres_id)
+    LEDGER.once(pres_id, attempt_id, "db", update_db, user_id, pres_id, clip_id, feedback, job_data)
+    if is_end != "false":
+        with span("mongo done"), stage_timer("db_done"):
+            update_db_done(user_id, pres_id)
+        finish(redis_client, pres_id)
 
     return feedback
 
@@ -274,72 +351,94 @@ def setPendingDict(pres_id, pending_dict):
     redis_client.hset(pres_id, "pending", json.dumps(pending_dict))
 
 
-def process_message(body):
-    message = body.decode()
-    print(f" [x] Worker2 received: {message}")
+def end_head_of_line_wait(pres_id):
+    since = redis_client.hget(pres_id, "hol_since")
+    if since is not None:
+        HEAD_OF_LINE_WAIT.observe(time.time() - float(since))
+        annotate(**{"reorder.head_of_line_wait_s": time.time() - float(since)})
+        redis_client.hdel(pres_id, "hol_since")
 
-    job_params = json.loads(message)
-    clip_id = job_params["CLIP_ID"]
-    pres_id = job_params["PRESENTATION_ID"]
-    print(redis_client)
 
-    if clip_id == redis_client.hget(pres_id, "next"):
+def process_message(body):
+    version, job_data = decode_job(body, redis_client)
+    if version == 0:
+        # Pointer published before the message schema, the clip is in the hash
+        job_data = redis_get_job_data(job_data["PRESENTATION_ID"], job_data["CLIP_ID"])
+    with bind(pres=job_data["PRESENTATION_ID"], clip=job_data["CLIP_ID"]):
+        handle_job(job_data)
+
+
+def handle_job(job_data):
+    """Run a clip's feedback in presentation order, or park it until its turn."""
+    clip_id = job_data["CLIP_ID"]
+    pres_id = job_data["PRESENTATION_ID"]
+    log.info("Received clip")
+    touch(redis_client, pres_id)
+
+    next_clip = redis_client.hget(pres_id, "next")
+    if next_clip is not None and int(clip_id) < int(next_clip):
+        # Redelivery of a clip we already finished
+        log.info("Skipping duplicate")
+        return
+
+    if clip_id == next_clip:
         # Process job and then all jobs in pending we can now do, if there are any
-        process_gpt_job(job_params)
+        end_head_of_line_wait(pres_id)
+        process_gpt_job(job_data)
         nextClip = int(clip_id) + 1
-        print(f" [x] Worker2 finsihed GPT: {message}")
+        log.info("Finished GPT")
 
         while str(nextClip) in getPendingDict(pres_id):
             # process(database[presID][nextClip])
-            process_gpt_job({"PRESENTATION_ID": pres_id, "CLIP_ID": nextClip})
+            POLLS.labels(loop="pending_drain").inc()
+            process_gpt_job(redis_get_job_data(pres_id, str(nextClip)))
 
             # delete database[presID][nextClip] for garbage collection
             removePendingClip(pres_id, str(nextClip))
+            redis_client.hdel(pres_id, str(nextClip))
             nextClip += 1
 
         # database[presID][”waitingFor”] = nextClip
         redis_client.hset(pres_id, "next", str(nextClip))
+        depth = len(getPendingDict(pres_id))
+        if depth:
+            # Still a gap, waiting on the new head now
+            redis_client.hsetnx(pres_id, "hol_since", time.time())
+        set_reorder_depth(pres_id, depth)
 
     else:
         # Add job to pending database
         # database[job.presNumber][job.clipNumber] = job
-        print(f" [x] Worker2 received: {message}")
+        log.info("Parking, waiting for clip %s", next_clip or "0")
+        annotate(**{"reorder.parked": True, "reorder.waiting_for": next_clip or "0"})
+        redis_park_job(job_data)
         addPendingClip(pres_id, clip_id)
+        redis_client.hsetnx(pres_id, "hol_since", time.time())
+        set_reorder_depth(pres_id, len(getPendingDict(pres_id)))
 
 
-def callback(ch, method, properties, body):
-    try:
-        process_message(body)
-        ch.basic_ack(delivery_tag=method.delivery_tag)
-
-    except Exception as e:
-        print(f"Error processing message: {e}")
-        # Optionally, send to a dead-letter queue or retry
+def start_worker():
+    setup_logging("worker2")
+    if TRANSPORT == "rabbitmq" and not RABBITMQ_URL:
+        log.error("RABBITMQ_URL is not defined in the environment variables.")
+        exit(1)
+    start_metrics()
+    register("redis", redis_client.ping)
+    register("mongo", lambda: database.client.admin.command("ping"))
+    start_health()
+    warm_up({
+        "redis": ping_redis,
+        "mongo": lambda: database.client.admin.command("ping"),
+        "openai": OPENAI_CLIENT.get,
+    }, wait=False)
+    setup_tracing("worker2")
+    start_sweeper(redis_client)
+    start_rollup(redis_client, database[USAGE_COLLECTION])
+    transport.consume(
+        QUEUE_NAME, process_message, "Worker2",
+        concurrency=WORKER2_CONCURRENCY, prefetch=WORKER2_PREFETCH, fair_key=fair_key,
+    )
 
 
-def start_worker():
-    while True:
-        try:
-            params = pika.URLParameters(RABBITMQ_URL)
-            connection = pika.BlockingConnection(params)
-            channel = connection.channel()
-            channel.queue_declare(queue=QUEUE_NAME, durable=True)
-            print(
-                f" [*] Worker2 waiting for messages in {QUEUE_NAME}. To exit press CTRL+C"
-            )
-            channel.basic_qos(prefetch_count=1)
-            # calls callback when we get the message
-            channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
-            print(f"Connection error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
-        except KeyboardInterrupt:
-            print("Worker2 stopped.")
-            break
-        except Exception as e:
-            print(f"Unexpected error: {e}. Retrying in 5 seconds...")
-            time.sleep(5)
-
-
-start_worker()
+if __name__ == "__main__":
+    start_worker()